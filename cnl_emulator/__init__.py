@@ -0,0 +1,8 @@
+from .clock import VirtualClock, RealClock
+from .config import EmulatorConfig
+from .pump_emulator import PumpEmulator
+from .contour_next_link_emulator import ContourNextLinkEmulator
+from .emulated_transport import EmulatedTransport
+
+__all__ = ["VirtualClock", "RealClock", "EmulatorConfig", "PumpEmulator", "ContourNextLinkEmulator",
+           "EmulatedTransport"]
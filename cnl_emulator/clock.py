@@ -0,0 +1,40 @@
+import time
+
+
+class VirtualClock(object):
+    """Simulated time in seconds.
+
+    Waiting for a scheduled response skips ahead instead of sleeping. Idle
+    time, e.g. while the driver decodes data or runs into a timeout, still
+    passes in real time, so it shows up in the simulated durations as well.
+    """
+
+    def __init__(self):
+        self._now = 0.0
+
+    def now(self):
+        return self._now
+
+    def wait(self, condition, timestamp, idle):
+        """Wait on condition until timestamp (None: until notified), condition must be held"""
+        if not idle:
+            self._now = max(self._now, timestamp)
+            return
+
+        start = time.monotonic()
+        condition.wait(None if timestamp is None else max(0.0, timestamp - self._now))
+        self._now += time.monotonic() - start
+
+
+class RealClock(object):
+    """Wall clock time in seconds since creation."""
+
+    def __init__(self):
+        self._start = time.monotonic()
+
+    def now(self):
+        return time.monotonic() - self._start
+
+    def wait(self, condition, timestamp, idle):
+        """Wait on condition until timestamp (None: until notified), condition must be held"""
+        condition.wait(None if timestamp is None else max(0.0, timestamp - self.now()))
@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class EmulatorConfig:
+    pump_channel: int = 0x14
+    usb_latency_ms: float = 1
+    radio_latency_ms: float = 20
+    packet_interval_ms: float = 5
+    drop_rate: float = 0.0
+    resend_rate: float = 0.0
+    resend_delay_ms: float = 40
+    noisy_rate: float = 0.0
+    packet_drop_rate: float = 0.0
+    truncated_packet_rate: float = 0.0
+    history_events: int = 50
+    history_interval_s: int = 300
+    blocks_per_segment: int = 4
+    packet_size: int = 160
+    seed: int = 0
@@ -0,0 +1,248 @@
+import heapq
+import logging
+import random
+import struct
+import threading
+
+import astm
+
+from cnl_emulator.clock import VirtualClock
+from cnl_emulator.config import EmulatorConfig
+from cnl_emulator.pump_emulator import PumpEmulator
+from read_minimed_next24 import ascii, BayerBinaryMessage, COM_D_COMMAND, MedtronicMessage, MedtronicSession, \
+    ChecksumException
+
+logger = logging.getLogger('app')
+
+
+class ContourNextLinkEmulator(object):
+    """In-process emulation of a Contour Next Link paired with a 600-series pump.
+
+    Reports written by the driver are reassembled into messages and answered
+    with the same framing a real stick uses: ASTM and control characters
+    before passthrough, Bayer binary messages afterwards, with AES-CFB
+    encrypted pump payloads inside the 0x80 responses. Responses become
+    readable at the time the configured latencies put them, so a VirtualClock
+    runs a full poll in milliseconds while still reporting realistic durations.
+    """
+    USB_BLOCKSIZE = 64
+    MAGIC_HEADER = b'ABC'
+
+    STICK_SERIAL = '6213-1234567'
+    LINK_MAC = 0x0023F745EE000001
+    LINK_KEY = bytes(range(0x10, 0x20))
+
+    def __init__(self, config=None, clock=None):
+        self.config = config if config is not None else EmulatorConfig()
+        self.clock = clock if clock is not None else VirtualClock()
+        self.random = random.Random(self.config.seed)
+        self.pump = PumpEmulator(self.config, self.clock)
+
+        self.session = MedtronicSession()
+        self.session.KEY = self.LINK_KEY
+        self.session.linkMAC = self.LINK_MAC
+        self.session.pumpMAC = self.pump.PUMP_MAC
+        self.session.radioChannel = self.config.pump_channel
+
+        self.stats = {"requests": 0, "responses": 0, "dropped": 0, "resent": 0, "noisy": 0, "dropped_packets": 0,
+                      "truncated_packets": 0, "resend_requests": 0}
+        self._condition = threading.Condition()
+        self._outgoing = []
+        self._order = 0
+        self.reset()
+
+    def reset(self):
+        with self._condition:
+            self._incoming = bytearray()
+            self._outgoing = []
+            self._condition.notify_all()
+
+    # --- USB side, used by EmulatedTransport
+
+    def read(self, timeout_ms=None):
+        with self._condition:
+            deadline = None if timeout_ms is None else self.clock.now() + timeout_ms / 1000.0
+            while True:
+                now = self.clock.now()
+                if self._outgoing and self._outgoing[0][0] <= now:
+                    return heapq.heappop(self._outgoing)[2]
+                if deadline is not None and now >= deadline:
+                    return b''
+
+                if self._outgoing and (deadline is None or self._outgoing[0][0] < deadline):
+                    self.clock.wait(self._condition, self._outgoing[0][0], idle=False)
+                else:
+                    self.clock.wait(self._condition, deadline, idle=True)
+
+    def write(self, report):
+        with self._condition:
+            size = report[3]
+            if bytes(report[0:3]) != self.MAGIC_HEADER:
+                logger.error("CNL emulator: invalid USB report")
+                return
+            self._incoming += report[4:4 + size]
+
+            message = self._incoming
+            if self.is_bayer_message(message):
+                if len(message) < 33 + struct.unpack('<I', bytes(message[28:32]))[0]:
+                    return
+            elif size == self.USB_BLOCKSIZE - 4:
+                return
+
+            self._incoming = bytearray()
+            self.handle_message(bytes(message))
+            self._condition.notify_all()
+
+    @staticmethod
+    def is_bayer_message(message):
+        # 'Q|' starts with 0x51 as well, but every Bayer message has a full 33 byte envelope
+        return len(message) >= 33 and message[0] == 0x51
+
+    def send(self, message, delay):
+        """Queue a message as USB reports, readable after delay seconds. The condition must be held."""
+        available_at = self.clock.now() + delay
+        chunks = [message[i:i + self.USB_BLOCKSIZE - 4] for i in range(0, len(message), self.USB_BLOCKSIZE - 4)]
+        # The driver only knows the size of 0x80 and 0x81 messages up front, all others end with a short report
+        if len(message) % (self.USB_BLOCKSIZE - 4) == 0 and not (self.is_bayer_message(message) and message[18] in (0x80, 0x81)):
+            chunks.append(b'')
+        for chunk in chunks:
+            report = struct.pack('>3sB', self.MAGIC_HEADER, len(chunk)) + chunk
+            heapq.heappush(self._outgoing, (available_at, self._order, report.ljust(self.USB_BLOCKSIZE, b'\x00')))
+            self._order += 1
+
+    # --- CNL side
+
+    def handle_message(self, message):
+        usb_delay = self.config.usb_latency_ms / 1000.0
+
+        if self.is_bayer_message(message):
+            self.handle_bayer_message(BayerBinaryMessage.decode(message))
+        elif message == struct.pack('>B', 0x58):
+            self.send(self.device_info(), usb_delay)
+            self.send(struct.pack('>B', ascii['ENQ']), usb_delay)
+        elif message == struct.pack('>B', ascii['NAK']):
+            self.send(struct.pack('>B', ascii['EOT']), usb_delay)
+        elif message == struct.pack('>B', ascii['ENQ']):
+            self.send(struct.pack('>B', ascii['ACK']), usb_delay)
+        elif message == struct.pack('>B', ascii['EOT']):
+            self.send(struct.pack('>B', ascii['ENQ']), usb_delay)
+        elif message in (b'W|', b'Q|', b'1|', b'0|'):
+            self.send(struct.pack('>B', ascii['ACK']), usb_delay)
+        else:
+            logger.warning("CNL emulator: unhandled message {0}".format(message))
+
+    def device_info(self):
+        body = ('1H|\\^&||Xd0lAi|Bayer7350^01.14\\01.04\\09.02\\1A3E^{0}^0000^0000-0000-0000-0^0|A|0|||||||P|1|'
+                '20170101000000\r').format(self.STICK_SERIAL).encode('ascii') + struct.pack('>B', ascii['ETB'])
+        return struct.pack('>B', ascii['STX']) + body + astm.codec.make_checksum(body) + b'\r\n'
+
+    def bayer_message(self, operation, payload=None):
+        return BayerBinaryMessage(operation, self.session, payload).encode()
+
+    def handle_bayer_message(self, request):
+        usb_delay = self.config.usb_latency_ms / 1000.0
+        operation = request.linkDeviceOperation
+
+        if operation in (0x10, 0x11):  # open / close connection
+            self.send(self.bayer_message(operation), usb_delay)
+        elif operation == 0x14:  # read info
+            self.send(self.bayer_message(0x14, struct.pack('>QQ', self.LINK_MAC, self.pump.PUMP_MAC)), usb_delay)
+        elif operation == 0x16:  # read link key
+            self.send(self.bayer_message(0x16, self.packed_link_key()), usb_delay)
+        elif operation == 0x12:  # send message
+            self.handle_send_message(request.payload)
+        else:
+            logger.warning("CNL emulator: unhandled link device operation 0x{0:x}".format(operation))
+
+    def packed_link_key(self):
+        # Inverse of ReadLinkKeyResponseMessage.linkKey: plain bytes, each followed by a zero flag byte and a filler
+        packed = bytearray(55)
+        pos = ord(self.STICK_SERIAL[-1:]) & 7
+        for value in self.LINK_KEY:
+            packed[pos] = value
+            pos += 3
+        return bytes(packed)
+
+    def handle_send_message(self, payload):
+        try:
+            message = MedtronicMessage.decode(payload, self.session)
+        except ChecksumException:
+            logger.warning("CNL emulator: dropping send message with invalid checksum")
+            return
+
+        self.stats["requests"] += 1
+        command_action = message.envelope[0]
+        sequence = message.payload[8] if command_action == 0x05 else 0
+
+        state = 0x02
+        if self.random.random() < self.config.noisy_rate:
+            self.stats["noisy"] += 1
+            state = 0x04
+        self.send(self.bayer_message(0x81, self.medtronic_message(
+            struct.pack('>BBBBBBBBBBB', 0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0x03, 0x00, 0x01, sequence, state))),
+            self.config.usb_latency_ms / 1000.0)
+
+        if command_action == 0x03:
+            self.handle_channel_negotiation(message.payload)
+        elif command_action == 0x05:
+            self.handle_pump_request(message.payload)
+
+    def medtronic_message(self, payload):
+        return MedtronicMessage(0x55, self.session, payload).encode()
+
+    def handle_channel_negotiation(self, payload):
+        channel = payload[1]
+        pump_mac = struct.unpack('<Q', payload[18:26])[0]
+        delay = self.config.radio_latency_ms / 1000.0
+
+        if channel != self.config.pump_channel or pump_mac != self.pump.PUMP_MAC:
+            # 55 0B 00 00 20 00 00 00 03 00 00 (no connect)
+            self.send(self.bayer_message(0x80, self.medtronic_message(
+                bytes([0x00, 0x00, 0x20, 0x00, 0x00, 0x00, 0x03, 0x00, 0x00]))), delay)
+            return
+
+        # The IV of the pump messages depends on the channel
+        self.session.radioChannel = channel
+        rssi = 0x3F
+        connect = struct.pack('>BB5sB', 0x00, 0x04, b'\x00' * 5, 0x02)
+        connect += struct.pack('<QB5sBBB', self.pump.PUMP_MAC, 0x82, b'\x00' * 5, 0x07, 0x00, rssi)
+        connect += struct.pack('<QB7sB', self.LINK_MAC, 0x42, b'\x00' * 7, channel)
+        self.send(self.bayer_message(0x80, self.medtronic_message(connect)), delay)
+
+    def handle_pump_request(self, payload):
+        encrypted_size = payload[10]
+        clear = MedtronicMessage(session=self.session).decrypt(bytes(payload[11:11 + encrypted_size]))
+        if MedtronicMessage.calculateCcitt(clear[:-2]) != struct.unpack('>H', clear[-2:])[0]:
+            logger.warning("CNL emulator: dropping pump request with invalid checksum")
+            return
+
+        sequence, message_type = struct.unpack('>BH', clear[0:3])
+        if message_type == COM_D_COMMAND.MULTIPACKET_RESEND_PACKETS:
+            self.stats["resend_requests"] += 1
+        for delay, response_type, data in self.pump.handle_request(message_type, clear[3:-2]):
+            if self.random.random() < self.config.drop_rate:
+                self.stats["dropped"] += 1
+                continue
+            if response_type == COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION:
+                # Packets of a history segment lost or cut short on the radio
+                if self.config.packet_drop_rate and self.random.random() < self.config.packet_drop_rate:
+                    self.stats["dropped_packets"] += 1
+                    continue
+                if self.config.truncated_packet_rate and self.random.random() < self.config.truncated_packet_rate:
+                    self.stats["truncated_packets"] += 1
+                    data = data[:-1]
+            message = self.bayer_message(0x80, self.pump_response(sequence, response_type, data))
+            self.send(message, delay)
+            self.stats["responses"] += 1
+            if self.random.random() < self.config.resend_rate:
+                self.stats["resent"] += 1
+                self.send(message, delay + self.config.resend_delay_ms / 1000.0)
+
+    def pump_response(self, sequence, message_type, data):
+        clear = struct.pack('>BH', sequence, message_type) + data
+        clear += struct.pack('>H', MedtronicMessage.calculateCcitt(clear))
+        encrypted = MedtronicMessage(session=self.session).encrypt(clear)
+
+        # 22 byte response envelope; byte 1 must not look like a 'lost connection' marker
+        envelope = struct.pack('<BBQBBB9s', 0x00, 0x04, self.pump.PUMP_MAC, 0x00, 0x00, 0x11, b'\x00' * 9)
+        return self.medtronic_message(envelope + encrypted)
@@ -0,0 +1,38 @@
+from cnl_emulator.contour_next_link_emulator import ContourNextLinkEmulator
+from usb_transport import Transport
+
+
+class EmulatedTransport(Transport):
+    """Connects the driver to a ContourNextLinkEmulator instead of USB.
+
+    Opening the transport resets the emulated stick, like plugging it in
+    again, while the pump state and the clock are kept across sessions.
+    """
+
+    def __init__(self, emulator=None):
+        self.emulator = emulator if emulator is not None else ContourNextLinkEmulator()
+
+    @property
+    def manufacturer(self):
+        return "Emulated Ascensia Diabetes Care"
+
+    @property
+    def product(self):
+        return "Emulated Contour Next Link 2.4"
+
+    @property
+    def serial(self):
+        return self.emulator.STICK_SERIAL
+
+    def open(self):
+        self.emulator.reset()
+
+    def read(self, size, timeout=None):
+        return self.emulator.read(timeout)[:size]
+
+    def write(self, data):
+        self.emulator.write(bytes(data))
+        return len(data)
+
+    def close(self):
+        pass
@@ -0,0 +1,161 @@
+import datetime
+import struct
+
+from helpers import DateTimeHelper
+from pump_history_parser import NGPHistoryEvent
+from read_minimed_next24 import COM_D_COMMAND, HISTORY_DATA_TYPE, MedtronicMessage
+
+
+class PumpEmulator(object):
+    """Answers decrypted COM_D requests like a 600-series pump.
+
+    handle_request returns a list of (delay in seconds, message type, data)
+    responses, where data is everything after the sequence number and the
+    message type in the decrypted response payload.
+    """
+    PUMP_MAC = 0x0023F70000123456
+    OFFSET = -1592387759
+
+    HEADER_SIZE = 12
+    BLOCK_SIZE = 2048
+
+    # Captured READ_PUMP_STATUS_RESPONSE, without sequence number and message type
+    STATUS_TEMPLATE = bytes.fromhex(
+        '5000000000000000000000000000002328278BDD283A00010000109A0000000000000000003A9819001C2ED819000000232800E2'
+        '8675E6D5A115F6670020100002D529FF350000FF00688675E6F9A115F667000000000008C8000008C8')
+    STATUS_SENSOR_TIMESTAMP = 52
+
+    def __init__(self, config, clock):
+        self.config = config
+        self.clock = clock
+        self.start = datetime.datetime.now()
+        self._segments = []
+        self._segment = None
+
+    @property
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.clock.now())
+
+    @property
+    def rtc(self):
+        return DateTimeHelper.rtcFromDate(self.now, self.OFFSET)
+
+    def encode_datetime(self, rtc):
+        return (rtc << 32) | (self.OFFSET & 0xffffffff)
+
+    def handle_request(self, message_type, payload):
+        latency = self.config.radio_latency_ms / 1000.0
+
+        if message_type == COM_D_COMMAND.TIME_REQUEST:
+            return [(latency, COM_D_COMMAND.TIME_RESPONSE,
+                     struct.pack('>BQ', 0x01, self.encode_datetime(self.rtc)))]
+
+        if message_type == COM_D_COMMAND.READ_PUMP_STATUS_REQUEST:
+            status = bytearray(self.STATUS_TEMPLATE)
+            struct.pack_into('>Q', status, self.STATUS_SENSOR_TIMESTAMP, self.encode_datetime(self.rtc - 60))
+            return [(latency, COM_D_COMMAND.READ_PUMP_STATUS_RESPONSE, bytes(status))]
+
+        if message_type == COM_D_COMMAND.READ_HISTORY_INFO_REQUEST:
+            history_type, _, from_rtc, to_rtc, _ = struct.unpack('>BBIIH', payload[0:12])
+            segments = self.history_segments(history_type, from_rtc)
+            size = sum(len(segment) - self.HEADER_SIZE for segment in segments)
+            return [(latency, COM_D_COMMAND.READ_HISTORY_INFO_RESPONSE,
+                     struct.pack('>BIQQ', 0x00, size, self.encode_datetime(from_rtc),
+                                 self.encode_datetime(min(to_rtc, self.rtc))))]
+
+        if message_type == COM_D_COMMAND.READ_HISTORY_REQUEST:
+            history_type, _, from_rtc, to_rtc, _ = struct.unpack('>BBIIH', payload[0:12])
+            self._segments = self.history_segments(history_type, from_rtc)
+            return self.next_segment(latency)
+
+        if message_type == COM_D_COMMAND.ACK_MULTIPACKET_COMMAND:
+            segment_command = struct.unpack('>H', payload[0:2])[0]
+            if segment_command == COM_D_COMMAND.INITIATE_MULTIPACKET_TRANSFER:
+                return self.segment_packets(latency)
+            if segment_command == COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION:
+                return self.next_segment(latency)
+
+        if message_type == COM_D_COMMAND.MULTIPACKET_RESEND_PACKETS:
+            first, count = struct.unpack('>HH', payload[0:4])
+            return self.segment_packets(latency, first, count)
+
+        # HIGH_SPEED_MODE_COMMAND and everything unknown is only acknowledged by the CNL
+        return []
+
+    def next_segment(self, latency):
+        if not self._segments:
+            self._segment = None
+            return [(latency, COM_D_COMMAND.END_HISTORY_TRANSMISSION, b'')]
+
+        self._segment = self._segments.pop(0)
+        packet_size = self.config.packet_size
+        packets = (len(self._segment) + packet_size - 1) // packet_size
+        last_packet_size = len(self._segment) - (packets - 1) * packet_size
+        return [(latency, COM_D_COMMAND.INITIATE_MULTIPACKET_TRANSFER,
+                 struct.pack('>IHHH', len(self._segment), packet_size, last_packet_size, packets))]
+
+    def segment_packets(self, latency, first=0, count=None):
+        """Packets of the current segment, all of them or count packets from number first on"""
+        responses = []
+        if self._segment is None:
+            return responses
+
+        packet_size = self.config.packet_size
+        interval = self.config.packet_interval_ms / 1000.0
+        packets = (len(self._segment) + packet_size - 1) // packet_size
+        last = packets if count is None else min(first + count, packets)
+        for index, number in enumerate(range(first, last)):
+            start = number * packet_size
+            responses.append((latency + index * interval, COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION,
+                              struct.pack('>H', number) + self._segment[start:start + packet_size]))
+        return responses
+
+    def history_events(self, history_type):
+        events = []
+        # The history ends when the emulator starts, so events keep their timestamp across sessions
+        now = DateTimeHelper.rtcFromDate(self.start, self.OFFSET)
+        for i in range(self.config.history_events - 1, -1, -1):
+            rtc = now - i * self.config.history_interval_s
+            header = struct.pack('>BBBQ', 0, 0x01, 0, self.encode_datetime(rtc))
+            if history_type == HISTORY_DATA_TYPE.SENSOR_DATA:
+                event = bytearray(header) + struct.pack('>BBH', 5, 1, 120 + i % 40)
+                # sg, isig, vctr, rate of change, sensor status, reading status
+                event += struct.pack('>BBHBhBB', 0x00, 100 + i % 80, 2500, 0x20, 10, 0, 0)
+                event[0] = NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED
+            else:
+                event = bytearray(header) + struct.pack('>BBI', 1, i % 48, 8500)
+                event[0] = NGPHistoryEvent.EVENT_TYPE.BASAL_SEGMENT_START
+            event[2] = len(event)
+            events.append((rtc, bytes(event)))
+        return events
+
+    def history_segments(self, history_type, from_rtc):
+        blocks = []
+        block = bytearray()
+        last_rtc = None
+        for rtc, event in self.history_events(history_type):
+            if len(block) + len(event) > self.BLOCK_SIZE - 4:
+                blocks.append((last_rtc, block))
+                block = bytearray()
+            block += event
+            last_rtc = rtc
+        if block:
+            blocks.append((last_rtc, block))
+
+        encoded_blocks = []
+        for last_rtc, block in blocks:
+            # The pump returns whole pages, so every block reaching into the requested range is sent
+            if last_rtc < from_rtc:
+                continue
+            encoded = bytearray(self.BLOCK_SIZE)
+            encoded[0:len(block)] = block
+            struct.pack_into('>HH', encoded, self.BLOCK_SIZE - 4, len(block), MedtronicMessage.calculateCcitt(block))
+            encoded_blocks.append(bytes(encoded))
+
+        segments = []
+        per_segment = self.config.blocks_per_segment
+        for start in range(0, len(encoded_blocks), per_segment):
+            history = b''.join(encoded_blocks[start:start + per_segment])
+            segments.append(struct.pack('>HBIIB', COM_D_COMMAND.UNMERGED_HISTORY_RESPONSE, history_type,
+                                        len(history), len(history), 0) + history)
+        return segments
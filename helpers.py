@@ -1,7 +1,14 @@
+import binascii
 import datetime
 import struct
 from dateutil import tz
 
+try:
+    import numpy
+except ImportError:
+    # Timestamps are decoded one by one without it
+    numpy = None
+
 
 class DateTimeHelper(object):
     # Base time is midnight 1st Jan 2000 (UTC)
@@ -13,7 +20,7 @@ class DateTimeHelper(object):
         return (pumpDateTime & 0xffffffff) - 0x100000000
 
     @staticmethod
-    def decodeDateTime(pumpDateTime, offset=None):
+    def decodeDateTime(pumpDateTime, offset=None, localTz=None):
         rtc = None
         if offset == None:
             rtc = (pumpDateTime >> 32) & 0xffffffff
@@ -25,9 +32,9 @@ class DateTimeHelper(object):
         # We do this, because the pump does not have a concept of timezone
         # For example, if baseTime + rtc + offset was 1463137668, this would be
         # Fri, 13 May 2016 21:07:48 UTC.
-        # However, the time the pump *means* is Fri, 13 May 2016 21:07:48 in our own timezone
-        offsetFromUTC = (datetime.datetime.utcnow() - datetime.datetime.now()).total_seconds()
-        epochTime = DateTimeHelper.baseTime + rtc + offset + offsetFromUTC
+        # However, the time the pump *means* is Fri, 13 May 2016 21:07:48 in our own timezone, with the offset
+        # from UTC of that time, not of now, so times before and after a DST change are both right
+        epochTime = DateTimeHelper.baseTime + rtc + offset
         if epochTime < 0:
             epochTime = 0
 
@@ -35,8 +42,7 @@ class DateTimeHelper(object):
 
         # Return a non-naive datetime in the local timezone
         # (so that we can convert to UTC for Nightscout later)
-        localTz = tz.tzlocal()
-        result = datetime.datetime.fromtimestamp(epochTime, localTz)
+        result = (DateTimeHelper.epoch + datetime.timedelta(seconds=epochTime)).replace(tzinfo=localTz or tz.tzlocal())
         # print ' ### DateTimeHelper.decodeDateTime {0:x} {1}'.format(pumpDateTime, result)
         return result
 
@@ -49,6 +55,57 @@ class DateTimeHelper(object):
         # print ' ### DateTimeHelper.rtcFromDate rtc:0x{0:x} {0} offset:0x{1:x} {1} epochTime:0x{2:x} {2}'.format(rtc, offset, epochTime)
         return rtc
 
+    @staticmethod
+    def dateFromRtc(rtc, offset):
+        # The naive local date rtcFromDate turns into rtc again
+        return DateTimeHelper.epoch + datetime.timedelta(seconds=rtc + offset + DateTimeHelper.baseTime)
+
+
+class DateTimeContext(object):
+    """Decodes the timestamps of one batch, e.g. of a history download
+
+    The local timezone is looked up once per context and every timestamp is
+    decoded once, as long as no more than CACHE_SIZE are kept. Arrays of
+    timestamps are decoded at once with NumPy.
+    """
+    CACHE_SIZE = 4096
+
+    def __init__(self, localTz=None):
+        self.localTz = localTz or tz.tzlocal()
+        self._dateTimes = {}
+
+    def decodeDateTime(self, pumpDateTime, offset=None):
+        key = pumpDateTime if offset is None else (pumpDateTime, offset)
+        dateTime = self._dateTimes.get(key)
+        if dateTime is None:
+            if len(self._dateTimes) >= self.CACHE_SIZE:
+                self._dateTimes.clear()
+            dateTime = self._dateTimes[key] = DateTimeHelper.decodeDateTime(pumpDateTime, offset, self.localTz)
+        return dateTime
+
+    def decodeDateTimes(self, pumpDateTimes, offsets=None):
+        """Datetimes in the local timezone of timestamps, or of RTC values and their offsets"""
+        if offsets is None:
+            return [self.decodeDateTime(pumpDateTime) for pumpDateTime in pumpDateTimes]
+        return [self.decodeDateTime(rtc, offset) for rtc, offset in zip(pumpDateTimes, offsets)]
+
+    def decodeDateTimes64(self, pumpDateTimes, offsets=None):
+        """Local times of a NumPy array of timestamps, or of RTC values and their offsets, as datetime64[s]
+
+        The times have no timezone, they are the local time as the pump
+        shows it, the same as decodeDateTime without the tzinfo.
+        """
+        if numpy is None:
+            raise RuntimeError("Decoding timestamps into arrays needs NumPy")
+        if offsets is None:
+            pumpDateTimes = numpy.asarray(pumpDateTimes, dtype=numpy.uint64)
+            rtcs = (pumpDateTimes >> numpy.uint64(32)).astype(numpy.int64)
+            offsets = (pumpDateTimes & numpy.uint64(0xffffffff)).astype(numpy.int64) - 0x100000000
+        else:
+            rtcs = numpy.asarray(pumpDateTimes, dtype=numpy.int64)
+            offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        return numpy.maximum(DateTimeHelper.baseTime + rtcs + offsets, 0).astype('M8[s]')
+
 
 class NumberHelper(object):
     @staticmethod
@@ -58,18 +115,70 @@ class NumberHelper(object):
 
 
 class BinaryDataDecoder(object):
+    """Big endian fields at an offset of bytes, bytearray or memoryview data, read without slicing it"""
+    _UINT64BE = struct.Struct('>Q').unpack_from
+    _UINT32BE = struct.Struct('>I').unpack_from
+    _UINT16BE = struct.Struct('>H').unpack_from
+    _BYTE = struct.Struct('>B').unpack_from
+    _layouts = {}
+
     @staticmethod
     def readUInt64BE(binData, offset):
-        return struct.unpack('>Q', binData[offset:offset + 8])[0]
+        return BinaryDataDecoder._UINT64BE(binData, offset)[0]
 
     @staticmethod
     def readUInt32BE(binData, offset):
-        return struct.unpack('>I', binData[offset:offset + 4])[0]
+        return BinaryDataDecoder._UINT32BE(binData, offset)[0]
 
     @staticmethod
     def readUInt16BE(binData, offset):
-        return struct.unpack('>H', binData[offset:offset + 2])[0]
+        return BinaryDataDecoder._UINT16BE(binData, offset)[0]
 
     @staticmethod
     def readByte(binData, offset):
-        return struct.unpack('>B', binData[offset:offset + 1])[0]
+        return BinaryDataDecoder._BYTE(binData, offset)[0]
+
+    @staticmethod
+    def layout(fmt):
+        """Precompiled struct for fmt, compiled once per format"""
+        layout = BinaryDataDecoder._layouts.get(fmt)
+        if layout is None:
+            layout = BinaryDataDecoder._layouts.setdefault(fmt, struct.Struct(fmt))
+        return layout
+
+    @staticmethod
+    def readFields(binData, offset, fmt):
+        """Several fields at once, e.g. readFields(eventData, 0x0B, '>BBH') for a byte, a byte and an uint16"""
+        return BinaryDataDecoder.layout(fmt).unpack_from(binData, offset)
+
+
+class CrcHelper(object):
+    """CRC-CCITT as used by the pump: XModem polynomial, initial value 0xFFFF
+
+    binascii.crc_hqx is table driven C code and reads any bytes-like object
+    in place, so memoryviews of messages and history blocks are checked
+    without copying them.
+    """
+    INITIAL_VALUE = 0xFFFF
+    BLOCK_TRAILER = struct.Struct('>HH')  # data size and checksum at the end of a history block
+
+    @staticmethod
+    def ccitt(data):
+        return binascii.crc_hqx(data, CrcHelper.INITIAL_VALUE)
+
+    @staticmethod
+    def verifyBlocks(payload, blockSize):
+        """Check all blocks of a decompressed history payload, return the indexes of the corrupt ones
+
+        Every block ends in the size of its data and the checksum over it.
+        """
+        view = memoryview(payload)
+        unpackTrailer = CrcHelper.BLOCK_TRAILER.unpack_from
+        crc = binascii.crc_hqx
+        badBlocks = []
+        for index, end in enumerate(range(blockSize, len(view) + 1, blockSize)):
+            size, checksum = unpackTrailer(view, end - 4)
+            start = end - blockSize
+            if size > blockSize - 4 or crc(view[start:start + size], CrcHelper.INITIAL_VALUE) != checksum:
+                badBlocks.append(index)
+        return badBlocks
@@ -0,0 +1,5 @@
+from .histogram import RollingHistogram
+from .instrumentation import Instrumentation, CycleSummary, Span, InstrumentedProxy
+from .instrumented_transport import InstrumentedTransport
+
+__all__ = ["RollingHistogram", "Instrumentation", "CycleSummary", "Span", "InstrumentedProxy", "InstrumentedTransport"]
@@ -0,0 +1,52 @@
+import collections
+import math
+
+
+class RollingHistogram(object):
+    """Distribution of the last `window` durations, in seconds"""
+    BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, window=100):
+        self._samples = collections.deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, duration):
+        self._samples.append(duration)
+
+    def percentile(self, percent):
+        """Nearest rank percentile, 0.0 without samples"""
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        rank = max(int(math.ceil(percent / 100.0 * len(samples))), 1)
+        return samples[rank - 1]
+
+    @property
+    def mean(self):
+        if not self._samples:
+            return 0.0
+        return sum(self._samples) / len(self._samples)
+
+    @property
+    def maximum(self):
+        return max(self._samples, default=0.0)
+
+    def buckets(self):
+        """Sample counts per upper bound in ms, None counting everything above the last bound"""
+        counts = collections.OrderedDict((bound, 0) for bound in self.BUCKETS_MS + (None,))
+        for duration in self._samples:
+            milliseconds = duration * 1000
+            for bound in self.BUCKETS_MS:
+                if milliseconds <= bound:
+                    counts[bound] += 1
+                    break
+            else:
+                counts[None] += 1
+        return counts
+
+    def __str__(self):
+        return "n={0} p50={1:.1f}ms p90={2:.1f}ms p99={3:.1f}ms max={4:.1f}ms".format(
+            len(self), self.percentile(50) * 1000, self.percentile(90) * 1000, self.percentile(99) * 1000,
+            self.maximum * 1000)
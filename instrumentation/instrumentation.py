@@ -0,0 +1,148 @@
+import collections
+import contextlib
+import datetime
+import functools
+import inspect
+import threading
+import time
+from dataclasses import dataclass, field
+
+from instrumentation.histogram import RollingHistogram
+
+
+@dataclass
+class Span:
+    name: str
+    depth: int
+    start: float  # seconds since the start of the cycle
+    duration: float = 0.0
+    failed: bool = False
+
+
+@dataclass
+class CycleSummary:
+    timestamp: datetime.datetime
+    duration: float
+    spans: list = field(default_factory=list)
+    counters: dict = field(default_factory=dict)
+
+    def span_durations(self) -> dict:
+        """Total duration per span name, e.g. to find the slowest driver call"""
+        durations = collections.OrderedDict()
+        for span in self.spans:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return durations
+
+    def __str__(self):
+        lines = ["Poll cycle {0:.1f} ms".format(self.duration * 1000)]
+        for span in self.spans:
+            lines.append("  {0:<44} {1:9.1f} ms{2}".format("  " * span.depth + span.name, span.duration * 1000,
+                                                           " (failed)" if span.failed else ""))
+        if self.counters:
+            lines.append("  " + ", ".join("{0}={1}".format(name, value)
+                                          for name, value in sorted(self.counters.items())))
+        return "\n".join(lines)
+
+
+class Instrumentation(object):
+    """Timing spans and counters of one poll cycle at a time.
+
+    Spans are nested by the thread running the cycle; counters may be raised
+    from any thread, e.g. by the USB reader. Spans and counters outside of a
+    cycle are ignored. Every finished cycle adds its duration and the
+    duration of each span to a rolling histogram per name.
+    """
+    CYCLE = "cycle"
+
+    def __init__(self, window=100):
+        self._window = window
+        self._lock = threading.Lock()
+        self._histograms = collections.OrderedDict()
+        self._cycle_start = None
+        self._cycle_timestamp = None
+        self._spans = []
+        self._depth = 0
+        self._counters = collections.Counter()
+        self.last_cycle = None
+
+    def start_cycle(self):
+        with self._lock:
+            self._spans = []
+            self._depth = 0
+            self._counters = collections.Counter()
+            self._cycle_timestamp = datetime.datetime.now()
+            self._cycle_start = time.perf_counter()
+
+    def finish_cycle(self):
+        if self._cycle_start is None:
+            return None
+
+        with self._lock:
+            summary = CycleSummary(self._cycle_timestamp, time.perf_counter() - self._cycle_start, self._spans,
+                                   dict(self._counters))
+            self._cycle_start = None
+
+        self.histogram(self.CYCLE).add(summary.duration)
+        for name, duration in summary.span_durations().items():
+            self.histogram(name).add(duration)
+        self.last_cycle = summary
+        return summary
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if self._cycle_start is None:
+            yield None
+            return
+
+        span = Span(name, self._depth, time.perf_counter() - self._cycle_start)
+        self._spans.append(span)
+        self._depth += 1
+        try:
+            yield span
+        except BaseException:
+            span.failed = True
+            raise
+        finally:
+            self._depth -= 1
+            span.duration = time.perf_counter() - self._cycle_start - span.start
+
+    def count(self, name, value=1):
+        if self._cycle_start is None:
+            return
+        with self._lock:
+            self._counters[name] += value
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms.setdefault(name, RollingHistogram(self._window))
+        return histogram
+
+    @property
+    def histograms(self):
+        return dict(self._histograms)
+
+    def wrap(self, target):
+        """Proxy to target timing every call of one of its methods as a span"""
+        return InstrumentedProxy(target, self)
+
+
+class InstrumentedProxy(object):
+    def __init__(self, target, instrumentation):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_instrumentation', instrumentation)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if name.startswith('_') or not inspect.ismethod(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def timed(*args, **kwargs):
+            with self._instrumentation.span(name):
+                return attribute(*args, **kwargs)
+
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
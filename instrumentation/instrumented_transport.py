@@ -0,0 +1,48 @@
+from usb_transport import Transport
+
+
+class InstrumentedTransport(Transport):
+    """Counts the USB reports and bytes moved through another transport"""
+
+    def __init__(self, transport, instrumentation):
+        self.transport = transport
+        self._instrumentation = instrumentation
+
+    @property
+    def manufacturer(self):
+        return self.transport.manufacturer
+
+    @property
+    def product(self):
+        return self.transport.product
+
+    @property
+    def serial(self):
+        return self.transport.serial
+
+    def open(self):
+        self.transport.open()
+
+    def read(self, size, timeout=None):
+        data = self.transport.read(size, timeout=timeout)
+        self._count_read(len(data))
+        return data
+
+    def readinto(self, buffer, timeout=None):
+        size = self.transport.readinto(buffer, timeout=timeout)
+        self._count_read(size)
+        return size
+
+    def _count_read(self, size):
+        if size:
+            self._instrumentation.count("usb_reports_read")
+            self._instrumentation.count("usb_bytes_read", size)
+
+    def write(self, data):
+        result = self.transport.write(data)
+        self._instrumentation.count("usb_reports_written")
+        self._instrumentation.count("usb_bytes_written", len(data))
+        return result
+
+    def close(self):
+        self.transport.close()
@@ -16,6 +16,8 @@ logger.addHandler(logHandler)
 
 from homeassistant_connector import HomeAssistantConnector
 from pump_connector import PumpConnector
+from read_minimed_next24 import Medtronic600SeriesDriver
+from usb_transport import HidrawTransport
 
 
 if __name__ == '__main__':
@@ -24,7 +26,11 @@ if __name__ == '__main__':
     PORT = os.getenv("HOMEASSISTANT_PORT")
 
     home_assistant_connector = HomeAssistantConnector(token=TOKEN, ip=IP, port=PORT)
-    pump_connector = PumpConnector(connector=home_assistant_connector)
+    transport = None
+    if os.getenv("CNL_TRANSPORT") == "hidraw":
+        transport = HidrawTransport(Medtronic600SeriesDriver.USB_VID, Medtronic600SeriesDriver.USB_PID)
+    pump_connector = PumpConnector(connector=home_assistant_connector, transport=transport,
+                                   persistent_session=os.getenv("CNL_PERSISTENT_SESSION") == "1")
 
     while True:
         try:
@@ -2,6 +2,8 @@ import logging
 import time
 import datetime
 import binascii
+import contextlib
+import functools
 import subprocess
 
 logger = logging.getLogger('app')
@@ -12,21 +14,72 @@ from pump_history_parser import AlarmNotificationEvent, AlarmClearedEvent, NGPHi
 from homeassistant_connector import HomeAssistantConnector
 from pump_connector.helper import get_datetime_now
 from pump_data import MedtronicDataStatus, MedtronicMeasurementData
+from instrumentation import Instrumentation, CycleSummary
+from usb_transport import Transport
+
+
+def _stage(method):
+    """Time a step of the poll cycle as a span, the driver calls inside it nest below"""
+    @functools.wraps(method)
+    def timed(self, *args, **kwargs):
+        with self._instrumentation.span(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return timed
 
 
 class PumpConnector:
-    def __init__(self, connector: HomeAssistantConnector):
+    # A persistent session is rebuilt from scratch after this time, even if it is still healthy
+    MAXIMUM_SESSION_AGE = datetime.timedelta(hours=1)
+    # Pump history events evaluated by the poll cycle, and how old they may be to be new. The history is
+    # requested for the same time, the pump sends the whole pages reaching into it
+    PUMP_EVENT_TYPES = frozenset((NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION,
+                                  NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED,
+                                  NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_STOPPED,
+                                  NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_RESTARTED))
+    PUMP_EVENT_AGE = datetime.timedelta(minutes=15)
+
+    def __init__(self, connector: HomeAssistantConnector, transport: Transport = None,
+                 persistent_session: bool = False, instrumentation: Instrumentation = None):
         self._ha_connector = connector
+        self._transport = transport
+        self._persistent_session = persistent_session
+        self._instrumentation = instrumentation if instrumentation is not None else Instrumentation()
 
         self._connected_successfully = False
         self._connection_timestamp = get_datetime_now()
         self._mt = None
+        self._session = None
+        self._session_timestamp = None
         self._set_change_timestamp = None
 
+    @property
+    def instrumentation(self) -> Instrumentation:
+        """Rolling histograms of the cycle and of every stage and driver call"""
+        return self._instrumentation
+
+    @property
+    def last_cycle(self) -> CycleSummary:
+        return self._instrumentation.last_cycle
+
     def get_and_upload_data(self) -> None:
+        self._instrumentation.start_cycle()
+        try:
+            self._poll()
+        except Exception:
+            # A failed cycle leaves the session in an unknown state, the next one starts from scratch
+            self.close_session()
+            raise
+        finally:
+            logger.info(self._instrumentation.finish_cycle())
+
+    def _poll(self) -> None:
         self._connected_successfully = False
 
-        self._start_communication()
+        if self._persistent_session:
+            self._poll_persistent_session()
+        else:
+            self._start_communication()
 
         if not self._connected_successfully:
             self._ha_connector.update_status("Not connected.")
@@ -34,11 +87,97 @@ class PumpConnector:
             self._reset_timestamp_after_fail()
 
         self._ha_connector.update_timestamp(state=self._connection_timestamp.strftime("%H:%M:%S %d.%m.%Y"))
+        if self._session is None:
+            self._mt = None
+
+    def _poll_persistent_session(self) -> None:
+        if self._session is not None and not self._session_is_healthy():
+            logger.info("Persistent session is not healthy anymore, reconnecting.")
+            self.close_session()
+
+        reused = self._session is not None
+        if not reused:
+            self._open_session()
+            if self._session is None:
+                return
+
+        try:
+            self._begin_high_speed_mode()
+            return
+        except Exception:
+            logger.warning("Poll cycle in persistent session failed", exc_info=True)
+            self.close_session()
+
+        if reused and not self._connected_successfully:
+            # The CNL or the pump may have dropped the idle session: fall back to a full reconnect once
+            self._open_session()
+            if self._session is None:
+                return
+            try:
+                self._begin_high_speed_mode()
+            except Exception:
+                logger.error("Cannot connect to the pump. Abandoning")
+                self.close_session()
+                self._reset_timestamp_after_fail()
+
+    def _session_is_healthy(self) -> bool:
+        if self._mt.reader is None or not self._mt.reader.running:
+            return False
+        return get_datetime_now() - self._session_timestamp < self.MAXIMUM_SESSION_AGE
+
+    def _create_driver(self):
+        return self._instrumentation.wrap(Medtronic600SeriesDriver(self._transport, self._instrumentation))
+
+    @_stage
+    def _open_session(self) -> None:
+        """Set up everything up to the negotiated channel and keep it open until close_session"""
+        self._mt = self._create_driver()
+        self._session = contextlib.ExitStack()
+        try:
+            self._mt.openDevice()
+            self._session.callback(self._mt.closeDevice)
+
+            self._session.callback(self._mt.exitControlMode)
+            self._mt.getDeviceInfo()
+            logger.info("Device serial: {0}".format(self._mt.deviceSerial))
+            self._mt.enterControlMode()
+
+            self._session.callback(self._mt.exitPassthroughMode)
+            self._mt.enterPassthroughMode()
+
+            self._session.callback(self._mt.closeConnection)
+            self._mt.openConnection()
+            self._mt.readLinkCredentials()
+            try:
+                self._mt.negotiateChannel()
+            except Exception:
+                logger.error("Cannot connect to the pump. Abandoning")
+                self.close_session()
+                self._reset_timestamp_after_fail()
+                return
+        except Exception:
+            if self._mt.device is None:
+                logger.warning("Loading of device driver failed. Try to reset device.")
+                self._ha_connector.update_status("Driver fail.")
+                self.close_session()
+                self._reset_timestamp_after_fail()
+                self._reset_usb_device()
+                return
+            self.close_session()
+            raise
+
+        self._session_timestamp = get_datetime_now()
+
+    def close_session(self) -> None:
+        """Tear down a persistent session, from the connection back to the closed device"""
+        session, self._session = self._session, None
         self._mt = None
+        if session is not None:
+            session.close()
 
     def _start_communication(self) -> None:
         try:
-            self._mt = Medtronic600SeriesDriver()
+            self._mt = self._create_driver()
 
             self._mt.openDevice()
 
@@ -53,6 +192,7 @@ class PumpConnector:
 
             self._mt.closeDevice()
 
+    @_stage
     def _enter_control_mode(self) -> None:
         try:
             self._mt.getDeviceInfo()
@@ -62,6 +202,7 @@ class PumpConnector:
         finally:
             self._mt.exitControlMode()
 
+    @_stage
     def _enter_passthrough_mode(self) -> None:
         try:
             self._mt.enterPassthroughMode()
@@ -69,11 +210,11 @@ class PumpConnector:
         finally:
             self._mt.exitPassthroughMode()
 
+    @_stage
     def _open_connection(self) -> None:
         try:
             self._mt.openConnection()
-            self._mt.readInfo()
-            self._mt.readLinkKey()
+            self._mt.readLinkCredentials()
             try:
                 self._mt.negotiateChannel()
                 self._begin_high_speed_mode()
@@ -84,6 +225,7 @@ class PumpConnector:
         finally:
             self._mt.closeConnection()
 
+    @_stage
     def _begin_high_speed_mode(self) -> None:
         try:
             self._mt.beginEHSM()
@@ -93,6 +235,7 @@ class PumpConnector:
         finally:
             self._mt.finishEHSM()
 
+    @_stage
     def _get_and_upload_data(self) -> None:
         try:
             status = self._mt.getPumpMeasurement()
@@ -154,11 +297,15 @@ class PumpConnector:
             if self._ha_connector.switched_on() is not switched_state:
                 break
 
+    @_stage
     def _request_pump_events(self) -> list:
-        start_date = get_datetime_now() - datetime.timedelta(minutes=10)
+        start_date = get_datetime_now() - self.PUMP_EVENT_AGE
         history_pages = self._mt.getPumpHistory(None, start_date, datetime.datetime.max,
                                                 HISTORY_DATA_TYPE.PUMP_DATA)
-        events = self._mt.processPumpHistory(history_pages, HISTORY_DATA_TYPE.PUMP_DATA)
+        # Only the events evaluated by the poll cycle are decoded, all other events are skipped by their header.
+        # There is no date filter: the latest set change is looked up in all InsulinDeliveryStoppedEvents of the
+        # pages, and alarms are checked for their age by _is_pump_event_new.
+        events = self._mt.processPumpHistory(history_pages, HISTORY_DATA_TYPE.PUMP_DATA, self.PUMP_EVENT_TYPES)
         return events
 
     def _get_not_acknowledged_pump_alarms(self, events: list) -> dict:
@@ -218,7 +365,7 @@ class PumpConnector:
 
     def _is_pump_event_new(self, event: NGPHistoryEvent) -> bool:
         time_delta = get_datetime_now() - event.timestamp.replace(tzinfo=None)
-        return time_delta.total_seconds() < 15 * 60
+        return time_delta < self.PUMP_EVENT_AGE
 
     def _update_states(self, medtronic_pump_data: MedtronicMeasurementData) -> None:
         if self._data_is_valid(medtronic_pump_data):
@@ -246,9 +393,16 @@ class PumpConnector:
         self._ha_connector.update_event(state="")
         
     def clear_messages(self) -> None:
+        if self._session is not None:
+            try:
+                self._mt.clearMessage()
+            finally:
+                self.close_session()
+            return
+
         try:
             if self._mt is None:
-                self._mt = Medtronic600SeriesDriver()
+                self._mt = self._create_driver()
 
                 self._mt.openDevice()
             self._mt.clearMessage()
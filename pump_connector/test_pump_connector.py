@@ -88,6 +88,27 @@ class TestPumpConnector:
         self.mock_connector.update_latest_set_change.assert_called_with("Saturday")
         assert self.mock_logger.error.call_count == 0
 
+    def test_get_and_upload_data_decodes_evaluated_events_only(self, mocker, medtronic_data_valid):
+        self.mock_dependencies(mocker)
+
+        self.mock_medtronic_driver.return_value.getPumpMeasurement.return_value = medtronic_data_valid
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 12, 4, 00, 0)
+        self.mock_medtronic_driver.return_value.processPumpHistory.return_value = []
+
+        unit_under_test = self.create_unit_under_test()
+
+        unit_under_test.get_and_upload_data()
+
+        _, start_date, _, _ = self.mock_medtronic_driver.return_value.getPumpHistory.call_args[0]
+        assert start_date == datetime.datetime(2022, 1, 1, 11, 49, 00, 0)
+        # every set change in the downloaded pages is decoded, not only those of the last minutes
+        args, kwargs = self.mock_medtronic_driver.return_value.processPumpHistory.call_args
+        assert len(args) == 3 and not kwargs
+        event_types = args[2]
+        assert event_types == PumpConnector.PUMP_EVENT_TYPES
+        assert AlarmNotificationEvent.EVENT_TYPES[0] in event_types
+        assert InsulinDeliveryStoppedEvent.EVENT_TYPES[0] in event_types
+
     def test_get_and_upload_data_event_low_glucose_prediction_only(self, mocker, medtronic_data_valid):
         self.mock_dependencies(mocker)
 
@@ -189,6 +210,102 @@ class TestPumpConnector:
         self.mock_connector.update_timestamp.assert_called_with(state="12:14:00 01.01.2022")
         assert self.mock_logger.error.call_count == 0
 
+    def test_get_and_upload_data_persistent_session_is_reused(self, mocker, medtronic_data_valid):
+        self.mock_dependencies(mocker)
+
+        self.mock_medtronic_driver.return_value.getPumpMeasurement.return_value = medtronic_data_valid
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 12, 4, 00, 0)
+
+        unit_under_test = PumpConnector(connector=self.mock_connector, persistent_session=True)
+
+        unit_under_test.get_and_upload_data()
+        unit_under_test.get_and_upload_data()
+
+        driver = self.mock_medtronic_driver.return_value
+        assert self.mock_medtronic_driver.call_count == 1
+        assert driver.negotiateChannel.call_count == 1
+        assert driver.beginEHSM.call_count == 2
+        assert driver.finishEHSM.call_count == 2
+        driver.closeDevice.assert_not_called()
+        self.mock_connector.update_status.assert_called_with("Connected.")
+
+        unit_under_test.close_session()
+
+        driver.closeConnection.assert_called_once()
+        driver.exitPassthroughMode.assert_called_once()
+        driver.exitControlMode.assert_called_once()
+        driver.closeDevice.assert_called_once()
+
+    def test_get_and_upload_data_persistent_session_reconnects_after_failure(self, mocker, medtronic_data_valid):
+        self.mock_dependencies(mocker)
+
+        driver = self.mock_medtronic_driver.return_value
+        driver.getPumpMeasurement.return_value = medtronic_data_valid
+        driver.beginEHSM.side_effect = [None, RuntimeError("no response from pump"), None]
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 12, 4, 00, 0)
+
+        unit_under_test = PumpConnector(connector=self.mock_connector, persistent_session=True)
+
+        unit_under_test.get_and_upload_data()
+        unit_under_test.get_and_upload_data()
+
+        assert self.mock_medtronic_driver.call_count == 2
+        assert driver.negotiateChannel.call_count == 2
+        driver.closeDevice.assert_called_once()
+        self.mock_connector.update_status.assert_called_with("Connected.")
+
+    def test_get_and_upload_data_persistent_session_reader_died(self, mocker, medtronic_data_valid):
+        self.mock_dependencies(mocker)
+
+        driver = self.mock_medtronic_driver.return_value
+        driver.getPumpMeasurement.return_value = medtronic_data_valid
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 12, 4, 00, 0)
+
+        unit_under_test = PumpConnector(connector=self.mock_connector, persistent_session=True)
+
+        unit_under_test.get_and_upload_data()
+        # e.g. the stick was unplugged and the reader stopped on the transport error
+        driver.reader.running = False
+        unit_under_test.get_and_upload_data()
+
+        assert self.mock_medtronic_driver.call_count == 2
+        assert driver.negotiateChannel.call_count == 2
+        driver.closeDevice.assert_called_once()
+        self.mock_connector.update_status.assert_called_with("Connected.")
+
+    def test_get_and_upload_data_persistent_session_closed_after_failed_cycle(self, mocker, medtronic_data_valid):
+        self.mock_dependencies(mocker)
+
+        driver = self.mock_medtronic_driver.return_value
+        driver.getPumpMeasurement.return_value = medtronic_data_valid
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 12, 4, 00, 0)
+        self.mock_connector.update_timestamp.side_effect = [RuntimeError("Homeassistant not reachable"), None]
+
+        unit_under_test = PumpConnector(connector=self.mock_connector, persistent_session=True)
+
+        with pytest.raises(RuntimeError):
+            unit_under_test.get_and_upload_data()
+        driver.closeDevice.assert_called_once()
+        unit_under_test.get_and_upload_data()
+
+        assert self.mock_medtronic_driver.call_count == 2
+        assert driver.negotiateChannel.call_count == 2
+
+    def test_get_and_upload_data_persistent_session_expires(self, mocker, medtronic_data_valid):
+        self.mock_dependencies(mocker)
+
+        self.mock_medtronic_driver.return_value.getPumpMeasurement.return_value = medtronic_data_valid
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 12, 4, 00, 0)
+
+        unit_under_test = PumpConnector(connector=self.mock_connector, persistent_session=True)
+
+        unit_under_test.get_and_upload_data()
+        self.mock_get_datetime_now.return_value = datetime.datetime(2022, 1, 1, 13, 5, 00, 0)
+        unit_under_test.get_and_upload_data()
+
+        assert self.mock_medtronic_driver.call_count == 2
+        self.mock_medtronic_driver.return_value.closeDevice.assert_called_once()
+
     def test_get_and_upload_data_invalid_data(self, mocker):
         self.mock_dependencies(mocker)
 
@@ -1,8 +1,16 @@
-from helpers import DateTimeHelper, BinaryDataDecoder, NumberHelper
+from helpers import DateTimeContext, DateTimeHelper, BinaryDataDecoder, NumberHelper
+import bisect
+import collections
 import struct
 import logging
 from datetime import timedelta
 
+try:
+    import numpy
+except ImportError:
+    # Sensor readings are decoded one by one without it
+    numpy = None
+
 logger = logging.getLogger('app')
 
 
@@ -125,6 +133,206 @@ class NGPConstants:
     }
 
 
+class EventField(object):
+    """A field of a history event: struct format at an offset of the event data
+
+    The raw value is divided by scale, unless the value of the unit field
+    picks another scale from scales, None keeping the raw value. convert
+    replaces the scaling and gets the raw values, one per item of fmt.
+    """
+
+    def __init__(self, offset, fmt, scale=None, unit=None, scales=None, convert=None):
+        self.offset = offset
+        self.fmt = fmt
+        self.size = struct.calcsize('>' + fmt)
+        self.items = len(struct.unpack('>' + fmt, bytes(self.size)))
+        self.scale = scale
+        self.unit = unit
+        self.scales = scales or {}
+        self.convert = convert
+
+
+class EventLayout(object):
+    """Decoder for all fields of an event type, compiled once
+
+    Fields that do not overlap are read by the same precompiled struct, so
+    most event types are decoded by a single unpack.
+    """
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        groups = []
+        for name, field in sorted(self.fields.items(), key=lambda item: item[1].offset):
+            group = next((group for group in groups if group['end'] <= field.offset), None)
+            if group is None:
+                group = {'end': 0, 'fmt': '>', 'names': []}
+                groups.append(group)
+            if field.offset > group['end']:
+                group['fmt'] += '{0}x'.format(field.offset - group['end'])
+            group['fmt'] += field.fmt
+            group['end'] = field.offset + field.size
+            group['names'].append(name)
+
+        self._structs = [(struct.Struct(group['fmt']).unpack_from,
+                          [(name, self.fields[name].items) for name in group['names']]) for group in groups]
+        self._converted = [(name, field) for name, field in self.fields.items()
+                           if field.convert is not None or field.scale is not None or field.unit is not None]
+
+    def decode(self, eventData):
+        raw = {}
+        for unpack, names in self._structs:
+            values = unpack(eventData)
+            pos = 0
+            for name, items in names:
+                raw[name] = values[pos] if items == 1 else values[pos:pos + items]
+                pos += items
+
+        values = dict(raw)
+        for name, field in self._converted:
+            if field.convert is not None:
+                values[name] = field.convert(*raw[name]) if field.items > 1 else field.convert(raw[name])
+                continue
+            scale = field.scales.get(raw[field.unit], field.scale) if field.unit is not None else field.scale
+            if scale is not None:
+                values[name] = raw[name] / scale
+        return values
+
+
+class DecodedField(object):
+    """Field of an event, the first access decodes all fields of the event at once"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, event, owner=None):
+        if event is None:
+            return self
+        # Fields assigned to the event before keep their value
+        decoded = type(event).LAYOUT.decode(event.eventData)
+        decoded.update(event.__dict__)
+        event.__dict__.update(decoded)
+        return event.__dict__[self.name]
+
+
+class DecodedTimestamp(object):
+    """Timestamp of an event, decoded once by the DateTimeContext of the event"""
+
+    def __get__(self, event, owner=None):
+        if event is None:
+            return self
+        if event.dateTimeContext is None:
+            timestamp = DateTimeHelper.decodeDateTime(event.encodedTimestamp)
+        else:
+            timestamp = event.dateTimeContext.decodeDateTime(event.encodedTimestamp)
+        event.__dict__['timestamp'] = timestamp
+        return timestamp
+
+
+class HistoryEventIndex(object):
+    """Events of a history by class and field value, sorted by time
+
+    Events are linked by looking up the matching events in a time window,
+    instead of every event scanning the whole history. The index of a class
+    and field is built once, on first use.
+
+    Timestamps have a resolution of one second, so an event and the one it
+    links to can have the same timestamp. The window includes the second of
+    the event, and the position in the history tells which came first.
+    """
+
+    def __init__(self, historyEvents):
+        self.historyEvents = historyEvents
+        # History position of historyEvents[0]
+        self.first = 0
+        self._groups = {}
+        self._positions = None
+
+    def __iter__(self):
+        return iter(self.historyEvents)
+
+    def __len__(self):
+        return len(self.historyEvents)
+
+    def before(self, eventClass, event, window, field, value):
+        """Events of eventClass with the field value, less than window before the event and earlier in history"""
+        groups = self._groups.get((eventClass, field))
+        if groups is None:
+            groups = self._groups[(eventClass, field)] = self._group(eventClass, field)
+        timestamps, positions, events = groups.get(value, ((), (), ()))
+        start = bisect.bisect_right(timestamps, event.timestamp - window)
+        end = bisect.bisect_right(timestamps, event.timestamp)
+        position = self.position(event)
+        if position is None:
+            return events[start:end]
+        return [events[i] for i in range(start, end) if positions[i] < position]
+
+    def position(self, event):
+        """Position of the event in the history, None if it is not indexed"""
+        if self._positions is None:
+            self._positions = {id(x): position for position, x in enumerate(self.historyEvents, self.first)}
+        return self._positions.get(id(event))
+
+    def _group(self, eventClass, field):
+        groups = {}
+        for position, event in enumerate(self.historyEvents, self.first):
+            if isinstance(event, eventClass):
+                groups.setdefault(getattr(event, field), []).append((position, event))
+        for value, events in groups.items():
+            # Stable, events of the same second stay in history order
+            events.sort(key=lambda item: item[1].timestamp)
+            groups[value] = ([event.timestamp for position, event in events],
+                             [position for position, event in events],
+                             [event for position, event in events])
+        return groups
+
+
+class HistoryEventWindow(HistoryEventIndex):
+    """Index of the latest events of a stream of history events, back to lookBack before the newest one
+
+    lookBack has to cover the time window in which postProcess links events.
+    """
+    LOOK_BACK = timedelta(minutes=10)
+
+    def __init__(self, lookBack=LOOK_BACK):
+        HistoryEventIndex.__init__(self, collections.deque())
+        self.lookBack = lookBack
+        self.newest = None
+
+    def startsOver(self, event):
+        """Whether the event is before the window, e.g. after the time of the pump was set back"""
+        return self.newest is not None and event.timestamp < self.newest - self.lookBack
+
+    def add(self, event):
+        if self.startsOver(event):
+            # Events before do not link to the following ones
+            self.first += len(self.historyEvents)
+            self.historyEvents.clear()
+            self.newest = None
+        if self.newest is None or event.timestamp > self.newest:
+            self.newest = event.timestamp
+        self.historyEvents.append(event)
+        while self.historyEvents[0].timestamp < self.newest - self.lookBack:
+            self.historyEvents.popleft()
+            self.first += 1
+        # Grouped again on the next lookup
+        self._groups.clear()
+        self._positions = None
+
+    def link(self, historyEvents):
+        """Link a stream of events in history order, yielding each once no later event can link to it anymore"""
+        pending = collections.deque()
+        for event in historyEvents:
+            if self.startsOver(event):
+                yield from pending
+                pending.clear()
+            self.add(event)
+            event.postProcess(self)
+            pending.append(event)
+            while pending[0].timestamp <= self.newest - self.lookBack:
+                yield pending.popleft()
+        yield from pending
+
+
 class NGPHistoryEvent:
     class EVENT_TYPE:
         TIME_RESET = 0x02
@@ -237,29 +445,48 @@ class NGPHistoryEvent:
         CLOSED_LOOP_TRANSITION = 0xDF
         GENERATED__SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM = 0xD601  # this is not a pump event, it's generated from single items within SENSOR_GLUCOSE_READINGS_EXTENDED
 
-    def __init__(self, eventData):
-        self.eventData = eventData;
-
-    @property
-    def source(self):
-        # No idea what "source" means.
-        return BinaryDataDecoder.readByte(self.eventData, 0x01)  # self.eventData[0x01];
-
-    @property
-    def size(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x02)  # this.eventData[0x02];
+    # Event types decoded by a subclass, registered for them when the subclass is defined
+    EVENT_TYPES = ()
+    _eventClasses = {}
 
-    @property
-    def eventType(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x00)  # this.eventData[0];
+    # Fields of the event data, extended by the FIELDS of each subclass
+    FIELDS = {
+        'eventType': EventField(0x00, 'B'),
+        'source': EventField(0x01, 'B'),  # No idea what "source" means.
+        'size': EventField(0x02, 'B'),
+        'encodedTimestamp': EventField(0x03, 'Q'),
+    }
+    LAYOUT = EventLayout(FIELDS)
+    eventType = DecodedField('eventType')
+    source = DecodedField('source')
+    size = DecodedField('size')
+    encodedTimestamp = DecodedField('encodedTimestamp')
+    timestamp = DecodedTimestamp()
+    # Shared by the events of a download, decoding their timestamps with DateTimeHelper without one
+    dateTimeContext = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Only the types a class lists itself, subclasses of a registered class do not take over its types
+        for eventType in cls.__dict__.get('EVENT_TYPES', ()):
+            NGPHistoryEvent._eventClasses[eventType] = cls
+        if 'FIELDS' in cls.__dict__:
+            cls.LAYOUT = EventLayout(dict(super(cls, cls).LAYOUT.fields, **cls.FIELDS))
+            for name in cls.FIELDS:
+                setattr(cls, name, DecodedField(name))
+
+    @staticmethod
+    def defineEvent(name, eventTypes, fields, base=None):
+        """Event class decoding fields for eventTypes, e.g. for an event type without a class of its own"""
+        return type(name, (base or NGPHistoryEvent,), {'EVENT_TYPES': tuple(eventTypes), 'FIELDS': fields,
+                                                       '__module__': __name__})
 
-    @property
-    def timestamp(self):
-        return DateTimeHelper.decodeDateTime(BinaryDataDecoder.readUInt64BE(self.eventData, 0x03))
+    def __init__(self, eventData):
+        self.eventData = eventData;
 
     @property
     def dynamicActionRequestor(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x01)  # self.eventData[0x01];
+        return self.source
 
     def __str__(self):
         return '{0} {1}'.format(self.__class__.__name__, self.timestamp)
@@ -273,57 +500,23 @@ class NGPHistoryEvent:
     def allNestedEvents(self):
         yield self.eventInstance()
 
-    def postProcess(self, histryEvents):
+    def postProcess(self, historyIndex):
+        """Link the event to other events of the history, found in a HistoryEventIndex"""
         pass
 
     def eventInstance(self):
-        if self.eventType == NGPHistoryEvent.EVENT_TYPE.BG_READING:
-            return BloodGlucoseReadingEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED:
-            return NormalBolusDeliveredEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED:
-            return SensorGlucoseReadingsEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE:
-            return BolusWizardEstimateEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.BASAL_SEGMENT_START:
-            return BasalSegmentStartEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_STOPPED:
-            return InsulinDeliveryStoppedEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_RESTARTED:
-            return InsulinDeliveryRestartedEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE:
-            return PLGMControllerStateEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.CALIBRATION_COMPLETE:
-            return CalibrationCompleteEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION:
-            return AlarmNotificationEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED:
-            return AlarmClearedEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_STARTED:
-            return SensorAlertSilenceStartedEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_ENDED:
-            return SensorAlertSilenceEndedEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.GENERAL_SENSOR_SETTINGS_CHANGE:
-            return GeneralSensorSettingsChangeEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.DAILY_TOTALS:
-            return DailyTotalsEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.START_OF_DAY_MARKER:
-            return StartOfDayMarkerEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.END_OF_DAY_MARKER:
-            return EndOfDayMarkerEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.SOURCE_ID_CONFIGURATION:
-            return SourceIdConfigurationEvent(self.eventData);
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED:
-            return NormalBolusProgrammedEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED:
-            return SquareBolusProgrammedEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_DELIVERED:
-            return SquareBolusDeliveredEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED:
-            return DualBolusProgrammedEvent(self.eventData)
-        elif self.eventType == NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PART_DELIVERED:
-            return DualBolusDeliveredEvent(self.eventData)
-        return self
+        eventClass = NGPHistoryEvent._eventClasses.get(self.eventData[0])
+        if eventClass is None or type(self) is eventClass:
+            return self
+        return NGPHistoryEvent.fromEventData(self.eventData, self.dateTimeContext)
+
+    @staticmethod
+    def fromEventData(eventData, dateTimeContext=None):
+        """The event of the class registered for its type, a plain NGPHistoryEvent for types without decoder"""
+        event = NGPHistoryEvent._eventClasses.get(eventData[0], NGPHistoryEvent)(eventData)
+        if dateTimeContext is not None:
+            event.dateTimeContext = dateTimeContext
+        return event
 
 
 #       case NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_BG_TARGETS:
@@ -374,6 +567,11 @@ class NGPHistoryEvent:
 #     }
 
 class BloodGlucoseReadingEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.BG_READING,)
+    FIELDS = {
+        'bgValue': EventField(0x0C, 'H'),  # bgValue is always in mg/dL.
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
 
@@ -391,11 +589,6 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
     #     return this.eventData[0x0E];
     #   }
 
-    @property
-    def bgValue(self):
-        # bgValue is always in mg/dL.
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x0C)  # this.eventData.readUInt16BE(0x0C);
-
 
 #   get bgUnits() {
 #     // bgValue is always in mg/dL. bgUnits tells us which units the device is set in.
@@ -419,6 +612,12 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
 #   }
 
 class BolusDeliveredEvent(NGPHistoryEvent):
+    FIELDS = {
+        'bolusSource': EventField(0x0B, 'B'),
+        'bolusNumber': EventField(0x0C, 'B'),
+        'presetBolusNumber': EventField(0x0D, 'B'),  # See NGPUtil.NGPConstants.BOLUS_PRESET_NAME
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
         self.programmedEvent = None
@@ -428,30 +627,21 @@ class BolusDeliveredEvent(NGPHistoryEvent):
                                                                           self.bolusSource, self.bolusNumber,
                                                                           self.presetBolusNumber)
 
-    @property
-    def bolusSource(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
-    @property
-    def bolusNumber(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0C)  # return this.eventData[0x0C];
-
-    @property
-    def presetBolusNumber(self):
-        # See NGPUtil.NGPConstants.BOLUS_PRESET_NAME
-        return BinaryDataDecoder.readByte(self.eventData, 0x0D)  # return this.eventData[0x0D];
-
-    def postProcess(self, histryEvents):
-        matches = [x for x in histryEvents
-                   if isinstance(x, NormalBolusProgrammedEvent)
-                   and x.bolusNumber == self.bolusNumber
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)]
+    def postProcess(self, historyIndex):
+        matches = historyIndex.before(NormalBolusProgrammedEvent, self, timedelta(minutes=5),
+                                      'bolusNumber', self.bolusNumber)
         if len(matches) == 1:
             self.programmedEvent = matches[0]
 
 
 class NormalBolusDeliveredEvent(BolusDeliveredEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED,)
+    FIELDS = {
+        'programmedAmount': EventField(0x0E, 'I', scale=10000.0),
+        'deliveredAmount': EventField(0x12, 'I', scale=10000.0),
+        'activeInsulin': EventField(0x16, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         BolusDeliveredEvent.__init__(self, eventData)
 
@@ -460,23 +650,17 @@ class NormalBolusDeliveredEvent(BolusDeliveredEvent):
                                                                            self.deliveredAmount, self.programmedAmount,
                                                                            self.activeInsulin, self.programmedEvent)
 
-    @property
-    def deliveredAmount(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x12) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def programmedAmount(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x0E) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x16) / 10000.0  # return this.eventData.readUInt32BE(0x16) / 10000.0;
-
 
 class SquareBolusDeliveredEvent(BolusDeliveredEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_DELIVERED,)
+    FIELDS = {
+        'programmedAmount': EventField(0x0E, 'I', scale=10000.0),
+        'deliveredAmount': EventField(0x12, 'I', scale=10000.0),
+        'programmedDuration': EventField(0x16, 'H'),
+        'deliveredDuration': EventField(0x18, 'H'),
+        'activeInsulin': EventField(0x1A, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         BolusDeliveredEvent.__init__(self, eventData)
 
@@ -490,31 +674,19 @@ class SquareBolusDeliveredEvent(BolusDeliveredEvent):
             self.activeInsulin,
             self.programmedEvent)
 
-    @property
-    def deliveredAmount(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x12) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def programmedAmount(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x0E) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def deliveredDuration(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x18)
-
-    @property
-    def programmedDuration(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x16)
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x1a) / 10000.0  # return this.eventData.readUInt32BE(0x16) / 10000.0;
-
 
 class DualBolusDeliveredEvent(BolusDeliveredEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PART_DELIVERED,)
+    FIELDS = {
+        'programmedAmountImmediate': EventField(0x0E, 'I', scale=10000.0),
+        'programmedAmountSquare': EventField(0x12, 'I', scale=10000.0),
+        'deliveredAmount': EventField(0x16, 'I', scale=10000.0),
+        'deliveredType': EventField(0x1A, 'B', convert=lambda value: 'Immediate' if value == 1 else 'Square'),
+        'programmedDuration': EventField(0x1B, 'H'),
+        'deliveredDuration': EventField(0x1D, 'H'),
+        'activeInsulin': EventField(0x1F, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         BolusDeliveredEvent.__init__(self, eventData)
 
@@ -530,40 +702,14 @@ class DualBolusDeliveredEvent(BolusDeliveredEvent):
             self.activeInsulin,
             self.programmedEvent)
 
-    @property
-    def deliveredAmount(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x16) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def deliveredType(self):
-        return 'Immediate' if BinaryDataDecoder.readByte(self.eventData, 0x1a) == 1 else 'Square'
-
-    @property
-    def programmedAmountImmediate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x0E) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def programmedAmountSquare(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x12) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def deliveredDuration(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x1d)
-
-    @property
-    def programmedDuration(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x1b)
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x1f) / 10000.0  # return this.eventData.readUInt32BE(0x16) / 10000.0;
-
 
 class BolusProgrammedEvent(NGPHistoryEvent):
+    FIELDS = {
+        'bolusSource': EventField(0x0B, 'B'),
+        'bolusNumber': EventField(0x0C, 'B'),
+        'presetBolusNumber': EventField(0x0D, 'B'),  # See NGPUtil.NGPConstants.BOLUS_PRESET_NAME
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
         self.bolusWizardEvent = None
@@ -573,21 +719,14 @@ class BolusProgrammedEvent(NGPHistoryEvent):
                                                                           self.bolusSource, self.bolusNumber,
                                                                           self.presetBolusNumber)
 
-    @property
-    def bolusSource(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
-    @property
-    def bolusNumber(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0C)  # return this.eventData[0x0C];
-
-    @property
-    def presetBolusNumber(self):
-        # See NGPUtil.NGPConstants.BOLUS_PRESET_NAME
-        return BinaryDataDecoder.readByte(self.eventData, 0x0D)  # return this.eventData[0x0D];
-
 
 class NormalBolusProgrammedEvent(BolusProgrammedEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED,)
+    FIELDS = {
+        'programmedAmount': EventField(0x0E, 'I', scale=10000.0),
+        'activeInsulin': EventField(0x12, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         BolusProgrammedEvent.__init__(self, eventData)
 
@@ -597,28 +736,24 @@ class NormalBolusProgrammedEvent(BolusProgrammedEvent):
                                                               self.activeInsulin,
                                                               self.bolusWizardEvent)
 
-    @property
-    def programmedAmount(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x0E) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x12) / 10000.0  # return this.eventData.readUInt32BE(0x16) / 10000.0;
-
-    def postProcess(self, histryEvents):
-        matches = [x for x in histryEvents
-                   if isinstance(x, BolusWizardEstimateEvent)
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)
-                   and x.finalEstimate == self.programmedAmount]
+    def postProcess(self, historyIndex):
+        # An estimate is programmed once, the one of an earlier bolus of the same amount is not a match
+        matches = [x for x in historyIndex.before(BolusWizardEstimateEvent, self, timedelta(minutes=5),
+                                                  'finalEstimate', self.programmedAmount)
+                   if not x.programmed]
         if len(matches) == 1:
             self.bolusWizardEvent = matches[0]
             self.bolusWizardEvent.programmed = True
 
 
 class SquareBolusProgrammedEvent(BolusProgrammedEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED,)
+    FIELDS = {
+        'programmedAmount': EventField(0x10, 'H', scale=10000.0),
+        'programmedDurationInMinutes': EventField(0x12, 'H'),
+        'activeInsulin': EventField(0x16, 'H', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         BolusProgrammedEvent.__init__(self, eventData)
 
@@ -629,32 +764,24 @@ class SquareBolusProgrammedEvent(BolusProgrammedEvent):
                                                                             self.activeInsulin,
                                                                             self.bolusWizardEvent)
 
-    @property
-    def programmedAmount(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData,
-                                              0x10) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def programmedDurationInMinutes(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x12)
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData,
-                                              0x16) / 10000.0  # return this.eventData.readUInt32BE(0x16) / 10000.0;
-
-    def postProcess(self, histryEvents):
-        matches = [x for x in histryEvents
-                   if isinstance(x, BolusWizardEstimateEvent)
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)
-                   and x.finalEstimate == self.programmedAmount]
+    def postProcess(self, historyIndex):
+        matches = [x for x in historyIndex.before(BolusWizardEstimateEvent, self, timedelta(minutes=5),
+                                                  'finalEstimate', self.programmedAmount)
+                   if not x.programmed]
         if len(matches) == 1:
             self.bolusWizardEvent = matches[0]
             self.bolusWizardEvent.programmed = True
 
 
 class DualBolusProgrammedEvent(BolusProgrammedEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED,)
+    FIELDS = {
+        'programmedAmountImmediate': EventField(0x0E, 'I', scale=10000.0),
+        'programmedAmountSquare': EventField(0x12, 'I', scale=10000.0),
+        'programmedDurationInMinutes': EventField(0x16, 'H'),
+        'activeInsulin': EventField(0x18, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         BolusProgrammedEvent.__init__(self, eventData)
 
@@ -667,63 +794,109 @@ class DualBolusProgrammedEvent(BolusProgrammedEvent):
             self.activeInsulin,
             self.bolusWizardEvent)
 
-    @property
-    def programmedAmountImmediate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x0E) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def programmedAmountSquare(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x12) / 10000.0  # return this.eventData.readUInt32BE(0x12) / 10000.0;
-
-    @property
-    def programmedDurationInMinutes(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x16)
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x18) / 10000.0  # return this.eventData.readUInt32BE(0x16) / 10000.0;
-
-    def postProcess(self, histryEvents):
-        matches = [x for x in histryEvents
-                   if isinstance(x, BolusWizardEstimateEvent)
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)
-                   and x.finalEstimate == self.programmedAmountImmediate]
+    def postProcess(self, historyIndex):
+        matches = [x for x in historyIndex.before(BolusWizardEstimateEvent, self, timedelta(minutes=5),
+                                                  'finalEstimate', self.programmedAmountImmediate)
+                   if not x.programmed]
         if len(matches) == 1:
             self.bolusWizardEvent = matches[0]
             self.bolusWizardEvent.programmed = True
 
 
 class SensorGlucoseReadingsEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED,)
+    FIELDS = {
+        'minutesBetweenReadings': EventField(0x0B, 'B'),
+        'numberOfReadings': EventField(0x0C, 'B'),
+        'predictedSg': EventField(0x0D, 'H'),
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
 
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__shortstr__(self))
 
-    @property
-    def minutesBetweenReadings(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
-    @property
-    def numberOfReadings(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0C)  # return this.eventData[0x0C];
-
-    @property
-    def predictedSg(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x0D)  # return this.eventData.readUInt16BE(0x0D);
+    if numpy is not None:
+        # A reading as stored in the event data, newest first
+        READING_RECORD = numpy.dtype([('sgHigh', 'u1'), ('sgLow', 'u1'), ('isig', '>u2'), ('vctrLow', 'u1'),
+                                      ('rateOfChange', '>i2'), ('sensorStatus', 'u1'), ('readingStatus', 'u1')])
+        # Columns of the decoded readings, in the order of the SensorGlucoseReading arguments. The timestamps are
+        # the local time of the pump, without the timezone.
+        READINGS = numpy.dtype([('timestamp', 'M8[us]'), ('dynamicActionRequestor', 'u1'), ('sg', 'u2'),
+                                ('predictedSg', 'u2'), ('isig', 'f8'), ('vctr', 'f8'), ('rateOfChange', 'f8'),
+                                ('backfilledData', '?'), ('settingsChanged', '?'), ('noisyData', '?'),
+                                ('discardData', '?'), ('sensorError', '?'), ('sensorStatus', 'u1'),
+                                ('readingStatus', 'u1')])
+
+    def readings(self):
+        """All readings of the event at once as a NumPy structured array of READINGS, oldest first"""
+        return SensorGlucoseReadingsEvent.readingsOf([self], self.dateTimeContext)
+
+    @staticmethod
+    def readingsOf(events, dateTimeContext=None):
+        """Readings of all events at once as a NumPy structured array of READINGS, oldest first per event
+
+        The fields and timestamps of all events are decoded together, without
+        an object per reading. Like allNestedEvents, only readings with a
+        glucose value are kept, the sensor error codes of 600 and above are not.
+        """
+        if numpy is None:
+            raise RuntimeError("Decoding sensor readings into arrays needs NumPy")
+
+        sizes = numpy.array([len(event.eventData) for event in events], dtype=numpy.intp)
+        data = numpy.frombuffer(b''.join(event.eventData for event in events), numpy.uint8)
+        starts = numpy.cumsum(sizes) - sizes
+        counts = data[starts + 0x0C].astype(numpy.intp)
+        total = int(counts.sum())
+        eventIndex = numpy.repeat(numpy.arange(len(events)), counts)
+        # Readings are stored newest first, the i-th one minutesBetweenReadings * i before the event timestamp
+        firstReading = numpy.cumsum(counts) - counts
+        readingsBefore = counts[eventIndex] - 1 - (numpy.arange(total) - firstReading[eventIndex])
+        offsets = starts[eventIndex] + 0x0F + 9 * readingsBefore
+        records = data[offsets[:, None] + numpy.arange(9)].view(SensorGlucoseReadingsEvent.READING_RECORD)[:, 0]
+
+        readings = numpy.empty(total, SensorGlucoseReadingsEvent.READINGS)
+        encodedTimestamps = data[starts[:, None] + numpy.arange(0x03, 0x0B)].view('>u8')[:, 0]
+        timestamps = (dateTimeContext or DateTimeContext()).decodeDateTimes64(encodedTimestamps)
+        minutes = data[starts + 0x0B].astype(numpy.intp)
+        readings['timestamp'] = timestamps[eventIndex] - (readingsBefore * minutes[eventIndex]).astype('m8[m]')
+        readings['dynamicActionRequestor'] = data[starts + 0x01][eventIndex]
+        readings['predictedSg'] = (data[starts + 0x0D].astype(numpy.uint16) << 8 | data[starts + 0x0E])[eventIndex]
+        sgHigh = records['sgHigh'].astype(numpy.uint32)
+        readings['sg'] = (sgHigh & 0x03) << 8 | records['sgLow']
+        readings['isig'] = records['isig'] / 100.0
+        # The 10 bit signed value, as NumberHelper.make32BitIntFromNBitSignedInt extends it to 32 bit
+        vctr = ((sgHigh >> 2) & 0x03) << 8 | records['vctrLow']
+        readings['vctr'] = numpy.where(vctr & 0x200, vctr | 0xFFFFFC00, vctr) / 100.0
+        readings['rateOfChange'] = records['rateOfChange'] / 100.0
+
+        readingStatus = records['readingStatus']
+        sensorStatus = records['sensorStatus']
+        readings['backfilledData'] = (readingStatus & 0x01) == 0x01
+        readings['settingsChanged'] = (readingStatus & 0x02) == 0x02
+        readings['noisyData'] = sensorStatus == 1
+        readings['discardData'] = sensorStatus == 2
+        readings['sensorError'] = sensorStatus == 3
+        readings['sensorStatus'] = sensorStatus
+        readings['readingStatus'] = readingStatus
+        sg = readings['sg']
+        return readings[(sg > 0) & (sg < 600)]
 
     def allNestedEvents(self):
         pos = 0x0F
+        minutesBetweenReadings = self.minutesBetweenReadings
+        numberOfReadings = self.numberOfReadings
+        predictedSg = self.predictedSg
+        eventTimestamp = self.timestamp
+        dynamicActionRequestor = self.dynamicActionRequestor
+        reading = BinaryDataDecoder.layout('>BBHBhBB')
         # if self.numberOfReadings > 1:
         #    logger.debug("MULTI_ITEM_HISTORY: {0} {1}".format(self.timestamp, self.numberOfReadings))
-        for i in range(self.numberOfReadings - 1, -1, -1):
+        for i in range(numberOfReadings - 1, -1, -1):
             # const timestamp = new NGPUtil.NGPTimestamp(this.timestamp.rtc - (i * this.minutesBetweenReadings * 60), this.timestamp.offset);
-            timestamp = self.timestamp - timedelta(minutes=i * self.minutesBetweenReadings)
-            payloadDecoded = struct.unpack('>BBHBhBB', self.eventData[pos + i * 9: pos + (i + 1) * 9])
+            timestamp = eventTimestamp - timedelta(minutes=i * minutesBetweenReadings)
+            payloadDecoded = reading.unpack_from(self.eventData, pos + i * 9)
 
             # const sg = ((this.eventData[pos] & 3) << 8) | this.eventData[pos + 1];
             sg = (payloadDecoded[0] & 0x03) << 8 | payloadDecoded[1]
@@ -758,9 +931,9 @@ class SensorGlucoseReadingsEvent(NGPHistoryEvent):
 
             if sg > 0 and sg < 600:
                 yield SensorGlucoseReading(timestamp=timestamp,
-                                           dynamicActionRequestor=self.dynamicActionRequestor,
+                                           dynamicActionRequestor=dynamicActionRequestor,
                                            sg=sg,
-                                           predictedSg=self.predictedSg,
+                                           predictedSg=predictedSg,
                                            noisyData=noisyData,
                                            discardData=discardData,
                                            sensorError=sensorError,
@@ -811,6 +984,13 @@ class SensorGlucoseReading(NGPHistoryEvent):
             self.isig,
             self.rateOfChange)
 
+    @staticmethod
+    def fromReadings(readings, tzinfo=None):
+        """Readings of an array of SensorGlucoseReadingsEvent.READINGS, with the timezone of the timestamps"""
+        columns = [readings[name].tolist() for name in SensorGlucoseReadingsEvent.READINGS.names[1:12]]
+        return [SensorGlucoseReading(timestamp.replace(tzinfo=tzinfo), *values)
+                for timestamp, *values in zip(readings['timestamp'].tolist(), *columns)]
+
     @property
     def source(self):
         return self._dynamicActionRequestor
@@ -836,6 +1016,31 @@ class SensorGlucoseReading(NGPHistoryEvent):
 
 
 class BolusWizardEstimateEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE,)
+    FIELDS = {
+        'bgUnits': EventField(0x0B, 'B'),  # See NGPUtil.NGPConstants.BG_UNITS
+        'carbUnits': EventField(0x0C, 'B'),  # See NGPUtil.NGPConstants.CARB_UNITS
+        # mg/dL and grams are not scaled
+        'bgInput': EventField(0x0D, 'H', scale=10.0, unit='bgUnits', scales={NGPConstants.BG_UNITS.MG_DL: None}),
+        'carbInput': EventField(0x0F, 'H', scale=10.0, unit='carbUnits',
+                                scales={NGPConstants.CARB_UNITS.GRAMS: None}),
+        'isf': EventField(0x11, 'H', scale=10.0, unit='bgUnits', scales={NGPConstants.BG_UNITS.MG_DL: None}),
+        'carbRatio': EventField(0x13, 'I', scale=1000.0, unit='carbUnits',
+                                scales={NGPConstants.CARB_UNITS.GRAMS: 10.0}),
+        'lowBgTarget': EventField(0x17, 'H', scale=10.0, unit='bgUnits', scales={NGPConstants.BG_UNITS.MG_DL: None}),
+        'highBgTarget': EventField(0x19, 'H', scale=10.0, unit='bgUnits',
+                                   scales={NGPConstants.BG_UNITS.MG_DL: None}),
+        'correctionEstimate': EventField(0x1B, '4B', convert=lambda b0, b1, b2, b3:
+                                         ((b0 << 8) | (b1 << 8) | (b2 << 8) | b3) / 10000.0),
+        'foodEstimate': EventField(0x1F, 'I', scale=10000.0),
+        'activeInsulin': EventField(0x23, 'I', scale=10000.0),
+        'activeInsulinCorrection': EventField(0x27, 'I', scale=10000.0),
+        'bolusWizardEstimate': EventField(0x2B, 'I', scale=10000.0),
+        'bolusStepSize': EventField(0x2F, 'B'),  # See NGPUtil.NGPConstants.BOLUS_STEP_SIZE
+        'estimateModifiedByUser': EventField(0x30, 'I', convert=lambda value: (value & 0x01) == 0x01),
+        'finalEstimate': EventField(0x31, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
         self.programmed = False
@@ -866,84 +1071,15 @@ class BolusWizardEstimateEvent(NGPHistoryEvent):
                          self.activeInsulinCorrection,
                          self.programmed)
 
-    @property
-    def bgUnits(self):
-        # See NGPUtil.NGPConstants.BG_UNITS
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
-    @property
-    def carbUnits(self):
-        # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.readByte(self.eventData, 0x0C)  # return this.eventData[0x0C];
-
-    @property
-    def bolusStepSize(self):
-        # See NGPUtil.NGPConstants.BOLUS_STEP_SIZE
-        return BinaryDataDecoder.readByte(self.eventData, 0x2F)  # return this.eventData[0x2F];
-
-    @property
-    def bgInput(self):
-        bgInput = BinaryDataDecoder.readUInt16BE(self.eventData, 0x0D)  # this.eventData.readUInt16BE(0x0D);
-        return bgInput if self.bgUnits == NGPConstants.BG_UNITS.MG_DL else bgInput / 10.0
-
-    @property
-    def carbInput(self):
-        carbs = BinaryDataDecoder.readUInt16BE(self.eventData, 0x0F)  # this.eventData.readUInt16BE(0x0F)
-        return carbs if self.carbUnits == NGPConstants.CARB_UNITS.GRAMS else carbs / 10.0
-
-    @property
-    def foodEstimate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData, 0x1F) / 10000.0;
-
-    @property
-    def carbRatio(self):
-        carbRatio = BinaryDataDecoder.readUInt32BE(self.eventData, 0x13);
-        return carbRatio / 10.0 if (self.carbUnits == NGPConstants.CARB_UNITS.GRAMS) else carbRatio / 1000.0
-
-    @property
-    def isf(self):
-        isf = BinaryDataDecoder.readUInt16BE(self.eventData, 0x11);
-        return isf if self.bgUnits == NGPConstants.BG_UNITS.MG_DL else isf / 10.0
-
-    @property
-    def lowBgTarget(self):
-        bgTarget = BinaryDataDecoder.readUInt16BE(self.eventData, 0x17)
-        return bgTarget if self.bgUnits == NGPConstants.BG_UNITS.MG_DL else bgTarget / 10.0
-
-    @property
-    def highBgTarget(self):
-        bgTarget = BinaryDataDecoder.readUInt16BE(self.eventData, 0x19)
-        return bgTarget if self.bgUnits == NGPConstants.BG_UNITS.MG_DL else bgTarget / 10.0;
-
-    @property
-    def correctionEstimate(self):
-        return ((BinaryDataDecoder.readByte(self.eventData, 0x1B) << 8) |
-                (BinaryDataDecoder.readByte(self.eventData, 0x1C) << 8) |
-                (BinaryDataDecoder.readByte(self.eventData, 0x1D) << 8) |
-                BinaryDataDecoder.readByte(self.eventData, 0x1E)) / 10000.0;
-
-    @property
-    def activeInsulin(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData, 0x23) / 10000.0
-
-    @property
-    def activeInsulinCorrection(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData, 0x27) / 10000.0
-
-    @property
-    def bolusWizardEstimate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData, 0x2B) / 10000.0
-
-    @property
-    def finalEstimate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData, 0x31) / 10000.0
-
-    @property
-    def estimateModifiedByUser(self):
-        return (BinaryDataDecoder.readUInt32BE(self.eventData, 0x30) & 0x01) == 0x01;
-
 
 class BasalSegmentStartEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.BASAL_SEGMENT_START,)
+    FIELDS = {
+        'patternNumber': EventField(0x0B, 'B'),
+        'segmentNumber': EventField(0x0C, 'B'),
+        'rate': EventField(0x0D, 'I', scale=10000.0),
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
 
@@ -954,27 +1090,17 @@ class BasalSegmentStartEvent(NGPHistoryEvent):
                                                                                self.segmentNumber,
                                                                                self.patternName)
 
-    @property
-    def rate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData,
-                                              0x0D) / 10000.0  # return this.eventData.readUInt32BE(0x0D) / 10000.0;
-
-    @property
-    def patternNumber(self):
-        # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
-    @property
-    def segmentNumber(self):
-        # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.readByte(self.eventData, 0x0C)  # return this.eventData[0x0C];
-
     @property
     def patternName(self):
         return NGPConstants.BASAL_PATTERN_NAME[self.patternNumber - 1];
 
 
 class InsulinDeliveryStoppedEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_STOPPED,)
+    FIELDS = {
+        'suspendReason': EventField(0x0B, 'B'),  # See NGPUtil.NGPConstants.SUSPEND_REASON
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
 
@@ -983,17 +1109,17 @@ class InsulinDeliveryStoppedEvent(NGPHistoryEvent):
                                               self.suspendReason,
                                               self.suspendReasonText)
 
-    @property
-    def suspendReason(self):
-        # See NGPUtil.NGPConstants.SUSPEND_REASON
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
     @property
     def suspendReasonText(self):
         return NGPConstants.SUSPEND_REASON_NAME[self.suspendReason]
 
 
 class InsulinDeliveryRestartedEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_RESTARTED,)
+    FIELDS = {
+        'resumeReason': EventField(0x0B, 'B'),  # See NGPUtil.NGPConstants.RESUME_REASON
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
 
@@ -1002,72 +1128,97 @@ class InsulinDeliveryRestartedEvent(NGPHistoryEvent):
                                               self.resumeReason,
                                               self.resumeReasonText)
 
-    @property
-    def resumeReason(self):
-        # See See NGPUtil.NGPConstants.RESUME_REASON
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)  # return this.eventData[0x0B];
-
     @property
     def resumeReasonText(self):
         return NGPConstants.RESUME_REASON_NAME[self.resumeReason]
 
 
 class PLGMControllerStateEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class CalibrationCompleteEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.CALIBRATION_COMPLETE,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class AlarmNotificationEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class AlarmClearedEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class SensorAlertSilenceStartedEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_STARTED,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class SensorAlertSilenceEndedEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_ENDED,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class GeneralSensorSettingsChangeEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.GENERAL_SENSOR_SETTINGS_CHANGE,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class DailyTotalsEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.DAILY_TOTALS,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class SourceIdConfigurationEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.SOURCE_ID_CONFIGURATION,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class StartOfDayMarkerEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.START_OF_DAY_MARKER,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class EndOfDayMarkerEvent(NGPHistoryEvent):
+    EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.END_OF_DAY_MARKER,)
+
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 
 class TempBasalEvent(NGPHistoryEvent):
+    FIELDS = {
+        'presetNumber': EventField(0x0B, 'B'),
+        'type': EventField(0x0C, 'B'),
+        'fixedRate': EventField(0x0D, 'I', scale=10000.0),
+        'percent': EventField(0x11, 'B'),
+        'programmedDurationMin': EventField(0x12, 'H'),
+    }
+
     def __init__(self, eventData):
         NGPHistoryEvent.__init__(self, eventData)
 
@@ -1087,34 +1238,14 @@ class TempBasalEvent(NGPHistoryEvent):
                          self.programmedDurationMin
                          )
 
-    @property
-    def presetNumber(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0B)
-
     @property
     def presetName(self):
         return NGPConstants.TEMP_BASAL_PRESET_NAME[self.presetNumber];
 
-    @property
-    def type(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x0C)
-
     @property
     def typeName(self):
         return "PERCENT" if self.type == NGPConstants.TEMP_BASAL_TYPE.PERCENT else "ABSOLUTE"
 
-    @property
-    def fixedRate(self):
-        return BinaryDataDecoder.readUInt32BE(self.eventData, 0x0D) / 10000.0
-
-    @property
-    def percent(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x11)
-
-    @property
-    def programmedDurationMin(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x12)
-
 
 class TempBasalStartEvent(TempBasalEvent):
     def __init__(self, eventData):
@@ -1122,6 +1253,11 @@ class TempBasalStartEvent(TempBasalEvent):
 
 
 class TempBasalEndEvent(TempBasalEvent):
+    FIELDS = {
+        'unknown': EventField(0x14, 'B'),
+        'realDurationMin': EventField(0x15, 'H'),
+    }
+
     def __init__(self, eventData):
         TempBasalEvent.__init__(self, eventData)
 
@@ -1133,11 +1269,3 @@ class TempBasalEndEvent(TempBasalEvent):
                          self.realDurationMin,
                          self.unknown
                          )
-
-    @property
-    def unknown(self):
-        return BinaryDataDecoder.readByte(self.eventData, 0x14)
-
-    @property
-    def realDurationMin(self):
-        return BinaryDataDecoder.readUInt16BE(self.eventData, 0x15)
@@ -4,21 +4,28 @@ import logging
 
 logger = logging.getLogger('app')
 
-import hid
 import astm  # pip install astm
 import struct
 import binascii
 import datetime
-import crc16  # pip install crc16
 import Crypto.Cipher.AES  # pip install PyCrypto
 import sqlite3
+import atexit
+import json
+import os
 import hashlib
 import re
 import lzo  # pip install python-lzo
-from pump_history_parser import NGPHistoryEvent
-from helpers import DateTimeHelper
+import collections
+import queue
+import threading
+from pump_history_parser import HistoryEventIndex, HistoryEventWindow, NGPHistoryEvent, SensorGlucoseReadingsEvent
+from helpers import CrcHelper, DateTimeContext, DateTimeHelper
 from datetime import time
+from time import perf_counter
 from pump_data import MedtronicDataStatus, MedtronicMeasurementData
+from usb_transport import HidTransport
+from instrumentation import Instrumentation, InstrumentedTransport
 
 ascii = {
     'ACK': 0x06,
@@ -112,20 +119,163 @@ class DataIncompleteError(Exception):
     pass
 
 
-class Config(object):
-    def __init__(self, stickSerial):
-        self.conn = sqlite3.connect('read_minimed.db')
-        self.c = self.conn.cursor()
-        self.c.execute('''CREATE TABLE IF NOT EXISTS
-            config ( stick_serial TEXT PRIMARY KEY, hmac TEXT, key TEXT, last_radio_channel INTEGER )''')
-        self.c.execute("INSERT OR IGNORE INTO config VALUES ( ?, ?, ?, ? )", (stickSerial, '', '', 0x14))
+class ConfigStore(object):
+    """Config rows of all sticks, kept in memory and written back in batches
+
+    There is one store per database file and process, holding a single
+    connection in WAL mode. Reads never touch the database; changed rows are
+    written in one transaction by flush, which the driver calls when it
+    closes the device, and at exit.
+    """
+    DATABASE = 'read_minimed.db'
+    COLUMNS = ('stick_serial', 'hmac', 'key', 'last_radio_channel', 'link_mac', 'pump_mac', 'channel_stats')
+
+    _stores = {}
+    _storesLock = threading.Lock()
+
+    @classmethod
+    def open(cls, path=DATABASE):
+        path = os.path.abspath(path)
+        with cls._storesLock:
+            store = cls._stores.get(path)
+            if store is None:
+                store = cls._stores[path] = cls(path)
+        return store
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = set()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS
+            config ( stick_serial TEXT PRIMARY KEY, hmac TEXT, key TEXT, last_radio_channel INTEGER,
+                     link_mac INTEGER, pump_mac INTEGER, channel_stats TEXT )''')
+        # Databases written by earlier versions lack the columns added since
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(config)')]
+        for column, columnType in (('link_mac', 'INTEGER'), ('pump_mac', 'INTEGER'), ('channel_stats', 'TEXT')):
+            if column not in columns:
+                self.conn.execute('ALTER TABLE config ADD COLUMN {0} {1}'.format(column, columnType))
         self.conn.commit()
 
+        self.rows = {row[0]: list(row) for row in
+                     self.conn.execute('SELECT {0} FROM config'.format(', '.join(self.COLUMNS)))}
+        atexit.register(self.flush)
+
+    def row(self, stickSerial):
+        with self._lock:
+            row = self.rows.get(stickSerial)
+            if row is None:
+                row = self.rows[stickSerial] = [stickSerial, '', '', 0x14, None, None, '']
+                self._dirty.add(stickSerial)
+            return row
+
+    def update(self, stickSerial, values):
+        """Change columns of a stick's row, given as {column index: value}"""
+        with self._lock:
+            row = self.rows[stickSerial]
+            for index, value in values.items():
+                if row[index] != value:
+                    row[index] = value
+                    self._dirty.add(stickSerial)
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [tuple(self.rows[stickSerial]) for stickSerial in self._dirty]
+            self._dirty.clear()
+
+        try:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO config ( {0} ) VALUES ( {1} )'.format(
+                    ', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS))), rows)
+        except sqlite3.Error:
+            logger.warning("Could not write the config database, retrying with the next flush", exc_info=True)
+            with self._lock:
+                self._dirty.update(row[0] for row in rows)
+
+
+class ChannelStatistics(object):
+    """Negotiation results per radio channel of one stick, deciding the order channels are tried in
+
+    Every negotiation decays what was seen before, so a pump that moved to
+    another channel is found there again after a few polls. Channels are
+    ranked by their success rate, adjusted for the signal strength of the
+    network connect response, noisy/busy 0x81 responses and latency.
+    Channels without data rank like an even chance and keep their order.
+    """
+    DECAY = 0.8
+    RSSI_WEIGHT = 0.1
+    NOISY_WEIGHT = 0.25
+    LATENCY_WEIGHT = 0.1  # per second
+
+    def __init__(self, channels=None):
+        self.channels = channels if channels is not None else {}
+
+    @classmethod
+    def fromJson(cls, text):
+        if not text:
+            return cls()
+        try:
+            return cls({int(channel): values for channel, values in json.loads(text).items()})
+        except (ValueError, AttributeError):
+            logger.warning("Ignoring invalid channel statistics in the config database")
+            return cls()
+
+    def toJson(self):
+        return json.dumps({str(channel): values for channel, values in self.channels.items()}, sort_keys=True)
+
+    def decay(self):
+        for values in self.channels.values():
+            for name in ('attempts', 'successes', 'noisy'):
+                values[name] *= self.DECAY
+
+    def record(self, channel, success, rssi=None, noisy=False, latency=None):
+        values = self.channels.setdefault(channel, {'attempts': 0.0, 'successes': 0.0, 'noisy': 0.0,
+                                                    'rssi': None, 'latency': None})
+        values['attempts'] += 1
+        if success:
+            values['successes'] += 1
+        if noisy:
+            values['noisy'] += 1
+        for name, value in (('rssi', rssi), ('latency', latency)):
+            if value is not None:
+                average = values[name]
+                values[name] = value if average is None else average + (value - average) * (1 - self.DECAY)
+
+    def score(self, channel):
+        values = self.channels.get(channel)
+        if values is None:
+            return 0.5
+        score = (values['successes'] + 0.5) / (values['attempts'] + 1)
+        if values['attempts'] > 0:
+            score -= self.NOISY_WEIGHT * values['noisy'] / values['attempts']
+        if values['rssi'] is not None:
+            score += self.RSSI_WEIGHT * values['rssi'] / 255.0
+        if values['latency'] is not None:
+            score -= self.LATENCY_WEIGHT * values['latency']
+        return score
+
+    def order(self, channels):
+        """Channels without duplicates, best first"""
+        channels = list(dict.fromkeys(channels))
+        return sorted(channels, key=self.score, reverse=True)
+
+
+class Config(object):
+    def __init__(self, stickSerial, store=None):
+        self.store = store if store is not None else ConfigStore.open()
         self.loadConfig(stickSerial)
 
     def loadConfig(self, stickSerial):
-        self.c.execute('SELECT * FROM config WHERE stick_serial = ?', (stickSerial,))
-        self.data = self.c.fetchone()
+        self.data = self.store.row(stickSerial)
+        self._channelStatistics = None
+
+    def flush(self):
+        self.store.flush()
 
     @property
     def stickSerial(self):
@@ -137,9 +287,7 @@ class Config(object):
 
     @lastRadioChannel.setter
     def lastRadioChannel(self, value):
-        self.c.execute("UPDATE config SET last_radio_channel = ? WHERE stick_serial = ?", (value, self.stickSerial))
-        self.conn.commit()
-        self.loadConfig(self.stickSerial)
+        self.store.update(self.stickSerial, {3: value})
 
     @property
     def hmac(self):
@@ -147,9 +295,7 @@ class Config(object):
 
     @hmac.setter
     def hmac(self, value):
-        self.c.execute("UPDATE config SET hmac = ? WHERE stick_serial = ?", (value, self.stickSerial))
-        self.conn.commit()
-        self.loadConfig(self.stickSerial)
+        self.store.update(self.stickSerial, {1: value})
 
     @property
     def key(self):
@@ -157,23 +303,146 @@ class Config(object):
 
     @key.setter
     def key(self, value):
-        self.c.execute("UPDATE config SET key = ? WHERE stick_serial = ?", (value, self.stickSerial))
+        self.store.update(self.stickSerial, {2: value})
+
+    @property
+    def linkMAC(self):
+        return self.data[4]
+
+    @property
+    def pumpMAC(self):
+        return self.data[5]
+
+    def storeCredentials(self, linkMAC, pumpMAC, key):
+        self.store.update(self.stickSerial, {4: linkMAC, 5: pumpMAC, 2: key})
+
+    @property
+    def channelStatistics(self):
+        if self._channelStatistics is None:
+            self._channelStatistics = ChannelStatistics.fromJson(self.data[6])
+        return self._channelStatistics
+
+    @channelStatistics.setter
+    def channelStatistics(self, value):
+        self._channelStatistics = value
+        self.store.update(self.stickSerial, {6: value.toJson()})
+
+
+class HistoryCheckpoints(object):
+    """Completed segments of history transfers, kept to resume an interrupted transfer
+
+    Every segment is stored with the RTC range it covers: from the start of
+    the request, or the end of the segment before it, up to its last event.
+    Unlike the config rows, each segment is written as soon as it is stored,
+    so the segments survive a lost connection or a crash.
+    """
+
+    def __init__(self, path=ConfigStore.DATABASE):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS
+            history_segments ( pump_mac INTEGER, history_type INTEGER, from_rtc INTEGER, to_rtc INTEGER,
+                               segment BLOB, PRIMARY KEY ( pump_mac, history_type, from_rtc ) )''')
         self.conn.commit()
-        self.loadConfig(self.stickSerial)
+
+    def store(self, pumpMAC, historyType, fromRtc, toRtc, segment):
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO history_segments VALUES ( ?, ?, ?, ?, ? )',
+                              (pumpMAC, historyType, fromRtc, toRtc, bytes(segment)))
+
+    def resume(self, pumpMAC, historyType, fromRtc):
+        """Stored segments covering the history from fromRtc on without a gap, and the RTC to continue at
+
+        The first segment may reach further back than fromRtc, like the whole
+        pages the pump sends.
+        """
+        segments = []
+        with self._lock:
+            rows = self.conn.execute('SELECT from_rtc, to_rtc, segment FROM history_segments '
+                                     'WHERE pump_mac = ? AND history_type = ? AND to_rtc >= ? ORDER BY from_rtc',
+                                     (pumpMAC, historyType, fromRtc)).fetchall()
+        for segmentFrom, segmentTo, segment in rows:
+            if segmentFrom > fromRtc:
+                break
+            segments.append(bytearray(segment))
+            fromRtc = segmentTo + 1
+        return segments, fromRtc
+
+    def discard(self, pumpMAC, historyType, beforeRtc):
+        """Drop the segments ending before beforeRtc"""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM history_segments WHERE pump_mac = ? AND history_type = ? AND to_rtc < ?',
+                              (pumpMAC, historyType, beforeRtc))
+
+
+class MedtronicCipher(object):
+    """AES-CFB with a 128 bit segment size, equivalent to Java's AES/CFB/NoPadding mode
+
+    The key schedule is expanded once into an ECB cipher and the IV kept as
+    bytes. Every CFB keystream block is the encryption of the previous
+    ciphertext block, so decryption needs a single ECB call over the IV and
+    the ciphertext, for one message or a whole batch of them.
+    """
+    BLOCK_SIZE = 16
+
+    def __init__(self, key, iv):
+        self.key = bytes(key)
+        self.iv = bytes(iv)
+        self._ecb = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_ECB)
+
+    @staticmethod
+    def _xor(data, keystream):
+        size = len(data)
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream[:size], 'big')).to_bytes(size, 'big')
+
+    def _feedback(self, encrypted):
+        # the IV followed by all but the last ciphertext block
+        return self.iv + encrypted[:(len(encrypted) - 1) // self.BLOCK_SIZE * self.BLOCK_SIZE]
+
+    def encrypt(self, clear):
+        encrypted = []
+        feedback = self.iv
+        for start in range(0, len(clear), self.BLOCK_SIZE):
+            feedback = self._xor(clear[start:start + self.BLOCK_SIZE], self._ecb.encrypt(feedback))
+            encrypted.append(feedback)
+        return b''.join(encrypted)
+
+    def decrypt(self, encrypted):
+        if not encrypted:
+            return b''
+        return self._xor(encrypted, self._ecb.encrypt(self._feedback(encrypted)))
+
+    def decryptBatch(self, messages):
+        """Decrypt several messages with one ECB call"""
+        keystream = self._ecb.encrypt(b''.join(self._feedback(message) for message in messages if message))
+
+        decrypted = []
+        position = 0
+        for message in messages:
+            decrypted.append(self._xor(message, keystream[position:position + len(message)]))
+            position += -(-len(message) // self.BLOCK_SIZE) * self.BLOCK_SIZE
+        return decrypted
 
 
 class MedtronicSession(object):
+    config = None
     radioChannel = None
+    _cipher = None
     bayerSequenceNumber = 1
     minimedSequenceNumber = 1
     sendSequenceNumber = 0
 
     @property
     def HMAC(self):
-        serial = bytearray(re.sub(r"\d+-", "", self.stickSerial), 'ascii')
-        paddingKey = b"A4BD6CED9A42602564F413123"
-        digest = hashlib.sha256(serial + paddingKey).hexdigest()
-        return "".join(reversed([digest[i:i + 2] for i in range(0, len(digest), 2)]))
+        # Only depends on the stick serial, so it is computed once and kept in the config of the stick
+        if not self.config.hmac:
+            serial = bytearray(re.sub(r"\d+-", "", self.stickSerial), 'ascii')
+            paddingKey = b"A4BD6CED9A42602564F413123"
+            digest = hashlib.sha256(serial + paddingKey).hexdigest()
+            self.config.hmac = "".join(reversed([digest[i:i + 2] for i in range(0, len(digest), 2)]))
+        return self.config.hmac
 
     @property
     def hexKey(self):
@@ -230,6 +499,26 @@ class MedtronicSession(object):
         tmp += self.KEY[1:]
         return bytes(tmp)
 
+    @property
+    def cipher(self):
+        """Crypto context for the current link key and radio channel"""
+        if self._cipher is None or self._cipherChannel != self.radioChannel or self._cipher.key != self.KEY:
+            self._cipher = MedtronicCipher(self.KEY, self.IV)
+            self._cipherChannel = self.radioChannel
+        return self._cipher
+
+    def loadCredentials(self):
+        """Restore link MAC, pump MAC and link key cached for the stick, False if there are none"""
+        if not self.config.key or self.config.linkMAC is None or self.config.pumpMAC is None:
+            return False
+        self.linkMAC = self.config.linkMAC
+        self.pumpMAC = self.config.pumpMAC
+        self.KEY = binascii.unhexlify(self.config.key)
+        return True
+
+    def storeCredentials(self):
+        self.config.storeCredentials(self.linkMAC, self.pumpMAC, binascii.hexlify(self.KEY).decode('ascii'))
+
 
 class MedtronicMessage(object):
     ENVELOPE_SIZE = 2
@@ -247,8 +536,7 @@ class MedtronicMessage(object):
 
     @classmethod
     def calculateCcitt(self, data):
-        crc = crc16.crc16xmodem(bytes(data), 0xffff)
-        return crc & 0xffff
+        return CrcHelper.ccitt(data)
 
     def pad(self, x, n=16):
         p = n - (len(x) % n)
@@ -256,48 +544,34 @@ class MedtronicMessage(object):
 
     # Encrpytion equivalent to Java's AES/CFB/NoPadding mode
     def encrypt(self, clear):
-        cipher = Crypto.Cipher.AES.new(
-            key=self.session.KEY,
-            mode=Crypto.Cipher.AES.MODE_CFB,
-            IV=self.session.IV,
-            segment_size=128
-        )
-
-        encrypted = cipher.encrypt(self.pad(clear))[0:len(clear)]
-        return encrypted
+        return self.session.cipher.encrypt(clear)
 
     # Decryption equivalent to Java's AES/CFB/NoPadding mode
     def decrypt(self, encrypted):
-        cipher = Crypto.Cipher.AES.new(
-            key=self.session.KEY,
-            mode=Crypto.Cipher.AES.MODE_CFB,
-            IV=self.session.IV,
-            segment_size=128
-        )
-
-        decrypted = cipher.decrypt(self.pad(encrypted))[0:len(encrypted)]
-        return decrypted
+        return self.session.cipher.decrypt(encrypted)
 
     def encode(self):
         # Increment the Minimed Sequence Number
         self.session.minimedSequenceNumber += 1
         message = self.envelope + self.payload
-        crc = struct.pack('<H', crc16.crc16xmodem(message, 0xffff) & 0xffff)
+        crc = struct.pack('<H', CrcHelper.ccitt(message))
         return message + crc
 
+    @classmethod
+    def verifyChecksum(cls, message):
+        checksum = struct.unpack_from('<H', message, len(message) - 2)[0]
+        calcChecksum = CrcHelper.ccitt(memoryview(message)[:-2])
+        if (checksum != calcChecksum):
+            raise ChecksumException('Expected to get {0}. Got {1}'.format(calcChecksum, checksum))
+
     @classmethod
     def decode(cls, message, session):
+        cls.verifyChecksum(message)
         response = cls()
         response.session = session
         response.envelope = message[0:2]
         response.payload = message[2:-2]
         response.originalMessage = message;
-
-        checksum = struct.unpack('<H', message[-2:])[0]
-        calcChecksum = MedtronicMessage.calculateCcitt(response.envelope + response.payload)
-        if (checksum != calcChecksum):
-            raise ChecksumException('Expected to get {0}. Got {1}'.format(calcChecksum, checksum))
-
         return response
 
 
@@ -328,8 +602,7 @@ class MedtronicSendMessage(MedtronicMessage):
         encryptedPayload = struct.pack('>BH', seqNo, messageType)
         if payload:
             encryptedPayload += payload
-        crc = crc16.crc16xmodem(encryptedPayload, 0xffff)
-        encryptedPayload += struct.pack('>H', crc & 0xffff)
+        encryptedPayload += struct.pack('>H', CrcHelper.ccitt(encryptedPayload))
         # logger.debug("### PAYLOAD")
         # logger.debug(binascii.hexlify( encryptedPayload ))
 
@@ -346,51 +619,90 @@ class MedtronicSendMessage(MedtronicMessage):
 
 
 class MedtronicReceiveMessage(MedtronicMessage):
+    """A decrypted message of the pump
+
+    Subclasses list the COM_D_COMMAND response codes they decode in
+    RESPONSE_TYPES and are registered for them when they are defined. Every
+    message is decoded straight into the class registered for its type, or
+    into MedtronicReceiveMessage for unknown types.
+    """
+    RESPONSE_TYPES = ()
+    ENVELOPE_SIZE = 22
+    _responseClasses = {}
 
     def __init__(self, session=None, responsePayload=None):
         MedtronicMessage.__init__(self, session=session)
         self.responsePayload = responsePayload
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Only the types a class lists itself, subclasses of a registered class do not take over its types
+        for responseType in cls.__dict__.get('RESPONSE_TYPES', ()):
+            MedtronicReceiveMessage._responseClasses[responseType] = cls
+
+    @classmethod
+    def responseClass(cls, messageType):
+        return cls._responseClasses.get(messageType, MedtronicReceiveMessage)
+
     @classmethod
     def decode(cls, message, session):
-        response = MedtronicMessage.decode(message, session)
+        cls.verifyChecksum(message)
+        response = cls._decodeDecrypted(message, session, session.cipher.decrypt(cls._encryptedPayload(message)))
+        if not isinstance(response, cls):
+            raise UnexpectedMessageException("Expected to get a {0} message [{1}]. Got 0x{2:x}.".format(
+                cls.__name__, ''.join('%04x ' % i for i in cls.RESPONSE_TYPES), response.messageType))
+        return response
 
-        # TODO - check validity of the envelope
-        response.responseEnvelope = response.payload[0:22]
-        decryptedResponsePayload = response.decrypt(bytes(response.payload[22:]))
+    @classmethod
+    def decodeBatch(cls, messages, session):
+        """Decode several messages with one decryption call
 
-        response.responsePayload = decryptedResponsePayload[0:-2]
+        Errors are returned in place of their message, so the messages before
+        them can still be processed in order.
+        """
+        responses = []
+        for message in messages:
+            try:
+                cls.verifyChecksum(message)
+                responses.append(message)
+            except ChecksumException as ex:
+                responses.append(ex)
+
+        decrypted = iter(session.cipher.decryptBatch(
+            [cls._encryptedPayload(message) for message in responses if not isinstance(message, Exception)]))
+        for i, message in enumerate(responses):
+            if not isinstance(message, Exception):
+                try:
+                    responses[i] = cls._decodeDecrypted(message, session, next(decrypted))
+                except ChecksumException as ex:
+                    responses[i] = ex
+        return responses
+
+    @classmethod
+    def _encryptedPayload(cls, message):
+        return bytes(memoryview(message)[MedtronicMessage.ENVELOPE_SIZE + cls.ENVELOPE_SIZE:-2])
 
+    @staticmethod
+    def _decodeDecrypted(message, session, decryptedResponsePayload):
         # logger.debug("### DECRYPTED PAYLOAD:")
-        # logger.debug(binascii.hexlify( response.responsePayload ))
+        # logger.debug(binascii.hexlify( decryptedResponsePayload[0:-2] ))
 
-        if len(response.responsePayload) > 2:
-            checksum = struct.unpack('>H', decryptedResponsePayload[-2:])[0]
-            calcChecksum = MedtronicMessage.calculateCcitt(response.responsePayload)
+        if len(decryptedResponsePayload) > 4:
+            checksum = struct.unpack_from('>H', decryptedResponsePayload, len(decryptedResponsePayload) - 2)[0]
+            calcChecksum = CrcHelper.ccitt(memoryview(decryptedResponsePayload)[:-2])
             if (checksum != calcChecksum):
                 raise ChecksumException('Expected to get {0}. Got {1}'.format(calcChecksum, checksum))
+            responseClass = MedtronicReceiveMessage.responseClass(
+                struct.unpack_from('>H', decryptedResponsePayload, 1)[0])
+        else:
+            responseClass = MedtronicReceiveMessage
 
-        response.__class__ = MedtronicReceiveMessage
-
-        if response.messageType == COM_D_COMMAND.TIME_RESPONSE:
-            response.__class__ = PumpTimeResponseMessage
-        elif response.messageType == COM_D_COMMAND.READ_HISTORY_INFO_RESPONSE:
-            response.__class__ = PumpHistoryInfoResponseMessage
-        elif response.messageType == COM_D_COMMAND.READ_PUMP_STATUS_RESPONSE:
-            response.__class__ = PumpStatusResponseMessage
-        elif response.messageType == COM_D_COMMAND.INITIATE_MULTIPACKET_TRANSFER:
-            response.__class__ = MultiPacketSegment
-        elif response.messageType == COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION:
-            response.__class__ = MultiPacketSegment
-        elif response.messageType == COM_D_COMMAND.END_HISTORY_TRANSMISSION:
-            response.__class__ = MultiPacketSegment
-        elif response.messageType == COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE:
-            response.__class__ = PumpBolusWizardCarbRatiosResponseMessage
-        elif response.messageType == COM_D_COMMAND.READ_BOLUS_WIZARD_SENSITIVITY_FACTORS_RESPONSE:
-            response.__class__ = PumpBolusWizardSensitivityFactorsResponseMessage
-        elif response.messageType == COM_D_COMMAND.READ_BOLUS_WIZARD_BG_TARGETS_RESPONSE:
-            response.__class__ = PumpBolusWizardBGTargetsResponseMessage
-
+        response = responseClass(session, decryptedResponsePayload[0:-2])
+        # TODO - check validity of the envelope
+        response.envelope = message[0:MedtronicMessage.ENVELOPE_SIZE]
+        response.responseEnvelope = message[MedtronicMessage.ENVELOPE_SIZE:
+                                            MedtronicMessage.ENVELOPE_SIZE + MedtronicReceiveMessage.ENVELOPE_SIZE]
+        response.originalMessage = message
         return response
 
     @property
@@ -452,17 +764,7 @@ class ReadLinkKeyResponseMessage(object):
 
 
 class PumpTimeResponseMessage(MedtronicReceiveMessage):
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        if response.messageType != COM_D_COMMAND.TIME_RESPONSE:
-            raise UnexpectedMessageException(
-                "Expected to get a Time Response message '{0}'. Got {1}.".format(COM_D_COMMAND.TIME_RESPONSE,
-                                                                                 response.messageType))
-
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = PumpTimeResponseMessage
-        return response
+    RESPONSE_TYPES = (COM_D_COMMAND.TIME_RESPONSE,)
 
     @property
     def timeSet(self):
@@ -487,15 +789,7 @@ class PumpTimeResponseMessage(MedtronicReceiveMessage):
 
 
 class PumpHistoryInfoResponseMessage(MedtronicReceiveMessage):
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        if response.messageType != COM_D_COMMAND.READ_HISTORY_INFO_RESPONSE:
-            raise UnexpectedMessageException("Expected to get a Time Response message '{0}'. Got {1}.".format(
-                COM_D_COMMAND.READ_HISTORY_INFO_RESPONSE, response.messageType))
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = PumpHistoryInfoResponseMessage
-        return response
+    RESPONSE_TYPES = (COM_D_COMMAND.READ_HISTORY_INFO_RESPONSE,)
 
     @property
     def historySize(self):
@@ -521,12 +815,8 @@ class PumpHistoryInfoResponseMessage(MedtronicReceiveMessage):
 
 
 class MultiPacketSegment(MedtronicReceiveMessage):
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = MultiPacketSegment
-        return response
+    RESPONSE_TYPES = (COM_D_COMMAND.INITIATE_MULTIPACKET_TRANSFER, COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION,
+                      COM_D_COMMAND.END_HISTORY_TRANSMISSION)
 
     @property
     def packetNumber(self):
@@ -553,174 +843,137 @@ class MultiPacketSegment(MedtronicReceiveMessage):
         return struct.unpack('>H', self.responsePayload[11:13])[0]
 
 
-class PumpStatusResponseMessage(MedtronicReceiveMessage):
-    MMOL = 1
-    MGDL = 2
-
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        if response.messageType != COM_D_COMMAND.READ_PUMP_STATUS_RESPONSE:
-            raise UnexpectedMessageException("Expected to get a Status Response message '{0}'. Got {1}.".format(
-                COM_D_COMMAND.READ_PUMP_STATUS_RESPONSE, response.messageType))
-
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = PumpStatusResponseMessage
-        return response
-
-    @property
-    def currentBasalRate(self):
-        return float(struct.unpack('>I', self.responsePayload[0x1b:0x1f])[0]) / 10000
-
-    @property
-    def tempBasalRate(self):
-        return float(struct.unpack('>H', self.responsePayload[0x21:0x23])[0]) / 10000
-
-    @property
-    def tempBasalPercentage(self):
-        return int(struct.unpack('>B', self.responsePayload[0x23:0x24])[0])
-
-    @property
-    def tempBasalMinutesRemaining(self):
-        return int(struct.unpack('>H', self.responsePayload[0x24:0x26])[0])
-
-    @property
-    def batteryLevelPercentage(self):
-        return int(struct.unpack('>B', self.responsePayload[0x2a:0x2b])[0])
-
-    @property
-    def insulinUnitsRemaining(self):
-        return int(struct.unpack('>I', self.responsePayload[0x2b:0x2f])[0]) / 10000
-
-    @property
-    def activeInsulin(self):
-        return float(struct.unpack('>I', self.responsePayload[0x31:0x35])[0]) / 10000
-
-    @property
-    def sensorBGL(self):
-        return int(struct.unpack('>H', self.responsePayload[0x35:0x37])[0])
-
-    @property
-    def trendArrowValue(self):
-        if self.StatusCgm:
-            status = int(struct.unpack('>B', self.responsePayload[0x40:0x41])[0])
-            if status & 0xF0 == 0x60:
-                return 0
-            elif status & 0xF0 == 0xc0:
-                return 3
-            elif status & 0xF0 == 0xa0:
-                return 2
-            elif status & 0xF0 == 0x80:
-                return 1
-            elif status & 0xF0 == 0x40:
-                return -1
-            elif status & 0xF0 == 0x20:
-                return -2
-            elif status & 0xF0 == 0x00:
-                return -3
-            else:
-                return None
-        else:
-            return None
+class PumpStatusSnapshot(object):
+    """All values of a pump status response, decoded in one pass"""
+    # Offsets of the fields in the decrypted response payload:
+    #   0x03 status flags, 0x10 last bolus amount, 0x14 last bolus time, 0x1b current basal rate,
+    #   0x21 temp basal rate, 0x23 temp basal percentage, 0x24 temp basal minutes remaining, 0x2a battery level,
+    #   0x2b insulin units remaining, 0x31 active insulin, 0x35 sensor BGL, 0x37 sensor BGL time,
+    #   0x40 trend, 0x41 sensor status, 0x42 sensor control, 0x43 calibration minutes remaining,
+    #   0x45 sensor battery, 0x46 rate of change, 0x48 recent bolus wizard, 0x49 bolus wizard BGL
+    LAYOUT = struct.Struct('>3xB12xII3xI2xHBH4xBI2xIHQx3BHBhBH')
+
+    # Upper nibble of the trend byte
+    TREND_ARROWS = {
+        0xc0: ("3 arrows up", 3),
+        0xa0: ("2 arrows up", 2),
+        0x80: ("1 arrow up", 1),
+        0x60: ("No arrows", 0),
+        0x40: ("1 arrow down", -1),
+        0x20: ("2 arrows down", -2),
+        0x00: ("3 arrows down", -3),
+        0xe0: ("Unknown trend", None),
+    }
+    SENSOR_STATUS = {
+        0x00: "Sensor init cycle.",
+        0x04: "Sensor not calibrated.",
+        0x10: "Sensor operational.",
+        0x14: "Sensor operational (high BGL).",
+    }
+
+    __slots__ = ('payload', 'StatusValue', 'lastBolusAmount', 'encodedLastBolusTimestamp', 'currentBasalRate',
+                 'tempBasalRate', 'tempBasalPercentage', 'tempBasalMinutesRemaining', 'batteryLevelPercentage',
+                 'insulinUnitsRemaining', 'activeInsulin', 'sensorBGL', 'sensorBGLTimestamp', 'trendArrow',
+                 'trendArrowValue', 'sensorStatusValue', 'sensorStatus', 'sensorControlValue',
+                 'sensorCalibrationMinutesRemaining', 'sensorBatteryPercent', 'sensorRateOfChangePerMin',
+                 'recentBolusWizard', 'bolusWizardBGL')
+
+    def __init__(self, payload):
+        self.payload = payload
+        (self.StatusValue, lastBolusAmount, self.encodedLastBolusTimestamp, currentBasalRate, tempBasalRate,
+         self.tempBasalPercentage, self.tempBasalMinutesRemaining, self.batteryLevelPercentage, insulinUnitsRemaining,
+         activeInsulin, self.sensorBGL, sensorBGLTimestamp, trend, self.sensorStatusValue, self.sensorControlValue,
+         self.sensorCalibrationMinutesRemaining, sensorBattery, sensorRateOfChange, recentBolusWizard,
+         self.bolusWizardBGL) = self.LAYOUT.unpack_from(payload)
+
+        self.lastBolusAmount = float(lastBolusAmount) / 10000
+        self.currentBasalRate = float(currentBasalRate) / 10000
+        self.tempBasalRate = float(tempBasalRate) / 10000
+        self.insulinUnitsRemaining = insulinUnitsRemaining / 10000
+        self.activeInsulin = float(activeInsulin) / 10000
+        self.sensorBGLTimestamp = DateTimeHelper.decodeDateTime(sensorBGLTimestamp)
+        self.sensorBatteryPercent = 100 * (0x0F & sensorBattery) / 0x0F
+        self.sensorRateOfChangePerMin = float(sensorRateOfChange) / 100
+        self.recentBolusWizard = recentBolusWizard != 0
 
-    @property
-    def trendArrow(self):
         if self.StatusCgm:
-            status = int(struct.unpack('>B', self.responsePayload[0x40:0x41])[0])
-            if status & 0xF0 == 0x60:
-                return "No arrows"
-            elif status & 0xF0 == 0xc0:
-                return "3 arrows up"
-            elif status & 0xF0 == 0xa0:
-                return "2 arrows up"
-            elif status & 0xF0 == 0x80:
-                return "1 arrow up"
-            elif status & 0xF0 == 0x40:
-                return "1 arrow down"
-            elif status & 0xF0 == 0x20:
-                return "2 arrows down"
-            elif status & 0xF0 == 0x00:
-                return "3 arrows down"
-            elif status & 0xF0 == 0xE0:
-                return "Unknown trend"
+            self.trendArrow, self.trendArrowValue = self.TREND_ARROWS.get(trend & 0xF0, (None, None))
+            self.sensorStatus = self._sensorStatus(self.sensorStatusValue)
         else:
-            return None
-
-    @property
-    def sensorRateOfChangePerMin(self):
-        status = float(struct.unpack('>h', self.responsePayload[0x46:0x48])[0]) / 100
-        return status
-
-    @property
-    def sensorStatusValue(self):
-        status = int(struct.unpack('>B', self.responsePayload[0x41:0x42])[0])
-        return status
-
-    @property
-    def sensorStatus(self):
-        if not self.StatusCgm:
-            return None
-        status = int(struct.unpack('>B', self.responsePayload[0x41:0x42])[0])
-        ret = "Unknown sensor status: 0x{:02X}".format(status)
-        if status == 0x00:
-            ret = "Sensor init cycle."
-        elif status == 0x04:
-            ret = "Sensor not calibrated."
-        elif status == 0x10:
-            ret = "Sensor operational."
-        elif status == 0x14:
-            ret = "Sensor operational (high BGL)."
+            self.trendArrow = self.trendArrowValue = self.sensorStatus = None
 
+    @classmethod
+    def _sensorStatus(cls, status):
+        ret = cls.SENSOR_STATUS.get(status, "Unknown sensor status: 0x{:02X}".format(status))
         # value not observed so far on 640 pump
         if status & 0x01 == 0x01:
             ret = "{} Calibrating.".format(ret)
         # value not observed so far on 640 pump
         elif status & 0x02 == 0x02:
             ret = "{} Calibration complete.".format(ret)
-
         return ret
 
     @property
-    def sensorControl(self):
-        status = int(struct.unpack('>B', self.responsePayload[0x42:0x43])[0])
-        return "0x{0:02X} ({0:08b})".format(status)
-        return status
+    def StatusCgm(self):
+        return self.StatusValue & 0x40 != 0
 
     @property
-    def sensorControlValue(self):
-        status = int(struct.unpack('>B', self.responsePayload[0x42:0x43])[0])
-        return status
+    def lastBolusTimestamp(self):
+        return DateTimeHelper.decodeDateTime(self.encodedLastBolusTimestamp, 0)
 
-    @property
-    def sensorCalibrationMinutesRemaining(self):
-        minutes = int(struct.unpack('>H', self.responsePayload[0x43:0x45])[0])
-        return minutes
+    def measurementData(self):
+        return MedtronicMeasurementData(bgl_value=self.sensorBGL, trend=self.trendArrow,
+                                        active_insulin=self.activeInsulin, current_basal_rate=self.currentBasalRate,
+                                        temporary_basal_percentage=self.tempBasalPercentage,
+                                        battery_level=self.batteryLevelPercentage,
+                                        insulin_units_remaining=self.insulinUnitsRemaining,
+                                        status=MedtronicDataStatus.valid, timestamp=self.sensorBGLTimestamp)
 
-    @property
-    def sensorBatteryPercent(self):
-        battery_percent = 100 * (0x0F & int(struct.unpack('>B', self.responsePayload[0x45:0x46])[0])) / 0x0F
-        return battery_percent
 
-    @property
-    def sensorBGLTimestamp(self):
-        dateTimeData = struct.unpack('>Q', self.responsePayload[55:63])[0]
-        return DateTimeHelper.decodeDateTime(dateTimeData)
+def _snapshotProperty(name):
+    return property(lambda self: getattr(self.snapshot, name))
 
-    @property
-    def recentBolusWizard(self):
-        if self.responsePayload[72] == 0:
-            return False
-        else:
-            return True
 
-    @property
-    def bolusWizardBGL(self):
-        return struct.unpack('>H', self.responsePayload[0x49:0x4B])[0]
+class PumpStatusResponseMessage(MedtronicReceiveMessage):
+    RESPONSE_TYPES = (COM_D_COMMAND.READ_PUMP_STATUS_RESPONSE,)
+    MMOL = 1
+    MGDL = 2
+
+    _snapshot = None
+
+    @property
+    def snapshot(self):
+        """The decoded status, decoded again only when responsePayload is replaced"""
+        if self._snapshot is None or self._snapshot.payload is not self.responsePayload:
+            self._snapshot = PumpStatusSnapshot(self.responsePayload)
+        return self._snapshot
+
+    currentBasalRate = _snapshotProperty('currentBasalRate')
+    tempBasalRate = _snapshotProperty('tempBasalRate')
+    tempBasalPercentage = _snapshotProperty('tempBasalPercentage')
+    tempBasalMinutesRemaining = _snapshotProperty('tempBasalMinutesRemaining')
+    batteryLevelPercentage = _snapshotProperty('batteryLevelPercentage')
+    insulinUnitsRemaining = _snapshotProperty('insulinUnitsRemaining')
+    activeInsulin = _snapshotProperty('activeInsulin')
+    sensorBGL = _snapshotProperty('sensorBGL')
+    trendArrowValue = _snapshotProperty('trendArrowValue')
+    trendArrow = _snapshotProperty('trendArrow')
+    sensorRateOfChangePerMin = _snapshotProperty('sensorRateOfChangePerMin')
+    sensorStatusValue = _snapshotProperty('sensorStatusValue')
+    sensorStatus = _snapshotProperty('sensorStatus')
+    sensorControlValue = _snapshotProperty('sensorControlValue')
+    sensorCalibrationMinutesRemaining = _snapshotProperty('sensorCalibrationMinutesRemaining')
+    sensorBatteryPercent = _snapshotProperty('sensorBatteryPercent')
+    sensorBGLTimestamp = _snapshotProperty('sensorBGLTimestamp')
+    recentBolusWizard = _snapshotProperty('recentBolusWizard')
+    bolusWizardBGL = _snapshotProperty('bolusWizardBGL')
+    StatusValue = _snapshotProperty('StatusValue')
+    lastBolusAmount = _snapshotProperty('lastBolusAmount')
+    lastBolusTimestamp = _snapshotProperty('lastBolusTimestamp')
 
     @property
-    def StatusValue(self):
-        status = int(struct.unpack('>B', self.responsePayload[0x03:0x04])[0])
-        return status
+    def sensorControl(self):
+        return "0x{0:02X} ({0:08b})".format(self.sensorControlValue)
 
     @property
     def StatusCgm(self):
@@ -763,15 +1016,6 @@ class PumpStatusResponseMessage(MedtronicReceiveMessage):
         }
         return status
 
-    @property
-    def lastBolusAmount(self):
-        return float(struct.unpack('>I', self.responsePayload[0x10:0x14])[0]) / 10000
-
-    @property
-    def lastBolusTimestamp(self):
-        dateTimeData = struct.unpack('>L', self.responsePayload[0x14:0x18])[0]
-        return DateTimeHelper.decodeDateTime(dateTimeData, 0)
-
 
 class PumpBolusWizardAbstractResponseMessage(MedtronicReceiveMessage):
 
@@ -801,16 +1045,7 @@ class PumpBolusWizardAbstractResponseMessage(MedtronicReceiveMessage):
 
 
 class PumpBolusWizardCarbRatiosResponseMessage(PumpBolusWizardAbstractResponseMessage):
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        if response.messageType != COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE:
-            raise UnexpectedMessageException("Expected to get a Carb Ratios Response message '{0}'. Got {1}.".format(
-                COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE, response.messageType))
-
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = PumpBolusWizardCarbRatiosResponseMessage
-        return response
+    RESPONSE_TYPES = (COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE,)
 
     @classmethod
     def get_record_size(cls):
@@ -838,16 +1073,7 @@ class PumpBolusWizardCarbRatiosResponseMessage(PumpBolusWizardAbstractResponseMe
 
 
 class PumpBolusWizardSensitivityFactorsResponseMessage(PumpBolusWizardAbstractResponseMessage):
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        if response.messageType != COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE:
-            raise UnexpectedMessageException("Expected to get a Carb Ratios Response message '{0}'. Got {1}.".format(
-                COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE, response.messageType))
-
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = PumpBolusWizardSensitivityFactorsResponseMessage
-        return response
+    RESPONSE_TYPES = (COM_D_COMMAND.READ_BOLUS_WIZARD_SENSITIVITY_FACTORS_RESPONSE,)
 
     @classmethod
     def get_record_size(cls):
@@ -880,16 +1106,7 @@ class PumpBolusWizardSensitivityFactorsResponseMessage(PumpBolusWizardAbstractRe
 
 
 class PumpBolusWizardBGTargetsResponseMessage(PumpBolusWizardAbstractResponseMessage):
-    @classmethod
-    def decode(cls, message, session):
-        response = MedtronicReceiveMessage.decode(message, session)
-        if response.messageType != COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE:
-            raise UnexpectedMessageException("Expected to get a Carb Ratios Response message '{0}'. Got {1}.".format(
-                COM_D_COMMAND.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE, response.messageType))
-
-        # Since we only add behaviour, we can cast this class to ourselves
-        response.__class__ = PumpBolusWizardBGTargetsResponseMessage
-        return response
+    RESPONSE_TYPES = (COM_D_COMMAND.READ_BOLUS_WIZARD_BG_TARGETS_RESPONSE,)
 
     @classmethod
     def get_record_size(cls):
@@ -995,6 +1212,12 @@ class AckMultipacketRequestMessage(MedtronicSendMessage):
         MedtronicSendMessage.__init__(self, COM_D_COMMAND.ACK_MULTIPACKET_COMMAND, session, payload)
 
 
+class MultipacketResendPacketsMessage(MedtronicSendMessage):
+    def __init__(self, session, packetNumber, packetCount):
+        payload = struct.pack('>HH', packetNumber, packetCount)
+        MedtronicSendMessage.__init__(self, COM_D_COMMAND.MULTIPACKET_RESEND_PACKETS, session, payload)
+
+
 class BasicNgpParametersRequestMessage(MedtronicSendMessage):
     def __init__(self, session):
         MedtronicSendMessage.__init__(self, COM_D_COMMAND.NGP_PARAMETER_REQUEST, session)
@@ -1105,6 +1328,181 @@ class BayerBinaryMessage(object):
                 "Expected to get linkDeviceOperation {0:x}. Got {1:x}".format(expectedValue, self.linkDeviceOperation))
 
 
+class UsbFrameReader(object):
+    """Drains the CNL in a background thread and reassembles USB reports into frames.
+
+    Frames are kept in a bounded queue until the driver asks for them, so the
+    CNL never has to hold back messages while the driver is busy. Messages
+    arriving while no request is outstanding are strays, and a 0x80 message
+    repeating the previous one for the same request is a resend by the pump;
+    both are dropped instead of being handed to the driver. An error of the
+    transport ends the thread; it is raised to the driver after the frames
+    received before it, and by every read after them.
+    """
+    USB_BLOCKSIZE = 64
+    MAGIC_HEADER = b'ABC'
+
+    QUEUE_SIZE = 64
+    POLL_TIMEOUT_MS = 100
+    REPORT_TIMEOUT_MS = 10000
+
+    def __init__(self, device, instrumentation=None):
+        self.device = device
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.frames = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.strayCount = 0
+        self.resendCount = 0
+        self.error = None
+
+        self._reportBuffer = bytearray(self.USB_BLOCKSIZE)
+        self._report = memoryview(self._reportBuffer)
+
+        self._lastResponse = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cnl-reader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                frame = self.readFrame()
+            except Exception as ex:
+                # The device is gone or keeps sending garbage, reading on would only repeat the error
+                logger.error("## READER: stopped by {0!r}".format(ex))
+                self.error = ex
+                try:
+                    # Hand the error over in order, the driver raises it when it gets there
+                    self.frames.put_nowait(ex)
+                except queue.Full:
+                    pass
+                return
+            if frame is None:
+                continue
+
+            with self._lock:
+                if self._isResend(frame):
+                    self.resendCount += 1
+                    self.instrumentation.count("dropped_resends")
+                    logger.warning("## READER: dropped resent 0x80 message")
+                    continue
+
+            while not self._stopped.is_set():
+                try:
+                    self.frames.put(frame, timeout=self.POLL_TIMEOUT_MS / 1000.0)
+                    break
+                except queue.Full:
+                    logger.warning("## READER: frame queue full, waiting for the driver")
+
+    def _isResend(self, frame):
+        if isinstance(frame, Exception) or len(frame) <= 0x21 or frame[0x12] != 0x80:
+            return False
+        response = bytes(frame[0x21:])
+        if response == self._lastResponse:
+            return True
+        self._lastResponse = response
+        return False
+
+    def readFrame(self):
+        """Read the next frame, or None if the CNL stays quiet for POLL_TIMEOUT_MS
+
+        Reports are read into one preallocated buffer and checked in place; the
+        payloads are copied straight into the frame, which is allocated at its
+        final size for 0x80 and 0x81 messages.
+        """
+        buffer = self._reportBuffer
+        report = self._report
+        readinto = self.device.readinto
+        debug = logger.isEnabledFor(logging.DEBUG)
+        frame = None
+        length = 0
+        expectedSize = 0
+        timeout = self.POLL_TIMEOUT_MS
+
+        while True:
+            bytesRead = readinto(buffer, timeout=timeout)
+            if bytesRead == 0:
+                if frame is not None:
+                    logger.warning('Timeout waiting for the rest of a message, dropping {0} bytes'.format(length))
+                return None
+
+            payloadSize = buffer[3] if bytesRead > 3 else 0
+            if bytesRead < 4 or not buffer.startswith(self.MAGIC_HEADER) or 4 + payloadSize > bytesRead:
+                logger.error('Recieved invalid USB packet')
+                raise RuntimeError('Recieved invalid USB packet')
+
+            if frame is None:
+                # get the expected size for 0x80 or 0x81 messages as they may be on a block boundary
+                if payloadSize >= 0x21 and buffer[0x12 + 4] in (0x80, 0x81):
+                    expectedSize = 0x21 + (buffer[0x1C + 4] | buffer[0x1D + 4] << 8)
+                    frame = bytearray(expectedSize)
+                else:
+                    frame = bytearray()
+
+            frame[length:length + payloadSize] = report[4:4 + payloadSize]
+            length += payloadSize
+
+            if debug:
+                logger.debug('READ: bytesRead={0}, payloadSize={1}, expectedSize={2}'.format(bytesRead, payloadSize,
+                                                                                             expectedSize))
+
+            if payloadSize != self.USB_BLOCKSIZE - 4 or length == expectedSize:
+                break
+            timeout = self.REPORT_TIMEOUT_MS
+
+        if length < len(frame):
+            del frame[length:]
+        return frame
+
+    def getFrame(self, timeout_ms):
+        try:
+            if self.error is not None:
+                frame = self.frames.get_nowait()
+            else:
+                frame = self.frames.get(timeout=timeout_ms / 1000.0)
+        except queue.Empty:
+            if self.error is not None:
+                raise self.error
+            raise TimeoutException('Timeout waiting for message')
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    def pendingCount(self):
+        """Number of frames received and not yet taken by the driver"""
+        return self.frames.qsize()
+
+    def discardPending(self):
+        """Drop everything received so far, called right before a new request is sent"""
+        count = 0
+        with self._lock:
+            self._lastResponse = None
+            while True:
+                try:
+                    frame = self.frames.get_nowait()
+                except queue.Empty:
+                    break
+                # An error is not a stray, it stays in self.error and is raised by the next read
+                if not isinstance(frame, Exception):
+                    count += 1
+            self.strayCount += count
+
+        self.instrumentation.count("stray_messages", count)
+        if count > 0:
+            logger.warning("## READER: dropped {0} stray messages".format(count))
+        return count
+
+
 class Medtronic600SeriesDriver(object):
     USB_BLOCKSIZE = 64
     USB_VID = 0x1A79
@@ -1112,24 +1510,40 @@ class Medtronic600SeriesDriver(object):
     MAGIC_HEADER = b'ABC'
 
     ERROR_CLEAR_TIMEOUT_MS = 25000
-    PRESEND_CLEAR_TIMEOUT_MS = 50
     READ_TIMEOUT_MS = 10000
     CNL_READ_TIMEOUT_MS = 2000
+    # Silence within a multipacket segment, after which the missing packets are requested again
+    MULTIPACKET_TIMEOUT_MS = 1500
+    # Resend requests in a row without any new packet, before the history transfer is given up
+    MULTIPACKET_RESEND_ATTEMPTS = 5
 
     CHANNELS = [0x14, 0x11, 0x0e, 0x17, 0x1a]  # In the order that the CareLink applet requests them
+    # RTC and offset of the timestamp in the header of a history event
+    EVENT_TIME = struct.Struct('>II')
 
     session = None
     offset = -1592387759;  # Just read out of my pump. Shall be overwritten by reading date/time from pump
 
-    def __init__(self):
+    def __init__(self, transport=None, instrumentation=None):
         self.session = MedtronicSession()
+        self.transport = transport if transport is not None else HidTransport(self.USB_VID, self.USB_PID)
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
         self.device = None
+        self.reader = None
+        self.credentialsCached = False
+        self.pendingMessages = collections.deque()
 
         self.deviceInfo = None
 
-    def openDevice(self):
+    def openDevice(self, transport=None):
+        """Open the CNL, optionally through another transport, e.g. HidrawTransport on Linux"""
         logger.info("# Opening device")
-        self.device = hid.Device(self.USB_VID, self.USB_PID)
+        if transport is not None:
+            self.transport = transport
+        self.transport.open()
+        self.device = InstrumentedTransport(self.transport, self.instrumentation)
+        self.reader = UsbFrameReader(self.device, self.instrumentation)
+        self.reader.start()
 
         logger.info("Manufacturer: %s" % self.device.manufacturer)
         logger.info("Product: %s" % self.device.product)
@@ -1137,47 +1551,24 @@ class Medtronic600SeriesDriver(object):
 
     def closeDevice(self):
         logger.info("# Closing device")
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        if self.session.config is not None:
+            self.session.config.flush()
         self.device.close()
 
     def readMessage(self, timeout_ms=READ_TIMEOUT_MS):
-        payload = bytearray()
-        bytesRead = 0
-        payloadSize = 0
-        expectedSize = 0
-        first = True
-
-        while first or (bytesRead > 0 and payloadSize == self.USB_BLOCKSIZE - 4 and len(payload) != expectedSize):
-            t = timeout_ms if first else 10000
-            data = self.device.read(self.USB_BLOCKSIZE, timeout=t)
-            first = False
-            if data:
-                data = struct.unpack(">64B", data)
-                bytesRead = len(data)
-                payloadSize = data[3]
-                if (bytearray(data[0:3]) != self.MAGIC_HEADER):
-                    logger.error('Recieved invalid USB packet')
-                    raise RuntimeError('Recieved invalid USB packet')
-                payload.extend(data[4:data[3] + 4])
-
-                # get the expected size for 0x80 or 0x81 messages as they may be on a block boundary
-                if expectedSize == 0 and data[3] >= 0x21 and (
-                        (data[0x12 + 4] & 0xFF == 0x80) or (data[0x12 + 4] & 0xFF == 0x81)):
-                    expectedSize = 0x21 + ((data[0x1C + 4] & 0x00FF) | (data[0x1D + 4] << 8 & 0xFF00))
-
-                logger.debug('READ: bytesRead={0}, payloadSize={1}, expectedSize={2}'.format(bytesRead, payloadSize,
-                                                                                             expectedSize))
-
-            else:
-                # logger.warning('Timeout waiting for message')
-                raise TimeoutException('Timeout waiting for message')
-
-        # logger.debug("READ: " + binascii.hexlify( payload )) # Debugging
-        return payload
+        return self.reader.getFrame(timeout_ms)
 
     def sendMessage(self, payload):
 
-        # Clear any message in the receive buffer
-        self.clearMessage(timeout_ms=self.PRESEND_CLEAR_TIMEOUT_MS)
+        # Drop any message received since the last request, the reader has already drained the CNL
+        self.reader.discardPending()
+        if self.pendingMessages:
+            logger.warning("## SEND: dropped {0} decoded stray messages".format(len(self.pendingMessages)))
+            self.instrumentation.count("stray_messages", len(self.pendingMessages))
+            self.pendingMessages.clear()
 
         # Split the message into 60 byte chunks
         for packet in [payload[i: i + 60] for i in range(0, len(payload), 60)]:
@@ -1199,10 +1590,14 @@ class Medtronic600SeriesDriver(object):
     # pre-clear: clear all messages in stream until timeout --> send request
     # consistently stable even with a small timeout, clears multiple messages with very rare miss
     # which will get caught using the post-clear method as fail-safe
+    #
+    # the UsbFrameReader keeps draining the CNL in the background, so the pre-clear only drops what has
+    # already been received instead of waiting for the stream to go quiet before every request
 
     def clearMessage(self, timeout_ms=ERROR_CLEAR_TIMEOUT_MS):
 
         logger.debug("## CLEAR: timeout={0}".format(timeout_ms))
+        self.instrumentation.count("clear_drains")
 
         count = 0
         cleared = False
@@ -1243,14 +1638,15 @@ class Medtronic600SeriesDriver(object):
 
         if count > 0:
             logger.warning("## CLEAR: message stream cleared " + str(count) + " messages.")
+            self.instrumentation.count("cleared_messages", count)
 
         return count
 
-    def readResponse0x80(self):
+    def readResponse0x80(self, timeout_ms=READ_TIMEOUT_MS):
 
         logger.debug("## readResponse0x80")
 
-        payload = self.readMessage()
+        payload = self.readMessage(timeout_ms)
 
         # minimum 0x80 message size?
         if len(payload) <= 0x21:
@@ -1345,6 +1741,7 @@ class Medtronic600SeriesDriver(object):
                     logger.warning("## readResponse0x81: message not a 0x81, got a 0x{0:x}".format(payload[0x12]))
                 else:
                     break
+                self.instrumentation.count("retries")
 
         except TimeoutException:  # Timeout in readMessage()
             # ugh... there should always be a CNL 0x81 response and if we don't get one
@@ -1442,6 +1839,7 @@ class Medtronic600SeriesDriver(object):
                 break
 
             except TimeoutException:
+                self.instrumentation.count("retries")
                 self.sendMessage(struct.pack('>B', ascii['EOT']))
 
     def checkControlMessage(self, controlChar):
@@ -1526,30 +1924,82 @@ class Medtronic600SeriesDriver(object):
         self.session.KEY = bytes(keyRequest.linkKey(self.session.stickSerial))
         logger.debug("LINK KEY: {0}".format(binascii.hexlify(self.session.KEY)))
 
-    def negotiateChannel(self):
-        logger.info("# Negotiate pump comms channel")
+    def readLinkCredentials(self):
+        """Restore link MAC, pump MAC and link key cached for the stick, or read and cache them
 
-        # Scan the last successfully connected channel first, since this could save us negotiating time
-        for self.session.radioChannel in [self.session.config.lastRadioChannel] + self.CHANNELS:
-            logger.debug("Negotiating on channel {0}".format(self.session.radioChannel))
+        The cached values are validated by negotiateChannel, which reads them
+        again if the CNL has been paired with another pump since.
+        """
+        self.credentialsCached = self.session.loadCredentials()
+        if self.credentialsCached:
+            logger.info("# Using cached link credentials")
+            return
 
-            mtMessage = ChannelNegotiateMessage(self.session)
+        self.readInfo()
+        self.readLinkKey()
+        self.session.storeCredentials()
 
-            bayerMessage = BayerBinaryMessage(0x12, self.session, mtMessage.encode())
-            self.sendMessage(bayerMessage.encode())
-            self.readResponse0x81()
-            response = self.readResponse0x80()
-            if len(response.payload) > 13:
-                # Check that the channel ID matches
-                responseChannel = response.payload[43]
-                if self.session.radioChannel == responseChannel:
-                    break
+    def negotiateChannel(self):
+        try:
+            self._negotiateChannel()
+        except (NegotiationException, UnexpectedMessageException) as ex:
+            if not self.credentialsCached:
+                raise
+
+            # Without any answer the pump is either out of reach or no longer the one the CNL is paired with
+            cachedPumpMAC = self.session.pumpMAC
+            self.credentialsCached = False
+            self.readInfo()
+            if isinstance(ex, NegotiationException) and self.session.pumpMAC == cachedPumpMAC:
+                raise
+
+            logger.warning("# Cached link credentials do not match the pump, reading them from the CNL")
+            self.readLinkKey()
+            self.session.storeCredentials()
+            self._negotiateChannel()
+
+    def _negotiateChannel(self):
+        logger.info("# Negotiate pump comms channel")
+
+        statistics = self.session.config.channelStatistics
+        statistics.decay()
+        channels = statistics.order([self.session.config.lastRadioChannel] + self.CHANNELS)
+        try:
+            # Try the channels the pump was found on most reliably first, since this could save us negotiating time
+            for self.session.radioChannel in channels:
+                logger.debug("Negotiating on channel {0}".format(self.session.radioChannel))
+                self.instrumentation.count("channel_attempts")
+                start = perf_counter()
+
+                mtMessage = ChannelNegotiateMessage(self.session)
+
+                bayerMessage = BayerBinaryMessage(0x12, self.session, mtMessage.encode())
+                self.sendMessage(bayerMessage.encode())
+                acknowledge = self.readResponse0x81()
+                noisy = len(acknowledge) == 0x30 and acknowledge[0x2D] == 0x04
+                response = self.readResponse0x80()
+                latency = perf_counter() - start
+                if len(response.payload) > 13:
+                    # Check that the channel ID and the pump match
+                    responseChannel = response.payload[43]
+                    responsePumpMAC = struct.unpack('<Q', response.payload[10:18])[0]
+                    if self.credentialsCached and responsePumpMAC != self.session.pumpMAC:
+                        raise UnexpectedMessageException(
+                            "Expected to connect to pump {0:x}. Got {1:x}".format(self.session.pumpMAC,
+                                                                                  responsePumpMAC))
+                    if self.session.radioChannel == responseChannel:
+                        statistics.record(responseChannel, True, rssi=response.payload[26], noisy=noisy,
+                                          latency=latency)
+                        break
+                    else:
+                        raise UnexpectedMessageException(
+                            "Expected to get a message for channel {0}. Got {1}".format(self.session.radioChannel,
+                                                                                        responseChannel))
                 else:
-                    raise UnexpectedMessageException(
-                        "Expected to get a message for channel {0}. Got {1}".format(self.session.radioChannel,
-                                                                                    responseChannel))
-            else:
-                self.session.radioChannel = None
+                    statistics.record(self.session.radioChannel, False, noisy=noisy, latency=latency)
+                    self.session.radioChannel = None
+        finally:
+            self.session.config.channelStatistics = statistics
 
         if not self.session.radioChannel:
             raise NegotiationException('Could not negotiate a comms channel with the pump. Are you near to the pump?')
@@ -1589,19 +2039,45 @@ class Medtronic600SeriesDriver(object):
             else:
                 logger.warning("## getBayerBinaryMessage: waiting for message 0x{0:x}, got 0x{1:x}".format(
                     expectedLinkDeviceOperation, message.linkDeviceOperation))
+                self.instrumentation.count("retries")
+        return message
+
+    def readMedtronicMessage(self, timeout_ms=READ_TIMEOUT_MS):
+        """Read and decode the next 0x80 pump message
+
+        Further messages the reader has queued already, e.g. the packets of a
+        multipacket transfer, are decrypted in the same batch and handed out
+        by the following calls.
+        """
+        if not self.pendingMessages:
+            payloads = [self.readResponse0x80(timeout_ms).payload]
+            error = None
+            try:
+                for _ in range(self.reader.pendingCount()):
+                    payloads.append(self.readResponse0x80().payload)
+            except Exception as ex:
+                # raised once the messages before it are processed
+                error = ex
+            self.pendingMessages.extend(MedtronicReceiveMessage.decodeBatch(payloads, self.session))
+            if error is not None:
+                self.pendingMessages.append(error)
+
+        message = self.pendingMessages.popleft()
+        if isinstance(message, Exception):
+            raise message
         return message
 
-    def getMedtronicMessage(self, expectedMessageTypes):
+    def getMedtronicMessage(self, expectedMessageTypes, timeout_ms=READ_TIMEOUT_MS):
         messageReceived = False
         medMessage = None
         while messageReceived == False:
-            message = self.readResponse0x80()
-            medMessage = MedtronicReceiveMessage.decode(message.payload, self.session)
+            medMessage = self.readMedtronicMessage(timeout_ms)
             if medMessage.messageType in expectedMessageTypes:
                 messageReceived = True
             else:
                 logger.warning("## getMedtronicMessage: waiting for message of [{0}], got 0x{1:x}".format(
                     ''.join('%04x ' % i for i in expectedMessageTypes), medMessage.messageType))
+                self.instrumentation.count("retries")
         return medMessage
 
     def getPumpTime(self):
@@ -1631,28 +2107,16 @@ class Medtronic600SeriesDriver(object):
         return response
 
     def getPumpMeasurement(self):
-        status = self.getPumpStatus()
-
-        response = MedtronicMeasurementData()
+        status = self.getPumpStatus().snapshot
         if not self._data_is_valid(status):
-            response.status = MedtronicDataStatus.invalid
-        else:
-            response.bgl_value = status.sensorBGL
-            response.trend = status.trendArrow
-            response.active_insulin = status.activeInsulin
-            response.current_basal_rate = status.currentBasalRate
-            response.temporary_basal_percentage = status.tempBasalPercentage
-            response.battery_level = status.batteryLevelPercentage
-            response.insulin_units_remaining = status.insulinUnitsRemaining
-            response.status = MedtronicDataStatus.valid
-            response.timestamp = status.sensorBGLTimestamp
-
-        return response
+            return MedtronicMeasurementData(status=MedtronicDataStatus.invalid)
+        return status.measurementData()
 
     @staticmethod
-    def _data_is_valid(medtronic_pump_status: PumpStatusResponseMessage) -> bool:
-        return str(medtronic_pump_status.sensorBGLTimestamp.strftime(
-            "%d.%m.%Y")) != "01.01.1970" and 0 < medtronic_pump_status.sensorBGL < 700
+    def _data_is_valid(medtronic_pump_status: PumpStatusSnapshot) -> bool:
+        timestamp = medtronic_pump_status.sensorBGLTimestamp
+        return (timestamp.year, timestamp.month, timestamp.day) != (1970, 1, 1) and \
+            0 < medtronic_pump_status.sensorBGL < 700
 
     def getBolusWizardCarbRatios(self):
         """Get bolus wizard carb ratios settings
@@ -1729,9 +2193,26 @@ class Medtronic600SeriesDriver(object):
         response = self.getMedtronicMessage([COM_D_COMMAND.READ_HISTORY_INFO_RESPONSE])
         return response
 
-    def getPumpHistory(self, expectedSize, dateStart, dateEnd, requestType=HISTORY_DATA_TYPE.PUMP_DATA):
+    def getPumpHistory(self, expectedSize, dateStart, dateEnd, requestType=HISTORY_DATA_TYPE.PUMP_DATA,
+                       checkpoints=None):
+        """Segments of the history from dateStart to dateEnd
+
+        Given HistoryCheckpoints, completed segments are stored as the transfer
+        goes on, and those stored by an earlier transfer that was interrupted
+        are not requested again.
+        """
         logger.info("# Get Pump History")
         allSegments = []
+        if checkpoints is not None:
+            checkpointRtc = DateTimeHelper.rtcFromDate(dateStart, self.offset)
+            checkpoints.discard(self.session.pumpMAC, requestType, checkpointRtc)
+            allSegments, checkpointRtc = checkpoints.resume(self.session.pumpMAC, requestType, checkpointRtc)
+            if allSegments:
+                logger.info("# Resuming the history transfer after {0} stored segments".format(len(allSegments)))
+                if checkpointRtc > DateTimeHelper.rtcFromDate(dateEnd, self.offset):
+                    return allSegments
+                dateStart = DateTimeHelper.dateFromRtc(checkpointRtc, self.offset)
+            completedSegment = None
         mtMessage = PumpHistoryRequestMessage(self.session, dateStart, dateEnd, self.offset, requestType)
 
         bayerMessage = BayerBinaryMessage(0x12, self.session, mtMessage.encode())
@@ -1739,10 +2220,22 @@ class Medtronic600SeriesDriver(object):
         self.readResponse0x81()
 
         transmissionCompleted = False
+        segmentParams = None
         while transmissionCompleted != True:
-            responseSegment = self.getMedtronicMessage(
-                [COM_D_COMMAND.HIGH_SPEED_MODE_COMMAND, COM_D_COMMAND.INITIATE_MULTIPACKET_TRANSFER,
-                 COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION, COM_D_COMMAND.END_HISTORY_TRANSMISSION])
+            try:
+                # Within a segment a quiet pump has lost packets, they are requested again after a short timeout
+                responseSegment = self.getMedtronicMessage(
+                    [COM_D_COMMAND.HIGH_SPEED_MODE_COMMAND, COM_D_COMMAND.INITIATE_MULTIPACKET_TRANSFER,
+                     COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION, COM_D_COMMAND.END_HISTORY_TRANSMISSION],
+                    self.READ_TIMEOUT_MS if segmentParams is None else self.MULTIPACKET_TIMEOUT_MS)
+            except TimeoutException:
+                if segmentParams is None:
+                    raise
+                logger.warning("## WARNING - timeout waiting for {0} missing packets".format(
+                    segmentParams.packetsToFetch - numPackets))
+                resendAttempts = resendAttempts + 1
+                lastRequestedPacket = self.requestMissingPackets(receivedPackets, resendAttempts)
+                continue
 
             if responseSegment.messageType == COM_D_COMMAND.HIGH_SPEED_MODE_COMMAND:
                 logger.debug("## getPumpHistory consumed HIGH_SPEED_MODE_COMMAND")
@@ -1757,9 +2250,23 @@ class Medtronic600SeriesDriver(object):
                     responseSegment.lastPacketSize))
                 logger.debug("## getPumpHistory INITIATE_MULTIPACKET_TRANSFER.packetsToFetch: {0}".format(
                     responseSegment.packetsToFetch))
+                if checkpoints is not None and completedSegment is not None:
+                    # Only now the last page of the segment before is known to be complete, the newest page of
+                    # the history still grows
+                    checkpointRtc = self.checkpointSegment(checkpoints, requestType, checkpointRtc, completedSegment)
+                    completedSegment = None
+                    if checkpointRtc is None:
+                        # The segments after it would leave a gap in the stored history
+                        checkpoints = None
                 segmentParams = responseSegment
-                packets = [None] * responseSegment.packetsToFetch
+                # Every packet is written straight to its place in one buffer of the whole segment
+                segmentBuffer = bytearray(responseSegment.segmentSize)
+                segmentView = memoryview(segmentBuffer)
+                receivedPackets = [False] * responseSegment.packetsToFetch
                 numPackets = 0
+                # The pump sends all packets of the segment in one burst, later bursts only the requested ones
+                lastRequestedPacket = responseSegment.packetsToFetch - 1
+                resendAttempts = 0
                 ackMessage = AckMultipacketRequestMessage(self.session,
                                                           AckMultipacketRequestMessage.SEGMENT_COMMAND__INITIATE_TRANSFER)
                 bayerAckMessage = BayerBinaryMessage(0x12, self.session, ackMessage.encode())
@@ -1769,34 +2276,48 @@ class Medtronic600SeriesDriver(object):
             elif responseSegment.messageType == COM_D_COMMAND.MULTIPACKET_SEGMENT_TRANSMISSION:
                 logger.debug("## getPumpHistory got MULTIPACKET_SEGMENT_TRANSMISSION")
                 logger.debug("## getPumpHistory responseSegment.packetNumber: {0}".format(responseSegment.packetNumber))
+                if segmentParams is None:
+                    logger.warning("## WARNING - packet {0} outside of a segment, skipping".format(
+                        responseSegment.packetNumber))
+                    continue
+                if responseSegment.packetNumber < 0 or responseSegment.packetNumber >= segmentParams.packetsToFetch:
+                    logger.warning("## WARNING - received packed out of expected range. Packet {0}/{1}".format(
+                        responseSegment.packetNumber, segmentParams.packetsToFetch))
+                    continue
+                # A packet of the wrong length stays missing and is requested again
+                packetStart = responseSegment.packetNumber * segmentParams.packetSize
+                packetPayload = responseSegment.payload
                 if responseSegment.packetNumber != (segmentParams.packetsToFetch - 1) and len(
-                        responseSegment.payload) != segmentParams.packetSize:
+                        packetPayload) != segmentParams.packetSize:
                     logger.warning(
                         "## WARNING - packet length invalid, skipping. Expected {0}, got {1}, for packet {2}/{3}".format(
-                            segmentParams.packetSize, len(responseSegment.payload), responseSegment.packetNumber,
-                            responseSegment.segmentParams))
-                    continue
-                if responseSegment.packetNumber == segmentParams.packetsToFetch - 1 and len(
-                        responseSegment.payload) != segmentParams.lastPacketSize:
+                            segmentParams.packetSize, len(packetPayload), responseSegment.packetNumber,
+                            segmentParams.packetsToFetch))
+                elif responseSegment.packetNumber == segmentParams.packetsToFetch - 1 and len(
+                        packetPayload) != segmentParams.lastPacketSize:
                     logger.warning(
                         "## WARNING - last packet length invalid, skipping. Expected {0}, got {1}, for packet {2}/{3}".format(
-                            segmentParams.lastPacketSize, len(responseSegment.payload), responseSegment.packetNumber,
-                            responseSegment.segmentParams))
-                    continue
-                if responseSegment.packetNumber < 0 or responseSegment.packetNumber >= segmentParams.packetsToFetch:
-                    logger.warning("## WARNING - received packed out of expected range. Packet {2}/{3}".format(
-                        responseSegment.packetNumber, responseSegment.segmentParams))
-                    continue
-                if packets[responseSegment.packetNumber] == None:
+                            segmentParams.lastPacketSize, len(packetPayload), responseSegment.packetNumber,
+                            segmentParams.packetsToFetch))
+                elif packetStart + len(packetPayload) > segmentParams.segmentSize:
+                    logger.warning("## WARNING - packet {0} exceeds the segment size {1}, skipping".format(
+                        responseSegment.packetNumber, segmentParams.segmentSize))
+                elif not receivedPackets[responseSegment.packetNumber]:
                     numPackets = numPackets + 1
-                    packets[responseSegment.packetNumber] = responseSegment.payload
+                    receivedPackets[responseSegment.packetNumber] = True
+                    segmentView[packetStart: packetStart + len(packetPayload)] = packetPayload
+                    resendAttempts = 0
                 else:
                     logger.warning("## WARNING - packet duplicated")
 
                 if numPackets == segmentParams.packetsToFetch:
                     logger.debug("## All packets there")
                     logger.debug("## Requesting next segment")
-                    allSegments.append(packets)
+                    segmentView.release()
+                    allSegments.append(segmentBuffer)
+                    segmentParams = None
+                    if checkpoints is not None:
+                        completedSegment = segmentBuffer
 
                     # request next segment
                     ackMessage = AckMultipacketRequestMessage(self.session,
@@ -1804,6 +2325,11 @@ class Medtronic600SeriesDriver(object):
                     bayerAckMessage = BayerBinaryMessage(0x12, self.session, ackMessage.encode())
                     self.sendMessage(bayerAckMessage.encode())
                     self.readResponse0x81()
+                elif responseSegment.packetNumber == lastRequestedPacket and not self.pendingMessages \
+                        and not self.reader.pendingCount():
+                    # The burst is over, sending the next request drops nothing that is still on its way
+                    resendAttempts = resendAttempts + 1
+                    lastRequestedPacket = self.requestMissingPackets(receivedPackets, resendAttempts)
             elif responseSegment.messageType == COM_D_COMMAND.END_HISTORY_TRANSMISSION:
                 logger.debug("## getPumpHistory got END_HISTORY_TRANSMISSION")
                 transmissionCompleted = True
@@ -1817,24 +2343,74 @@ class Medtronic600SeriesDriver(object):
             logger.error("Transmission finished, but END_HISTORY_TRANSMISSION did not arrive")
             raise DataIncompleteError("Transmission finished, but END_HISTORY_TRANSMISSION did not arrive")
 
+    def checkpointSegment(self, checkpoints, historyType, fromRtc, segment):
+        """Store a completed segment covering the history from fromRtc on
+
+        :return: RTC the next segment starts at, None if the segment is invalid and was not stored
+        """
+        try:
+            decodedBlocks = self.decodePumpSegment(segment, historyType)
+        except (InvalidMessageError, ChecksumError):
+            logger.warning("## WARNING - invalid segment, not checkpointed", exc_info=True)
+            return None
+
+        lastRtc = None
+        for page in decodedBlocks:
+            pos = 0
+            while pos < len(page):
+                rtc = self.EVENT_TIME.unpack_from(page, pos + 3)[0]
+                lastRtc = rtc if lastRtc is None else max(lastRtc, rtc)
+                pos += page[pos + 2]
+        if lastRtc is None:
+            return fromRtc
+
+        checkpoints.store(self.session.pumpMAC, historyType, fromRtc, lastRtc, segment)
+        self.instrumentation.count("history_checkpoints")
+        return lastRtc + 1
+
+    def requestMissingPackets(self, receivedPackets, resendAttempts):
+        """Ask the pump to resend the first run of missing packets of a segment
+
+        :return: number of the last packet requested
+        """
+        if resendAttempts > self.MULTIPACKET_RESEND_ATTEMPTS:
+            logger.error("Packets still missing after {0} resend requests".format(self.MULTIPACKET_RESEND_ATTEMPTS))
+            raise DataIncompleteError("Packets still missing after {0} resend requests".format(
+                self.MULTIPACKET_RESEND_ATTEMPTS))
+
+        packetNumber = receivedPackets.index(False)
+        packetCount = 1
+        while packetNumber + packetCount < len(receivedPackets) and not receivedPackets[packetNumber + packetCount]:
+            packetCount += 1
+        logger.info("# Request resend of packets {0} to {1}".format(packetNumber, packetNumber + packetCount - 1))
+        self.instrumentation.count("multipacket_resends")
+
+        mtMessage = MultipacketResendPacketsMessage(self.session, packetNumber, packetCount)
+        bayerMessage = BayerBinaryMessage(0x12, self.session, mtMessage.encode())
+        self.sendMessage(bayerMessage.encode())
+        self.readResponse0x81()
+        return packetNumber + packetCount - 1
+
     def decodePumpSegment(self, encodedFragmentedSegment, historyType=HISTORY_DATA_TYPE.PUMP_DATA):
-        decodedBlocks = []
-        segmentPayload = encodedFragmentedSegment[0]
+        """History blocks of a segment, as views into its decompressed payload
 
-        for idx in range(1, len(encodedFragmentedSegment)):
-            segmentPayload += encodedFragmentedSegment[idx]
+        The segment is either the buffer getPumpHistory reassembled it in, or
+        the list of its packets, e.g. of an older capture.
+        """
+        decodedBlocks = []
+        if isinstance(encodedFragmentedSegment, (list, tuple)):
+            encodedFragmentedSegment = b''.join(encodedFragmentedSegment)
+        segmentPayload = memoryview(encodedFragmentedSegment)
 
-            # Decompress the message
-        if struct.unpack('>H', segmentPayload[0:2])[0] == 0x030E:
+        # Decompress the message
+        if struct.unpack_from('>H', segmentPayload, 0)[0] == 0x030E:
             HEADER_SIZE = 12
             BLOCK_SIZE = 2048
             # It's an UnmergedHistoryUpdateCompressed response. We need to decompress it
-            dataType = struct.unpack('>B', segmentPayload[2:3])[0]  # Returns a HISTORY_DATA_TYPE
-            historySizeCompressed = struct.unpack('>I', segmentPayload[3:7])[0]  # segmentPayload.readUInt32BE(0x03)
+            dataType, historySizeCompressed, historySizeUncompressed, historyCompressed = struct.unpack_from(
+                '>BIIB', segmentPayload, 2)  # dataType returns a HISTORY_DATA_TYPE
             logger.debug("Compressed: {0}".format(historySizeCompressed))
-            historySizeUncompressed = struct.unpack('>I', segmentPayload[7:11])[0]  # segmentPayload.readUInt32BE(0x07)
             logger.debug("Uncompressed: {0}".format(historySizeUncompressed))
-            historyCompressed = struct.unpack('>B', segmentPayload[11:12])[0]
             logger.debug("IsCompressed: {0}".format(historyCompressed))
 
             if dataType != historyType:  # Check HISTORY_DATA_TYPE (PUMP_DATA: 2, SENSOR_DATA: 3)
@@ -1847,52 +2423,118 @@ class Medtronic600SeriesDriver(object):
 
             blockPayload = None
             if historyCompressed > 0:
-                blockPayload = lzo.decompress(segmentPayload[HEADER_SIZE:], False, historySizeUncompressed)
+                # python-lzo only reads from bytes, and allocates its output once from the uncompressed size
+                blockPayload = memoryview(
+                    lzo.decompress(segmentPayload[HEADER_SIZE:].tobytes(), False, historySizeUncompressed))
             else:
                 blockPayload = segmentPayload[HEADER_SIZE:]
 
             if len(blockPayload) % BLOCK_SIZE != 0:
                 raise InvalidMessageError('Block payload size is not a multiple of 2048')
 
+            # All blocks are checked in one pass before any of them is decoded
+            badBlocks = CrcHelper.verifyBlocks(blockPayload, BLOCK_SIZE)
+            if badBlocks:
+                raise ChecksumError('Unexpected checksum in block {0}'.format(badBlocks))
+
             for i in range(0, len(blockPayload) // BLOCK_SIZE):
-                blockSize = struct.unpack('>H', blockPayload[(i + 1) * BLOCK_SIZE - 4: (i + 1) * BLOCK_SIZE - 2])[
+                blockSize = struct.unpack_from('>H', blockPayload, (i + 1) * BLOCK_SIZE - 4)[
                     0]  # blockPayload.readUInt16BE(((i + 1) * ReadHistoryCommand.BLOCK_SIZE) - 4)
-                blockChecksum = struct.unpack('>H', blockPayload[(i + 1) * BLOCK_SIZE - 2: (i + 1) * BLOCK_SIZE])[
-                    0]  # blockPayload.readUInt16BE(((i + 1) * ReadHistoryCommand.BLOCK_SIZE) - 2)
 
                 blockStart = i * BLOCK_SIZE
-                blockData = blockPayload[blockStart: blockStart + blockSize]
-                calculatedChecksum = MedtronicMessage.calculateCcitt(blockData)
-                if blockChecksum != calculatedChecksum:
-                    raise ChecksumError('Unexpected checksum in block')
-                else:
-                    decodedBlocks.append(blockData)
+                decodedBlocks.append(blockPayload[blockStart: blockStart + blockSize])
         else:
             raise InvalidMessageError('Unknown history response message type')
 
         return decodedBlocks
 
-    def decodeEvents(self, decodedBlocks):
+    @staticmethod
+    def _encodedEventTime(date):
+        # RTC + offset of an event at the local time date, as the unsigned 32 bit values add up in its header
+        return int((date - DateTimeHelper.epoch).total_seconds()) - DateTimeHelper.baseTime + 0x100000000
+
+    def decodeEvents(self, decodedBlocks, dateTimeContext=None, eventTypes=None, dateStart=None, dateEnd=None):
+        """Events of the decoded history blocks
+
+        Given a set of eventTypes or the local time window from dateStart to
+        dateEnd, only the matching events are created. The others are skipped
+        by the type and timestamp in their header.
+        """
+        filtered = dateStart is not None or dateEnd is not None
+        timeStart = self._encodedEventTime(dateStart) if dateStart is not None else 0
+        timeEnd = self._encodedEventTime(dateEnd) if dateEnd is not None else 0x1FFFFFFFF
+        eventTime = self.EVENT_TIME.unpack_from
         eventList = []
         for page in decodedBlocks:
+            # The events keep views into the page instead of copies
+            page = memoryview(page)
             pos = 0;
 
             while pos < len(page):
-                eventSize = struct.unpack('>B', page[pos + 2: pos + 3])[0]  # page[pos + 2];
+                eventSize = page[pos + 2]
+                if eventTypes is not None and page[pos] not in eventTypes:
+                    pos += eventSize
+                    continue
+                if filtered:
+                    rtc, offset = eventTime(page, pos + 3)
+                    if not timeStart <= rtc + offset <= timeEnd:
+                        pos += eventSize
+                        continue
                 eventData = page[pos: pos + eventSize]  # page.slice(pos, pos + eventSize);
                 pos += eventSize
-                eventList.extend(NGPHistoryEvent(eventData).eventInstance().allNestedEvents())
+                eventList.extend(NGPHistoryEvent.fromEventData(eventData, dateTimeContext).allNestedEvents())
         return eventList
 
-    def processPumpHistory(self, historySegments, historyType=HISTORY_DATA_TYPE.PUMP_DATA):
+    def processPumpHistory(self, historySegments, historyType=HISTORY_DATA_TYPE.PUMP_DATA, eventTypes=None,
+                           dateStart=None, dateEnd=None):
+        """Events of the history, only those of eventTypes from dateStart to dateEnd if given, see decodeEvents
+
+        Events are linked to other events of the result only.
+        """
         historyEvents = []
+        dateTimeContext = DateTimeContext()
         for segment in historySegments:
             decodedBlocks = self.decodePumpSegment(segment, historyType)
-            historyEvents += self.decodeEvents(decodedBlocks)
+            historyEvents += self.decodeEvents(decodedBlocks, dateTimeContext, eventTypes, dateStart, dateEnd)
+        historyIndex = HistoryEventIndex(historyEvents)
         for event in historyEvents:
-            event.postProcess(historyEvents)
+            event.postProcess(historyIndex)
         return historyEvents
 
+    def streamPumpHistory(self, historySegments, historyType=HISTORY_DATA_TYPE.PUMP_DATA, eventTypes=None,
+                          dateStart=None, dateEnd=None, lookBack=HistoryEventWindow.LOOK_BACK):
+        """Events of the history as they are decoded, segment by segment and block by block
+
+        historySegments may be any iterable, e.g. of segments as they arrive.
+        Events are linked to the events up to lookBack before them and are
+        yielded as soon as no later event can link to them anymore, so only
+        that window of the history is kept, not the whole history.
+        """
+        dateTimeContext = DateTimeContext()
+        historyEvents = (event
+                         for segment in historySegments
+                         for decodedBlock in self.decodePumpSegment(segment, historyType)
+                         for event in self.decodeEvents([decodedBlock], dateTimeContext, eventTypes, dateStart,
+                                                        dateEnd))
+        return HistoryEventWindow(lookBack).link(historyEvents)
+
+    def processSensorReadings(self, historySegments):
+        """Sensor glucose readings of the sensor history as one NumPy array, without an event per reading
+
+        See SensorGlucoseReadingsEvent.readingsOf for the columns.
+        """
+        readingEvents = []
+        for segment in historySegments:
+            for page in self.decodePumpSegment(segment, HISTORY_DATA_TYPE.SENSOR_DATA):
+                page = memoryview(page)
+                pos = 0
+                while pos < len(page):
+                    eventSize = page[pos + 2]
+                    if page[pos] == NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED:
+                        readingEvents.append(SensorGlucoseReadingsEvent(page[pos: pos + eventSize]))
+                    pos += eventSize
+        return SensorGlucoseReadingsEvent.readingsOf(readingEvents, DateTimeContext())
+
     def getTempBasalStatus(self):
         logger.info("# Get Temp Basal Status")
         mtMessage = PumpTempBasalRequestMessage(self.session)
@@ -1966,8 +2608,8 @@ class Medtronic600SeriesDriver(object):
         return MedtronicReceiveMessage.decode(response.payload, self.session)
 
 
-def downloadPumpSession(downloadOperations):
-    mt = Medtronic600SeriesDriver()
+def downloadPumpSession(downloadOperations, transport=None):
+    mt = Medtronic600SeriesDriver(transport)
     mt.openDevice()
     try:
         mt.getDeviceInfo()
@@ -1978,8 +2620,7 @@ def downloadPumpSession(downloadOperations):
             try:
                 mt.openConnection()
                 try:
-                    mt.readInfo()
-                    mt.readLinkKey()
+                    mt.readLinkCredentials()
                     try:
                         mt.negotiateChannel()
                     except:
@@ -2046,8 +2687,9 @@ def pumpDownload(mt):
     print(" Pump Size: {0}".format(historyInfo.historySize));
 
     print("Getting Pump history")
+    checkpoints = HistoryCheckpoints()
     history_pages = mt.getPumpHistory(historyInfo.historySize, start_date, datetime.datetime.max,
-                                      HISTORY_DATA_TYPE.PUMP_DATA)
+                                      HISTORY_DATA_TYPE.PUMP_DATA, checkpoints)
 
     # Uncomment to save events for testing without Pump (use: tests/process_saved_history.py)
     # with open('history_data.dat', 'wb') as output:
@@ -2068,7 +2710,7 @@ def pumpDownload(mt):
 
     print("Getting Sensor history")
     sensor_history_pages = mt.getPumpHistory(sensHistoryInfo.historySize, start_date, datetime.datetime.max,
-                                             HISTORY_DATA_TYPE.SENSOR_DATA)
+                                             HISTORY_DATA_TYPE.SENSOR_DATA, checkpoints)
 
     # Uncomment to save events for testing without Pump (use: tests/process_saved_history.py)
     # with open('sensor_history_data.dat', 'wb') as output:
@@ -0,0 +1,74 @@
+"""Benchmark the checksum verification of history blocks in the testdata captures.
+
+Every history segment of the captures is decompressed once, then all of its
+2048 byte blocks are checked per block on copies through the crc16 extension,
+as decodePumpSegment did before, and in one pass with CrcHelper.verifyBlocks:
+
+    $ python -m tests.benchmark_crc --rounds 200
+"""
+import argparse
+import glob
+import os
+import struct
+import time
+
+import lzo
+
+from helpers import CrcHelper
+from tests.benchmark_history import TESTDATA, load_history_pages
+
+BLOCK_SIZE = 2048
+HEADER_SIZE = 12
+
+
+def load_segments(path):
+    return [b''.join(segment) for segment in load_history_pages(path)]
+
+
+def decompress(segment):
+    historySizeCompressed, historySizeUncompressed, historyCompressed = struct.unpack_from('>IIB', segment, 3)
+    if historyCompressed > 0:
+        return lzo.decompress(segment[HEADER_SIZE:], False, historySizeUncompressed)
+    return segment[HEADER_SIZE:]
+
+
+def verify_per_block(payload):
+    import crc16
+    badBlocks = []
+    for i in range(0, len(payload) // BLOCK_SIZE):
+        blockSize = struct.unpack('>H', payload[(i + 1) * BLOCK_SIZE - 4: (i + 1) * BLOCK_SIZE - 2])[0]
+        blockChecksum = struct.unpack('>H', payload[(i + 1) * BLOCK_SIZE - 2: (i + 1) * BLOCK_SIZE])[0]
+        blockData = payload[i * BLOCK_SIZE: i * BLOCK_SIZE + blockSize]
+        if blockChecksum != crc16.crc16xmodem(bytes(blockData), 0xffff) & 0xffff:
+            badBlocks.append(i)
+    return badBlocks
+
+
+def verify_in_one_pass(payload):
+    return CrcHelper.verifyBlocks(payload, BLOCK_SIZE)
+
+
+def run(name, verify, payloads, rounds):
+    blocks = sum(len(payload) // BLOCK_SIZE for payload in payloads)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            verify(payload)
+    duration = time.perf_counter() - start
+    print("  {0:<12} {1:8.2f} us/block".format(name, duration / (rounds * blocks) * 1e6))
+    return duration
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=200, help='verifications of every payload')
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(os.path.join(TESTDATA, '*.dat'))):
+        payloads = [decompress(segment) for segment in load_segments(path)]
+        assert all(not verify_in_one_pass(payload) for payload in payloads)
+        print("{0}: {1} blocks".format(os.path.basename(path), sum(len(payload) // BLOCK_SIZE
+                                                                   for payload in payloads)))
+        before = run("per block", verify_per_block, payloads, args.rounds)
+        after = run("one pass", verify_in_one_pass, payloads, args.rounds)
+        print("  speedup      {0:8.2f}x".format(before / after))
@@ -0,0 +1,135 @@
+"""Benchmark decryption of the pump messages of a recorded session.
+
+Replays a capture made with tests.benchmark_replay, or without one a session
+recorded from the CNL emulator, and decrypts all of its encrypted 0x80 pump
+messages with a new AES-CFB cipher per message as the driver did before,
+with the session's MedtronicCipher one message at a time and with
+MedtronicCipher.decryptBatch:
+
+    $ python -m tests.benchmark_crypto [capture.jsonl] --batch 8
+"""
+import argparse
+import binascii
+import json
+import logging
+import os
+import tempfile
+import time
+
+import Crypto.Cipher.AES
+
+from cnl_emulator import ContourNextLinkEmulator, EmulatedTransport, EmulatorConfig
+from read_minimed_next24 import MedtronicMessage, UsbFrameReader, downloadPumpSession
+from tests.benchmark_replay import Timings, download_operations
+from usb_transport import RecordingTransport, ReplayTransport, Transport
+
+
+class CaptureReports(Transport):
+    def __init__(self, path):
+        with open(path) as capture:
+            records = [json.loads(line) for line in capture if line.strip()]
+        self.reports = [binascii.unhexlify(record["data"]) for record in records
+                        if record["op"] == "read" and record["data"]]
+
+    def read(self, size, timeout=None):
+        return self.reports.pop(0) if self.reports else b''
+
+    def open(self):
+        pass
+
+    def write(self, data):
+        # only the reports read are replayed
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def record_emulator_session(path, history_events):
+    # one event per second, so the whole history falls into the ten minutes downloaded
+    emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=history_events, history_interval_s=1))
+    downloadPumpSession(download_operations(Timings()), RecordingTransport(EmulatedTransport(emulator), path))
+
+
+def replay_session(path):
+    """Replay the capture and return the driver session holding its link key and channel"""
+    sessions = []
+    operations = download_operations(Timings())
+
+    def capture_session(mt):
+        sessions.append(mt.session)
+        operations(mt)
+
+    downloadPumpSession(capture_session, ReplayTransport(path))
+    return sessions[0]
+
+
+def encrypted_payloads(path, session):
+    reader = UsbFrameReader(CaptureReports(path))
+    payloads = []
+    while reader.device.reports:
+        frame = reader.readFrame()
+        if frame is None or len(frame) <= 0x21 or frame[0x12] != 0x80:
+            continue
+        message = bytes(frame[0x21:])
+        # pump messages carry a 22 byte envelope before the encrypted part, network messages are shorter
+        if len(message) > 2 + 22 + 2:
+            encrypted = message[2 + 22:-2]
+            clear = session.cipher.decrypt(encrypted)
+            if MedtronicMessage.calculateCcitt(clear[:-2]) == int.from_bytes(clear[-2:], 'big'):
+                payloads.append(encrypted)
+    return payloads
+
+
+def cipher_per_message(session, payloads):
+    for payload in payloads:
+        cipher = Crypto.Cipher.AES.new(key=session.KEY, mode=Crypto.Cipher.AES.MODE_CFB, iv=session.IV,
+                                       segment_size=128)
+        cipher.decrypt(payload + bytes(16 - len(payload) % 16))[0:len(payload)]
+
+
+def session_cipher(session, payloads):
+    for payload in payloads:
+        session.cipher.decrypt(payload)
+
+
+def session_cipher_batch(session, payloads, batch):
+    for start in range(0, len(payloads), batch):
+        session.cipher.decryptBatch(payloads[start:start + batch])
+
+
+def run(name, function, rounds, count, *args):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(*args)
+    duration = time.perf_counter() - start
+    print("{0:<12} {1:8.2f} us/message".format(name, duration / (rounds * count) * 1e6))
+    return duration
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', nargs='?', help='capture file (JSON lines), default: record the emulator')
+    parser.add_argument('--history-events', type=int, default=600, help='history size of the emulated pump')
+    parser.add_argument('--batch', type=int, default=8, help='messages per decryptBatch call')
+    parser.add_argument('--rounds', type=int, default=200, help='decryptions of every message')
+    args = parser.parse_args()
+
+    logging.getLogger('app').setLevel(logging.CRITICAL)
+
+    capture = os.path.abspath(args.capture) if args.capture else None
+    # Record and replay against an empty configuration database each, see tests.benchmark_replay
+    os.chdir(tempfile.mkdtemp())
+    if capture is None:
+        capture = os.path.abspath('emulator.jsonl')
+        record_emulator_session(capture, args.history_events)
+    os.chdir(tempfile.mkdtemp())
+
+    session = replay_session(capture)
+    payloads = encrypted_payloads(capture, session)
+    print("{0} encrypted messages, {1} bytes".format(len(payloads), sum(len(payload) for payload in payloads)))
+
+    before = run("per message", cipher_per_message, args.rounds, len(payloads), session, payloads)
+    single = run("context", session_cipher, args.rounds, len(payloads), session, payloads)
+    batched = run("batch", session_cipher_batch, args.rounds, len(payloads), session, payloads, args.batch)
+    print("speedup      {0:8.2f}x context, {1:.2f}x batch".format(before / single, before / batched))
@@ -0,0 +1,75 @@
+"""Benchmark PumpConnector poll cycles against the in-process CNL emulator.
+
+Every scenario runs a number of complete get_and_upload_data cycles on a
+virtual clock, so radio latency and resent responses are accounted for
+without waiting for them. Idle time still passes in real time, so a dropped
+response costs the driver's full read timeout:
+
+    $ python -m tests.benchmark_emulator --cycles 20
+
+Pass --persistent to keep the session open between cycles and --realtime to
+sleep for the emulated latencies instead. --stages adds the wall time
+histogram of every stage and driver call.
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from unittest.mock import Mock
+
+from cnl_emulator import ContourNextLinkEmulator, EmulatedTransport, EmulatorConfig, RealClock, VirtualClock
+from pump_connector import PumpConnector
+
+SCENARIOS = {
+    "ideal": EmulatorConfig(radio_latency_ms=5, packet_interval_ms=1),
+    "realistic": EmulatorConfig(resend_rate=0.05, noisy_rate=0.05),
+    "adversarial": EmulatorConfig(radio_latency_ms=60, packet_interval_ms=15, drop_rate=0.02, resend_rate=0.2,
+                                  noisy_rate=0.2, packet_drop_rate=0.02, truncated_packet_rate=0.01,
+                                  history_events=500),
+}
+
+
+def run_scenario(name, config, cycles, realtime, persistent, stages):
+    clock = RealClock() if realtime else VirtualClock()
+    emulator = ContourNextLinkEmulator(config, clock)
+    connector = Mock()
+    pump_connector = PumpConnector(connector, EmulatedTransport(emulator), persistent_session=persistent)
+
+    durations = []
+    wall_durations = []
+    successes = 0
+    for _ in range(cycles):
+        start = clock.now()
+        wall_start = time.perf_counter()
+        pump_connector.get_and_upload_data()
+        durations.append(clock.now() - start)
+        wall_durations.append(time.perf_counter() - wall_start)
+        if connector.update_status.call_args == (("Connected.",),):
+            successes += 1
+    pump_connector.close_session()
+
+    print("{0:<12} {1:3}/{2:<3} ok  cycle {3:8.1f} ms (min {4:8.1f}, max {5:8.1f})  wall {6:7.1f} ms  {7}".format(
+        name, successes, cycles, statistics.mean(durations) * 1000, min(durations) * 1000, max(durations) * 1000,
+        statistics.mean(wall_durations) * 1000, emulator.stats))
+    if stages:
+        for stage, histogram in pump_connector.instrumentation.histograms.items():
+            print("    {0:<26} {1}".format(stage, histogram))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=10, help='poll cycles per scenario')
+    parser.add_argument('--realtime', action='store_true', help='sleep for emulated latencies')
+    parser.add_argument('--persistent', action='store_true', help='keep the session open between cycles')
+    parser.add_argument('--stages', action='store_true', help='print the histogram of every stage')
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS), help='scenarios to run')
+    args = parser.parse_args()
+
+    logging.getLogger('app').setLevel(logging.CRITICAL)
+
+    # The driver keeps its configuration database in the working directory
+    os.chdir(tempfile.mkdtemp())
+    for scenario in args.scenarios:
+        run_scenario(scenario, SCENARIOS[scenario], args.cycles, args.realtime, args.persistent, args.stages)
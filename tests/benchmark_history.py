@@ -0,0 +1,187 @@
+"""Benchmark decoding the pump history of the testdata captures.
+
+The micro benchmark reads event fields the way BinaryDataDecoder did
+before, by slicing the data and unpacking the slice, and the way it does
+now, with precompiled structs at an offset. The macro benchmark runs
+processPumpHistory on every capture, also only for the events of the last 15
+minutes a poll cycle evaluates, and compares the sensor readings of the
+sensor captures as events with the NumPy arrays of processSensorReadings.
+Linking the bolus events is timed for the pump history repeated up to
+--scale times, against every event scanning the history before it, and the peak
+memory of processPumpHistory is compared with streamPumpHistory:
+
+    $ python -m tests.benchmark_history --rounds 20
+"""
+import argparse
+import os
+import pickle
+import struct
+import time
+import timeit
+import tracemalloc
+from datetime import timedelta
+
+from helpers import BinaryDataDecoder
+from pump_history_parser import BolusDeliveredEvent, BolusProgrammedEvent, BolusWizardEstimateEvent, \
+    DualBolusProgrammedEvent, HistoryEventIndex, NGPHistoryEvent, NormalBolusProgrammedEvent, numpy
+from read_minimed_next24 import HISTORY_DATA_TYPE, Medtronic600SeriesDriver
+
+# The events PumpConnector evaluates
+POLL_EVENT_TYPES = frozenset((NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION, NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED,
+                              NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_STOPPED,
+                              NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_RESTARTED))
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+CAPTURES = (
+    ('mortlind_20170923_cgm_sample.dat', HISTORY_DATA_TYPE.SENSOR_DATA),
+    ('paulokow_20170827_sample.dat', HISTORY_DATA_TYPE.PUMP_DATA),
+    ('paulokow_20171217_cgm_sample.dat', HISTORY_DATA_TYPE.SENSOR_DATA),
+    ('paulokow_20171221_history_640G_with_CGM.dat', HISTORY_DATA_TYPE.PUMP_DATA),
+)
+
+
+def load_history_pages(path):
+    # The captures were pickled by Python 2, packets may come back as str
+    with open(path, 'rb') as capture:
+        segments = pickle.load(capture, encoding='latin1')
+    return [[packet.encode('latin1') if isinstance(packet, str) else bytes(packet) for packet in segment]
+            for segment in segments]
+
+
+def read_sliced(binData, offset):
+    return struct.unpack('>I', binData[offset:offset + 4])[0]
+
+
+def micro(rounds):
+    eventData = memoryview(bytes(range(64)))
+    number = rounds * 10000
+    cases = (
+        ("uint32 sliced", lambda: read_sliced(eventData, 0x0E)),
+        ("uint32 unpack_from", lambda: BinaryDataDecoder.readUInt32BE(eventData, 0x0E)),
+        ("3 fields one by one", lambda: (BinaryDataDecoder.readByte(eventData, 0x0B),
+                                         BinaryDataDecoder.readByte(eventData, 0x0C),
+                                         BinaryDataDecoder.readUInt16BE(eventData, 0x0D))),
+        ("3 fields readFields", lambda: BinaryDataDecoder.readFields(eventData, 0x0B, '>BBH')),
+    )
+    for name, case in cases:
+        duration = min(timeit.repeat(case, number=number, repeat=3))
+        print("  {0:<22} {1:8.3f} us".format(name, duration / number * 1e6))
+
+
+def macro(rounds):
+    mt = Medtronic600SeriesDriver()
+    for name, historyType in CAPTURES:
+        history_pages = load_history_pages(os.path.join(TESTDATA, name))
+        events = mt.processPumpHistory(history_pages, historyType)
+        duration = min(timeit.repeat(lambda: mt.processPumpHistory(history_pages, historyType), number=1,
+                                     repeat=rounds))
+        print("  {0:<44} {1:5d} events {2:9.2f} ms".format(name, len(events), duration * 1000))
+        if historyType != HISTORY_DATA_TYPE.PUMP_DATA:
+            continue
+        # PumpConnector decodes the events it evaluates in all pages, the date filter is measured on top
+        pollEvents = mt.processPumpHistory(history_pages, historyType, POLL_EVENT_TYPES)
+        duration = min(timeit.repeat(lambda: mt.processPumpHistory(history_pages, historyType, POLL_EVENT_TYPES),
+                                     number=1, repeat=rounds))
+        print("  {0:<44} {1:5d} events {2:9.2f} ms".format("  poll event types", len(pollEvents), duration * 1000))
+        dateStart = max(event.timestamp for event in events).replace(tzinfo=None) - timedelta(minutes=15)
+        events = mt.processPumpHistory(history_pages, historyType, POLL_EVENT_TYPES, dateStart)
+        duration = min(timeit.repeat(lambda: mt.processPumpHistory(history_pages, historyType, POLL_EVENT_TYPES,
+                                                                   dateStart), number=1, repeat=rounds))
+        print("  {0:<44} {1:5d} events {2:9.2f} ms".format("  last 15 minutes", len(events), duration * 1000))
+
+
+def sensor(rounds):
+    mt = Medtronic600SeriesDriver()
+    for name, historyType in CAPTURES:
+        if historyType != HISTORY_DATA_TYPE.SENSOR_DATA:
+            continue
+        history_pages = load_history_pages(os.path.join(TESTDATA, name))
+        readings = mt.processSensorReadings(history_pages)
+        for case, function in (("events", lambda: mt.processPumpHistory(history_pages, historyType)),
+                               ("arrays", lambda: mt.processSensorReadings(history_pages))):
+            duration = min(timeit.repeat(function, number=1, repeat=rounds))
+            print("  {0:<44} {1:5d} readings {2:<6} {3:9.2f} ms".format(name, len(readings), case, duration * 1000))
+
+
+def link_by_scanning(historyEvents):
+    """The links of postProcess, every event scanning the history before it"""
+    for position, event in enumerate(historyEvents):
+        if isinstance(event, BolusDeliveredEvent):
+            [x for x in historyEvents[:position]
+             if isinstance(x, NormalBolusProgrammedEvent)
+             and x.bolusNumber == event.bolusNumber
+             and x.timestamp <= event.timestamp
+             and event.timestamp - x.timestamp < timedelta(minutes=5)]
+        elif isinstance(event, BolusProgrammedEvent):
+            amount = event.programmedAmountImmediate if isinstance(event, DualBolusProgrammedEvent) \
+                else event.programmedAmount
+            [x for x in historyEvents[:position]
+             if isinstance(x, BolusWizardEstimateEvent)
+             and x.timestamp <= event.timestamp
+             and event.timestamp - x.timestamp < timedelta(minutes=5)
+             and x.finalEstimate == amount
+             and not x.programmed]
+
+
+def link_by_index(historyEvents):
+    historyIndex = HistoryEventIndex(historyEvents)
+    for event in historyEvents:
+        event.postProcess(historyIndex)
+
+
+def linking(rounds, scale):
+    mt = Medtronic600SeriesDriver()
+    name, historyType = CAPTURES[1]
+    events = mt.processPumpHistory(load_history_pages(os.path.join(TESTDATA, name)), historyType)
+    copies = 1
+    while copies <= scale:
+        historyEvents = events * copies
+        scanning = min(timeit.repeat(lambda: link_by_scanning(historyEvents), number=1,
+                                     repeat=max(rounds // copies, 1)))
+        index = min(timeit.repeat(lambda: link_by_index(historyEvents), number=1, repeat=rounds))
+        print("  {0:6d} events  scanning {1:9.2f} ms  index {2:7.2f} ms".format(len(historyEvents), scanning * 1000,
+                                                                               index * 1000))
+        copies *= 2
+
+
+def streaming(scale):
+    mt = Medtronic600SeriesDriver()
+    name, historyType = CAPTURES[1]
+    history_pages = load_history_pages(os.path.join(TESTDATA, name))
+    copies = 1
+    while copies <= scale:
+        segments = history_pages * copies
+        for case, function in (("list", lambda: mt.processPumpHistory(segments, historyType)),
+                               ("stream", lambda: mt.streamPumpHistory(segments, historyType))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            first = None
+            events = 0
+            for _ in function():
+                if first is None:
+                    first = time.perf_counter() - start
+                events += 1
+            duration = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("  {0:6d} events {1:<6} first event {2:9.2f} ms, all {3:9.2f} ms, peak {4:7.0f} kB".format(
+                events, case, first * 1000, duration * 1000, peak / 1024))
+        copies *= 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20, help='repetitions, the fastest one is reported')
+    parser.add_argument('--scale', type=int, default=8, help='largest number of copies of the history to link')
+    args = parser.parse_args()
+
+    print("Field reads:")
+    micro(args.rounds)
+    print("processPumpHistory:")
+    macro(args.rounds)
+    if numpy is not None:
+        print("Sensor readings:")
+        sensor(args.rounds)
+    print("Linking:")
+    linking(args.rounds, args.scale)
+    print("Streaming:")
+    streaming(args.scale)
@@ -0,0 +1,70 @@
+"""Benchmark a full pump download against a recorded USB capture.
+
+Record a capture with the Contour Next Link plugged in:
+
+    $ python -m tests.benchmark_replay --record capture.jsonl
+
+and replay it at full speed, e.g. in CI, to compare latency across changes:
+
+    $ python -m tests.benchmark_replay capture.jsonl
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from read_minimed_next24 import Medtronic600SeriesDriver, HISTORY_DATA_TYPE, downloadPumpSession
+from usb_transport import HidTransport, RecordingTransport, ReplayTransport
+
+
+class Timings(object):
+    def __init__(self):
+        self.steps = []
+
+    def measure(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.steps.append((name, time.perf_counter() - start))
+        return result
+
+    def report(self):
+        for name, duration in self.steps:
+            print("{0:<24} {1:10.3f} ms".format(name, duration * 1000))
+
+
+def download_operations(timings):
+    def operations(mt):
+        start_date = datetime.datetime.now() - datetime.timedelta(minutes=10)
+        timings.measure("getPumpStatus", mt.getPumpStatus)
+        history_info = timings.measure("getPumpHistoryInfo", mt.getPumpHistoryInfo, start_date,
+                                       datetime.datetime.max, HISTORY_DATA_TYPE.PUMP_DATA)
+        history_pages = timings.measure("getPumpHistory", mt.getPumpHistory, history_info.historySize, start_date,
+                                        datetime.datetime.max, HISTORY_DATA_TYPE.PUMP_DATA)
+        events = timings.measure("processPumpHistory", mt.processPumpHistory, history_pages,
+                                 HISTORY_DATA_TYPE.PUMP_DATA)
+        print("Decoded {0} events".format(len(events)))
+
+    return operations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help='capture file (JSON lines)')
+    parser.add_argument('--record', action='store_true', help='record a new capture from the device')
+    parser.add_argument('--realtime', action='store_true', help='replay with the recorded read timing')
+    args = parser.parse_args()
+
+    capture = os.path.abspath(args.capture)
+    # Start from an empty configuration database, so cached link credentials and channel statistics do not
+    # change the exchanges between recording and replay
+    os.chdir(tempfile.mkdtemp())
+    if args.record:
+        transport = RecordingTransport(HidTransport(Medtronic600SeriesDriver.USB_VID,
+                                                    Medtronic600SeriesDriver.USB_PID), capture)
+    else:
+        transport = ReplayTransport(capture, realtime=args.realtime)
+
+    timings = Timings()
+    timings.measure("downloadPumpSession", downloadPumpSession, download_operations(timings), transport)
+    timings.report()
@@ -0,0 +1,117 @@
+"""Microbenchmark of USB report reassembly into CNL frames.
+
+Compares the per-report cost of the former tuple based reassembly with
+UsbFrameReader.readFrame on multipacket history sized 0x80 frames:
+
+    $ python -m tests.benchmark_usb_reassembly --frames 20000
+"""
+import argparse
+import logging
+import struct
+import time
+
+from read_minimed_next24 import BayerBinaryMessage, MedtronicSession, UsbFrameReader
+from usb_transport import Transport
+
+logger = logging.getLogger('app')
+
+
+class MemoryTransport(Transport):
+    def __init__(self, reports):
+        self.reports = reports
+        self.position = 0
+
+    def read(self, size, timeout=None):
+        if self.position >= len(self.reports):
+            return b''
+        report = self.reports[self.position]
+        self.position += 1
+        return report
+
+    def readinto(self, buffer, timeout=None):
+        if self.position >= len(self.reports):
+            return 0
+        report = self.reports[self.position]
+        self.position += 1
+        buffer[:len(report)] = report
+        return len(report)
+
+    def open(self):
+        pass
+
+    def write(self, data):
+        # only the reports read are replayed
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def split_reports(message):
+    reports = []
+    for i in range(0, len(message), 60):
+        chunk = message[i:i + 60]
+        reports.append((struct.pack('>3sB', b'ABC', len(chunk)) + chunk).ljust(64, b'\x00'))
+    return reports
+
+
+def tuple_read_frame(device):
+    """Reassembly as readMessage did it before frames were read in place"""
+    payload = bytearray()
+    bytesRead = 0
+    payloadSize = 0
+    expectedSize = 0
+    first = True
+
+    while first or (bytesRead > 0 and payloadSize == 60 and len(payload) != expectedSize):
+        data = device.read(64, timeout=10000)
+        first = False
+        if data:
+            data = struct.unpack(">64B", data)
+            bytesRead = len(data)
+            payloadSize = data[3]
+            if (bytearray(data[0:3]) != b'ABC'):
+                raise RuntimeError('Recieved invalid USB packet')
+            payload.extend(data[4:data[3] + 4])
+
+            if expectedSize == 0 and data[3] >= 0x21 and (
+                    (data[0x12 + 4] & 0xFF == 0x80) or (data[0x12 + 4] & 0xFF == 0x81)):
+                expectedSize = 0x21 + ((data[0x1C + 4] & 0x00FF) | (data[0x1D + 4] << 8 & 0xFF00))
+
+            logger.debug('READ: bytesRead={0}, payloadSize={1}, expectedSize={2}'.format(bytesRead, payloadSize,
+                                                                                         expectedSize))
+        else:
+            return None
+    return payload
+
+
+def run(name, reports, frames, read_frame):
+    transport = MemoryTransport(reports)
+    start = time.perf_counter()
+    for _ in range(frames):
+        read_frame(transport)
+    duration = time.perf_counter() - start
+    print("{0:<10} {1:8.3f} us/report  {2:8.1f} ms total".format(name, duration / len(reports) * 1e6,
+                                                                duration * 1000))
+    return duration
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=20000, help='number of 0x80 frames')
+    parser.add_argument('--payload', type=int, default=200, help='frame payload size in bytes')
+    args = parser.parse_args()
+
+    message = bytes(BayerBinaryMessage(0x80, MedtronicSession(), bytes(range(256)) * (args.payload // 256) +
+                                       bytes(range(args.payload % 256))).encode())
+    reports = split_reports(message) * args.frames
+
+    before = run("tuple", reports, args.frames, tuple_read_frame)
+    reader = UsbFrameReader(None)
+
+    def read_frame(transport):
+        reader.device = transport
+        return reader.readFrame()
+
+    after = run("in place", reports, args.frames, read_frame)
+    print("speedup    {0:8.2f}x".format(before / after))
@@ -0,0 +1,25 @@
+import unittest
+
+from helpers import BinaryDataDecoder
+
+
+class TestBinaryDataDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.data = bytes.fromhex('00010203040506070809')
+
+    def test_read_at_offset(self):
+        for data in (self.data, bytearray(self.data), memoryview(self.data)):
+            self.assertEqual(BinaryDataDecoder.readByte(data, 0x09), 0x09)
+            self.assertEqual(BinaryDataDecoder.readUInt16BE(data, 0x01), 0x0102)
+            self.assertEqual(BinaryDataDecoder.readUInt32BE(data, 0x02), 0x02030405)
+            self.assertEqual(BinaryDataDecoder.readUInt64BE(data, 0x02), 0x0203040506070809)
+
+    def test_read_fields(self):
+        self.assertEqual(BinaryDataDecoder.readFields(memoryview(self.data)[2:], 0x01, '>BHI'),
+                         (0x03, 0x0405, 0x06070809))
+        self.assertIs(BinaryDataDecoder.layout('>BHI'), BinaryDataDecoder.layout('>BHI'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from cnl_emulator import ContourNextLinkEmulator, EmulatedTransport, EmulatorConfig
+from pump_connector import PumpConnector
+from pump_history_parser import SensorGlucoseReading
+from read_minimed_next24 import HISTORY_DATA_TYPE, Config, DataIncompleteError, HistoryCheckpoints, \
+    Medtronic600SeriesDriver, downloadPumpSession
+
+
+class TestContourNextLinkEmulator(unittest.TestCase):
+
+    def setUp(self):
+        # The driver keeps its configuration database in the working directory
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, emulator, history_type=HISTORY_DATA_TYPE.PUMP_DATA, minutes=60):
+        result = {}
+
+        def operations(mt):
+            start_date = datetime.datetime.now() - datetime.timedelta(minutes=minutes)
+            result["status"] = mt.getPumpStatus()
+            history_pages = mt.getPumpHistory(None, start_date, datetime.datetime.max, history_type)
+            result["events"] = mt.processPumpHistory(history_pages, history_type)
+
+        downloadPumpSession(operations, EmulatedTransport(emulator))
+        return result
+
+    def test_download_pump_session(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=600))
+        result = self.download(emulator)
+
+        self.assertEqual(result["status"].sensorBGL, 226)
+        # 600 events are more than one block, so only the blocks reaching into the last hour are sent
+        self.assertGreaterEqual(len(result["events"]), 12)
+        self.assertLess(len(result["events"]), 600)
+        self.assertGreater(emulator.clock.now(), 0)
+
+    def test_download_sensor_history_in_several_segments(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=400, blocks_per_segment=1))
+        result = self.download(emulator, HISTORY_DATA_TYPE.SENSOR_DATA, minutes=48 * 60)
+
+        self.assertEqual(len(result["events"]), 400)
+        self.assertTrue(all(isinstance(event, SensorGlucoseReading) for event in result["events"]))
+
+    def test_reassembles_segments_in_place(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=400, blocks_per_segment=1, resend_rate=0.5))
+        segments = []
+
+        def operations(mt):
+            start_date = datetime.datetime.now() - datetime.timedelta(days=2)
+            segments.extend(mt.getPumpHistory(None, start_date, datetime.datetime.max, HISTORY_DATA_TYPE.SENSOR_DATA))
+
+        downloadPumpSession(operations, EmulatedTransport(emulator))
+
+        self.assertGreater(len(segments), 1)
+        mt = Medtronic600SeriesDriver()
+        for segment in segments:
+            self.assertIsInstance(segment, bytearray)
+            blocks = mt.decodePumpSegment(segment, HISTORY_DATA_TYPE.SENSOR_DATA)
+            self.assertTrue(all(isinstance(block, memoryview) for block in blocks))
+            # the packets of an older capture decode to the same blocks
+            packets = [bytes(segment[start:start + 160]) for start in range(0, len(segment), 160)]
+            self.assertEqual([bytes(block) for block in mt.decodePumpSegment(packets, HISTORY_DATA_TYPE.SENSOR_DATA)],
+                             [bytes(block) for block in blocks])
+
+    def download_sensor_history(self, emulator):
+        result = {}
+
+        def operations(mt):
+            # Idle time passes in real time on the virtual clock
+            mt.MULTIPACKET_TIMEOUT_MS = 200
+            start_date = datetime.datetime.now() - datetime.timedelta(days=2)
+            history_pages = mt.getPumpHistory(None, start_date, datetime.datetime.max, HISTORY_DATA_TYPE.SENSOR_DATA)
+            result["events"] = mt.processPumpHistory(history_pages, HISTORY_DATA_TYPE.SENSOR_DATA)
+
+        downloadPumpSession(operations, EmulatedTransport(emulator))
+        return result
+
+    def test_resends_lost_packets(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=400, blocks_per_segment=1,
+                                                          packet_drop_rate=0.1, truncated_packet_rate=0.05))
+        result = self.download_sensor_history(emulator)
+
+        self.assertEqual(len(result["events"]), 400)
+        self.assertGreater(emulator.stats["dropped_packets"], 0)
+        self.assertGreater(emulator.stats["truncated_packets"], 0)
+        self.assertGreater(emulator.stats["resend_requests"], 0)
+
+    def test_gives_up_resending_packets(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=400, packet_drop_rate=1.0))
+
+        with self.assertRaises(DataIncompleteError):
+            self.download_sensor_history(emulator)
+        self.assertEqual(emulator.stats["resend_requests"], Medtronic600SeriesDriver.MULTIPACKET_RESEND_ATTEMPTS)
+
+    def test_resumes_interrupted_transfer(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(history_events=400, blocks_per_segment=1))
+        pump = emulator.pump
+        next_segment = pump.next_segment
+        segments_sent = []
+
+        def lose_connection_after_three_segments(latency):
+            segments_sent.append(latency)
+            if len(segments_sent) == 4:
+                emulator.config.packet_drop_rate = 1.0
+            return next_segment(latency)
+
+        def operations(mt):
+            mt.MULTIPACKET_TIMEOUT_MS = 200
+            start_date = datetime.datetime.now() - datetime.timedelta(days=2)
+            history_pages = mt.getPumpHistory(None, start_date, datetime.datetime.max, HISTORY_DATA_TYPE.SENSOR_DATA,
+                                              HistoryCheckpoints())
+            result["events"] = mt.processPumpHistory(history_pages, HISTORY_DATA_TYPE.SENSOR_DATA)
+
+        result = {}
+        with patch.object(pump, "next_segment", side_effect=lose_connection_after_three_segments):
+            with self.assertRaises(DataIncompleteError):
+                downloadPumpSession(operations, EmulatedTransport(emulator))
+        segments_total = len(pump.history_segments(HISTORY_DATA_TYPE.SENSOR_DATA, 0))
+        emulator.config.packet_drop_rate = 0.0
+        segments_sent.clear()
+
+        with patch.object(pump, "next_segment", side_effect=next_segment) as resumed:
+            downloadPumpSession(operations, EmulatedTransport(emulator))
+
+        # the three segments completed before the connection was lost are not requested again
+        self.assertEqual(resumed.call_count, segments_total - 3 + 1)
+        timestamps = [event.timestamp for event in result["events"]]
+        self.assertEqual(len(timestamps), 400)
+        self.assertEqual(len(set(timestamps)), 400)
+
+    def test_negotiates_other_channel(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(pump_channel=0x1a))
+        self.download(emulator)
+
+        # all five channels are tried before the pump answers on 0x1a
+        self.assertEqual(emulator.stats["requests"], 5 + 7)
+
+    def test_channel_statistics_order_next_negotiation(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(pump_channel=0x1a))
+        self.download(emulator)
+        emulator.config.pump_channel = 0x0e
+        self.download(emulator)
+        requests = emulator.stats["requests"]
+
+        self.download(emulator)
+
+        # 0x0e is tried first, although it is the third channel in CareLink order
+        self.assertEqual(emulator.stats["requests"] - requests, 1 + 7)
+        statistics = Config(emulator.STICK_SERIAL).channelStatistics
+        self.assertEqual(statistics.order(Medtronic600SeriesDriver.CHANNELS)[:2], [0x0e, 0x1a])
+        self.assertEqual(statistics.channels[0x0e]["rssi"], 0x3F)
+
+    def test_reuses_cached_link_credentials(self):
+        emulator = ContourNextLinkEmulator()
+        self.download(emulator)
+
+        with patch.object(Medtronic600SeriesDriver, "readInfo", autospec=True) as read_info, \
+                patch.object(Medtronic600SeriesDriver, "readLinkKey", autospec=True) as read_link_key:
+            result = self.download(emulator)
+
+        self.assertEqual(result["status"].sensorBGL, 226)
+        read_info.assert_not_called()
+        read_link_key.assert_not_called()
+        config = Config(emulator.STICK_SERIAL)
+        self.assertEqual(config.pumpMAC, emulator.pump.PUMP_MAC)
+        self.assertEqual(config.key, bytes(emulator.LINK_KEY).hex())
+
+    def test_pump_change_invalidates_cached_link_credentials(self):
+        emulator = ContourNextLinkEmulator()
+        self.download(emulator)
+        emulator.pump.PUMP_MAC = 0x0023F70000654321
+
+        result = self.download(emulator)
+
+        self.assertEqual(result["status"].sensorBGL, 226)
+        self.assertEqual(Config(emulator.STICK_SERIAL).pumpMAC, 0x0023F70000654321)
+
+    def test_pump_connector_cycle(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(resend_rate=0.5, noisy_rate=0.5))
+        connector = Mock()
+
+        PumpConnector(connector, EmulatedTransport(emulator)).get_and_upload_data()
+
+        connector.update_status.assert_called_with("Connected.")
+        connector.update_bgl.assert_called_with(state=226)
+        self.assertGreater(emulator.stats["resent"], 0)
+
+    def test_pump_connector_cycle_summary(self):
+        emulator = ContourNextLinkEmulator(EmulatorConfig(pump_channel=0x1a))
+        pump_connector = PumpConnector(Mock(), EmulatedTransport(emulator))
+
+        pump_connector.get_and_upload_data()
+
+        summary = pump_connector.last_cycle
+        names = [span.name for span in summary.spans]
+        self.assertLess(names.index("_open_connection"), names.index("negotiateChannel"))
+        self.assertLess(names.index("negotiateChannel"), names.index("getPumpMeasurement"))
+        negotiate = summary.spans[names.index("negotiateChannel")]
+        self.assertEqual(negotiate.depth, summary.spans[names.index("_open_connection")].depth + 1)
+        self.assertEqual(summary.counters["channel_attempts"], 5)
+        self.assertGreater(summary.counters["usb_reports_written"], emulator.stats["requests"])
+        self.assertEqual(summary.counters["usb_bytes_read"], 64 * summary.counters["usb_reports_read"])
+        self.assertEqual(len(pump_connector.instrumentation.histogram("negotiateChannel")), 1)
+
+    def test_pump_connector_persistent_session(self):
+        emulator = ContourNextLinkEmulator()
+        connector = Mock()
+        pump_connector = PumpConnector(connector, EmulatedTransport(emulator), persistent_session=True)
+
+        pump_connector.get_and_upload_data()
+        requests_first_cycle = emulator.stats["requests"]
+        pump_connector.get_and_upload_data()
+        pump_connector.close_session()
+
+        connector.update_status.assert_called_with("Connected.")
+        # channel negotiation is only needed once
+        self.assertEqual(emulator.stats["requests"], 2 * requests_first_cycle - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from read_minimed_next24 import ChannelStatistics, Config, ConfigStore, HistoryCheckpoints
+
+
+class TestConfigStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'read_minimed.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_rows(self):
+        with sqlite3.connect(self.path) as conn:
+            return conn.execute('SELECT stick_serial, last_radio_channel, pump_mac FROM config '
+                                'ORDER BY stick_serial').fetchall()
+
+    def test_writes_are_deferred_until_flush(self):
+        store = ConfigStore(self.path)
+        config = Config('6213-1234567', store)
+        config.lastRadioChannel = 0x1a
+        config.storeCredentials(0x0023F745EE000001, 0x0023F70000123456, '10111213')
+
+        self.assertEqual(config.lastRadioChannel, 0x1a)
+        self.assertEqual(self.read_rows(), [])
+
+        config.flush()
+        self.assertEqual(self.read_rows(), [('6213-1234567', 0x1a, 0x0023F70000123456)])
+
+    def test_several_sticks(self):
+        store = ConfigStore(self.path)
+        Config('6213-1', store).lastRadioChannel = 0x0e
+        Config('6213-2', store).lastRadioChannel = 0x17
+        store.flush()
+
+        store = ConfigStore(self.path)
+        self.assertEqual(Config('6213-1', store).lastRadioChannel, 0x0e)
+        self.assertEqual(Config('6213-2', store).lastRadioChannel, 0x17)
+        self.assertEqual(Config('6213-3', store).lastRadioChannel, 0x14)
+
+    def test_one_store_per_database(self):
+        self.assertIs(ConfigStore.open(self.path), ConfigStore.open(self.path))
+
+    def test_wal_mode(self):
+        store = ConfigStore(self.path)
+        self.assertEqual(store.conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_migrates_old_database(self):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute('CREATE TABLE config ( stick_serial TEXT PRIMARY KEY, hmac TEXT, key TEXT, '
+                         'last_radio_channel INTEGER )')
+            conn.execute("INSERT INTO config VALUES ( '6213-1', '', '', 23 )")
+
+        config = Config('6213-1', ConfigStore(self.path))
+        self.assertEqual(config.lastRadioChannel, 23)
+        self.assertIsNone(config.pumpMAC)
+
+    def test_channel_statistics_are_persisted(self):
+        store = ConfigStore(self.path)
+        statistics = ChannelStatistics()
+        statistics.record(0x17, True, rssi=0x40, latency=0.1)
+        Config('6213-1', store).channelStatistics = statistics
+        store.flush()
+
+        restored = Config('6213-1', ConfigStore(self.path)).channelStatistics
+        self.assertEqual(restored.channels, statistics.channels)
+
+
+class TestHistoryCheckpoints(unittest.TestCase):
+    PUMP_MAC = 0x0023F70000123456
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'read_minimed.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resumes_after_stored_segments(self):
+        checkpoints = HistoryCheckpoints(self.path)
+        checkpoints.store(self.PUMP_MAC, 3, 1000, 1999, b'first')
+        checkpoints.store(self.PUMP_MAC, 3, 2000, 2999, b'second')
+        # another pump and a segment after a gap are not part of the transfer
+        checkpoints.store(0x0023F70000654321, 3, 3000, 3999, b'other pump')
+        checkpoints.store(self.PUMP_MAC, 3, 4000, 4999, b'after gap')
+
+        segments, resumeRtc = HistoryCheckpoints(self.path).resume(self.PUMP_MAC, 3, 1500)
+
+        self.assertEqual(segments, [b'first', b'second'])
+        self.assertEqual(resumeRtc, 3000)
+        self.assertEqual(checkpoints.resume(self.PUMP_MAC, 2, 1500), ([], 1500))
+
+    def test_discard_old_segments(self):
+        checkpoints = HistoryCheckpoints(self.path)
+        checkpoints.store(self.PUMP_MAC, 3, 1000, 1999, b'first')
+        checkpoints.store(self.PUMP_MAC, 3, 2000, 2999, b'second')
+
+        checkpoints.discard(self.PUMP_MAC, 3, 2500)
+
+        self.assertEqual(checkpoints.resume(self.PUMP_MAC, 3, 1000), ([], 1000))
+        self.assertEqual(checkpoints.resume(self.PUMP_MAC, 3, 2000), ([b'second'], 3000))
+
+
+class TestChannelStatistics(unittest.TestCase):
+    CHANNELS = [0x14, 0x11, 0x0e, 0x17, 0x1a]
+
+    def test_unknown_channels_keep_their_order(self):
+        statistics = ChannelStatistics()
+        statistics.record(0x14, False)
+
+        self.assertEqual(statistics.order([0x17] + self.CHANNELS), [0x17, 0x11, 0x0e, 0x1a, 0x14])
+
+    def test_decay_moves_pump_to_new_channel(self):
+        statistics = ChannelStatistics()
+        for _ in range(10):
+            statistics.decay()
+            statistics.record(0x14, True, rssi=0x30)
+        statistics.decay()
+        statistics.record(0x14, False)
+
+        # a single miss does not outweigh the history
+        self.assertEqual(statistics.order(self.CHANNELS)[0], 0x14)
+
+        statistics.record(0x1a, True, rssi=0x30)
+        self.assertEqual(statistics.order(self.CHANNELS)[:2], [0x1a, 0x14])
+
+    def test_noisy_channel_ranks_lower(self):
+        statistics = ChannelStatistics()
+        statistics.record(0x11, True, rssi=0x30, noisy=True)
+        statistics.record(0x17, True, rssi=0x30)
+
+        self.assertEqual(statistics.order(self.CHANNELS)[:2], [0x17, 0x11])
+
+    def test_invalid_json(self):
+        self.assertEqual(ChannelStatistics.fromJson('[1, 2').channels, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import struct
+import unittest
+
+from helpers import CrcHelper
+
+
+def history_block(data, size=64):
+    return data + bytes(size - 4 - len(data)) + struct.pack('>HH', len(data), CrcHelper.ccitt(data))
+
+
+class TestCrcHelper(unittest.TestCase):
+
+    def test_ccitt(self):
+        self.assertEqual(CrcHelper.ccitt(b'123456789'), 0x29B1)
+        self.assertEqual(CrcHelper.ccitt(memoryview(b'0123456789')[1:]), 0x29B1)
+
+    def test_verify_blocks(self):
+        payload = bytearray(history_block(b'\x01' * 10) + history_block(b'\x02' * 60) + history_block(b''))
+        self.assertEqual(CrcHelper.verifyBlocks(payload, 64), [])
+
+        payload[64 + 5] ^= 0x01
+        payload[128 + 61] = 0xFF  # size beyond the block
+        self.assertEqual(CrcHelper.verifyBlocks(payload, 64), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import struct
+import unittest
+
+import Crypto.Cipher.AES
+
+from read_minimed_next24 import COM_D_COMMAND, ChecksumException, MedtronicCipher, MedtronicMessage, \
+    MedtronicReceiveMessage, MedtronicSession, MultiPacketSegment, PumpStatusResponseMessage, PumpTimeResponseMessage, \
+    UnexpectedMessageException
+
+
+def reference_cfb(key, iv):
+    return Crypto.Cipher.AES.new(key, Crypto.Cipher.AES.MODE_CFB, iv=iv, segment_size=128)
+
+
+class TestMedtronicCipher(unittest.TestCase):
+
+    def setUp(self):
+        self.key = bytes(range(0x10, 0x20))
+        self.iv = bytes([0x14]) + self.key[1:]
+        self.cipher = MedtronicCipher(self.key, self.iv)
+        self.messages = [os.urandom(size) for size in (0, 1, 15, 16, 17, 48, 131)]
+
+    def test_matches_cfb(self):
+        for message in self.messages:
+            self.assertEqual(self.cipher.encrypt(message), reference_cfb(self.key, self.iv).encrypt(message))
+            self.assertEqual(self.cipher.decrypt(message), reference_cfb(self.key, self.iv).decrypt(message))
+
+    def test_decrypt_batch(self):
+        self.assertEqual(self.cipher.decryptBatch(self.messages),
+                         [reference_cfb(self.key, self.iv).decrypt(message) for message in self.messages])
+
+    def test_session_cipher_follows_channel(self):
+        session = MedtronicSession()
+        session.KEY = self.key
+        session.radioChannel = 0x14
+        cipher = session.cipher
+        self.assertIs(session.cipher, cipher)
+
+        session.radioChannel = 0x1a
+        self.assertIsNot(session.cipher, cipher)
+        self.assertEqual(session.cipher.iv, session.IV)
+
+
+class PumpMessageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.session = MedtronicSession()
+        self.session.KEY = bytes(range(0x10, 0x20))
+        self.session.radioChannel = 0x14
+
+    def pump_message(self, messageType, data):
+        clear = struct.pack('>BH', 1, messageType) + data
+        clear += struct.pack('>H', MedtronicMessage.calculateCcitt(clear))
+        payload = bytes(22) + self.session.cipher.encrypt(clear)
+        message = struct.pack('<BB', 0x55, len(payload) + 2) + payload
+        return message + struct.pack('<H', MedtronicMessage.calculateCcitt(message))
+
+
+class TestDecodeBatch(PumpMessageTestCase):
+
+    def test_errors_in_place(self):
+        broken = bytearray(self.pump_message(0x0407, b'\x00' * 4))
+        broken[-1] ^= 0xFF
+        messages = [self.pump_message(0x0407, b'\x01' * 4), bytes(broken), self.pump_message(0x0407, b'\x02' * 20)]
+
+        responses = MedtronicReceiveMessage.decodeBatch(messages, self.session)
+
+        self.assertEqual(responses[0].responsePayload, MedtronicReceiveMessage.decode(messages[0],
+                                                                                      self.session).responsePayload)
+        self.assertIsInstance(responses[1], ChecksumException)
+        self.assertEqual(responses[2].messageType, 0x0407)
+        self.assertEqual(responses[2].responsePayload[3:], b'\x02' * 20)
+
+
+class TestResponseDispatch(PumpMessageTestCase):
+
+    def test_decoded_into_registered_class(self):
+        status = MedtronicReceiveMessage.decode(self.pump_message(COM_D_COMMAND.READ_PUMP_STATUS_RESPONSE, bytes(96)),
+                                                self.session)
+        segment, unknown = MedtronicReceiveMessage.decodeBatch(
+            [self.pump_message(COM_D_COMMAND.END_HISTORY_TRANSMISSION, bytes(4)), self.pump_message(0x0123, bytes(4))],
+            self.session)
+
+        self.assertIs(type(status), PumpStatusResponseMessage)
+        self.assertIs(type(segment), MultiPacketSegment)
+        self.assertIs(type(unknown), MedtronicReceiveMessage)
+
+    def test_typed_decode(self):
+        message = self.pump_message(COM_D_COMMAND.TIME_RESPONSE, bytes(9))
+        self.assertIsInstance(PumpTimeResponseMessage.decode(message, self.session), PumpTimeResponseMessage)
+        with self.assertRaises(UnexpectedMessageException):
+            PumpStatusResponseMessage.decode(message, self.session)
+
+    def test_subclass_registers_itself(self):
+        class Type405ResponseMessage(MedtronicReceiveMessage):
+            RESPONSE_TYPES = (0x0405,)
+
+        self.addCleanup(MedtronicReceiveMessage._responseClasses.pop, 0x0405)
+        self.assertIs(type(MedtronicReceiveMessage.decode(self.pump_message(0x0405, bytes(4)), self.session)),
+                      Type405ResponseMessage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import datetime
+import unittest
+
+from dateutil import tz
+
+from helpers import DateTimeContext, DateTimeHelper, numpy
+
+OFFSET = -0x5A3D7B6
+BERLIN = tz.gettz('Europe/Berlin')
+
+
+def encode(localTime):
+    return DateTimeHelper.rtcFromDate(localTime, OFFSET) << 32 | (OFFSET & 0xffffffff)
+
+
+class TestDateTimeHelper(unittest.TestCase):
+
+    def test_date_from_rtc(self):
+        localTime = datetime.datetime(2021, 3, 28, 2, 30)
+        rtc = DateTimeHelper.rtcFromDate(localTime, OFFSET)
+
+        self.assertEqual(DateTimeHelper.dateFromRtc(rtc, OFFSET), localTime)
+
+
+class TestDateTimeContext(unittest.TestCase):
+
+    def test_times_around_dst_change(self):
+        context = DateTimeContext(BERLIN)
+        # Summer time ends at 3:00 on 29 October 2017
+        times = [datetime.datetime(2017, 10, 29, 1, 30), datetime.datetime(2017, 10, 29, 4, 30)]
+
+        decoded = context.decodeDateTimes([encode(localTime) for localTime in times])
+
+        self.assertEqual([dateTime.replace(tzinfo=None) for dateTime in decoded], times)
+        self.assertEqual([dateTime.utcoffset() for dateTime in decoded],
+                         [datetime.timedelta(hours=2), datetime.timedelta(hours=1)])
+
+    def test_decoded_once(self):
+        context = DateTimeContext(BERLIN)
+        pumpDateTime = encode(datetime.datetime(2017, 12, 10))
+
+        self.assertIs(context.decodeDateTime(pumpDateTime), context.decodeDateTime(pumpDateTime))
+        self.assertEqual(context.decodeDateTime(pumpDateTime),
+                         DateTimeHelper.decodeDateTime(pumpDateTime, None, BERLIN))
+        self.assertEqual(context.decodeDateTimes([pumpDateTime >> 32], [OFFSET]),
+                         [context.decodeDateTime(pumpDateTime)])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_arrays(self):
+        context = DateTimeContext(BERLIN)
+        # Summer time starts at 2:00 on 26 March 2017
+        times = [datetime.datetime(2017, 3, 26, 1, 59, 59), datetime.datetime(2017, 3, 26, 3, 0),
+                 datetime.datetime(2009, 1, 1)]
+        pumpDateTimes = numpy.array([encode(localTime) for localTime in times], dtype=numpy.uint64)
+
+        self.assertEqual(context.decodeDateTimes64(pumpDateTimes).tolist(), times)
+        self.assertEqual(context.decodeDateTimes64(pumpDateTimes >> numpy.uint64(32), [OFFSET] * 3).tolist(), times)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+from pump_data import MedtronicDataStatus
 from read_minimed_next24 import PumpStatusResponseMessage
 
 from test_helper import data_provider
@@ -104,6 +105,26 @@ class TestPumpStatusDecode(unittest.TestCase):
 
         self.assertEqual(testobj.sensorStatus, exp_status)
 
+    def test_PumpStatusResponseMessage_Snapshot(self):
+        testobj = PumpStatusResponseMessage()
+        testobj.responsePayload = bytearray.fromhex(
+            '02013C5000000000000000000000000000000BB82799FA6E410001000013880000000000000000005CC632002274501900000000000063868498F3A115F66800601000011D3D000000000000000000000000000000000000000008FC000008FC')
+        snapshot = testobj.snapshot
+        self.assertIs(testobj.snapshot, snapshot)
+
+        measurement = snapshot.measurementData()
+        self.assertEqual(measurement.bgl_value, 99)
+        self.assertEqual(measurement.trend, 'No arrows')
+        self.assertEqual(measurement.current_basal_rate, 0.5)
+        self.assertEqual(measurement.battery_level, 50)
+        self.assertEqual(measurement.status, MedtronicDataStatus.valid)
+        self.assertEqual(measurement.timestamp, testobj.sensorBGLTimestamp)
+
+        testobj.responsePayload = bytearray.fromhex(
+            '02013C1000000000000000000000000000005DC02799A7623F000300001770000000000000000001220A640005E8B2190000002AF80000000000000000000000000000000000000000000000000000000000000000000000000008F4000008F4')
+        self.assertIsNot(testobj.snapshot, snapshot)
+        self.assertIsNone(testobj.trendArrow)
+
 
 if __name__ == '__main__':
     unittest.main()
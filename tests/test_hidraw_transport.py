@@ -0,0 +1,96 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tty
+import unittest
+
+from read_minimed_next24 import Medtronic600SeriesDriver, TimeoutException
+from usb_transport import HidrawTransport
+
+
+def usb_report(payload):
+    return (struct.pack('>3sB', b'ABC', len(payload)) + payload).ljust(64, b'\x00')
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "hidraw is Linux only")
+class TestHidrawTransport(unittest.TestCase):
+
+    def setUp(self):
+        # A raw pty stands in for the hidraw device node
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.transport = HidrawTransport(path=os.ttyname(self.slave))
+        self.transport.open()
+
+    def tearDown(self):
+        self.transport.close()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def test_readinto_returns_report(self):
+        os.write(self.master, usb_report(b'\x06'))
+
+        buffer = bytearray(64)
+        self.assertEqual(self.transport.readinto(buffer, timeout=1000), 64)
+        self.assertEqual(buffer, usb_report(b'\x06'))
+
+    def test_read_times_out(self):
+        start = time.monotonic()
+        self.assertEqual(self.transport.read(64, timeout=50), b'')
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_write(self):
+        self.transport.write(usb_report(b'\x58'))
+        self.assertEqual(os.read(self.master, 64), usb_report(b'\x58'))
+
+    def test_driver_reads_message(self):
+        message = bytes(range(100))
+        os.write(self.master, usb_report(message[:60]))
+
+        mt = Medtronic600SeriesDriver()
+        mt.openDevice(self.transport)
+        try:
+            time.sleep(0.05)
+            os.write(self.master, usb_report(message[60:]))
+            self.assertEqual(mt.readMessage(timeout_ms=1000), bytearray(message))
+            with self.assertRaises(TimeoutException):
+                mt.readMessage(timeout_ms=200)
+        finally:
+            mt.closeDevice()
+
+
+class TestHidrawDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+        self.add_device('hidraw0', '0003:0000046D:0000C52B', 'Logitech USB Receiver', '')
+        self.add_device('hidraw1', '0003:00001A79:00006210', 'Bayer HealthCare LLC. Contour Next Link 2.4',
+                        '1234567')
+        self.sysfs_hidraw = HidrawTransport.SYSFS_HIDRAW
+        HidrawTransport.SYSFS_HIDRAW = self.sysfs
+
+    def tearDown(self):
+        HidrawTransport.SYSFS_HIDRAW = self.sysfs_hidraw
+        shutil.rmtree(self.sysfs)
+
+    def add_device(self, name, hid_id, hid_name, hid_uniq):
+        os.makedirs(os.path.join(self.sysfs, name, 'device'))
+        with open(os.path.join(self.sysfs, name, 'device', 'uevent'), 'w') as uevent:
+            uevent.write("DRIVER=hid-generic\nHID_ID={0}\nHID_NAME={1}\nHID_UNIQ={2}\n".format(hid_id, hid_name,
+                                                                                               hid_uniq))
+
+    def test_find_contour_next_link(self):
+        path, info = HidrawTransport.find(0x1A79, 0x6210)
+        self.assertEqual(path, '/dev/hidraw1')
+        self.assertEqual(info["HID_UNIQ"], '1234567')
+
+    def test_find_missing_device(self):
+        with self.assertRaises(IOError):
+            HidrawTransport.find(0x1A79, 0x6211)
+
+
+if __name__ == '__main__':
+    unittest.main()
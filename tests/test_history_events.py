@@ -0,0 +1,269 @@
+import datetime
+import struct
+import unittest
+
+from helpers import DateTimeHelper
+from pump_history_parser import AlarmClearedEvent, BolusWizardEstimateEvent, EventField, EventLayout, \
+    HistoryEventIndex, HistoryEventWindow, NGPConstants, NGPHistoryEvent, NormalBolusDeliveredEvent, NormalBolusProgrammedEvent, \
+    SensorGlucoseReading, SensorGlucoseReadingsEvent, numpy
+from read_minimed_next24 import Medtronic600SeriesDriver
+
+
+def event_data(eventType, size=0x1A):
+    return bytes([eventType, 0x01, size]) + bytes(size - 3)
+
+
+class TestEventDispatch(unittest.TestCase):
+
+    def test_registered_class(self):
+        event = NGPHistoryEvent.fromEventData(event_data(NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED))
+        self.assertIs(type(event), NormalBolusDeliveredEvent)
+        self.assertIs(event.eventInstance(), event)
+        self.assertIs(type(NGPHistoryEvent(event_data(NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED)).eventInstance()),
+                      AlarmClearedEvent)
+
+    def test_type_without_decoder(self):
+        event = NGPHistoryEvent.fromEventData(event_data(NGPHistoryEvent.EVENT_TYPE.REWIND))
+        self.assertIs(type(event), NGPHistoryEvent)
+        self.assertEqual(list(event.allNestedEvents()), [event])
+
+    def test_subclass_registers_itself(self):
+        class RewindEvent(NGPHistoryEvent):
+            EVENT_TYPES = (NGPHistoryEvent.EVENT_TYPE.REWIND,)
+
+        self.addCleanup(NGPHistoryEvent._eventClasses.pop, NGPHistoryEvent.EVENT_TYPE.REWIND)
+        self.assertIs(type(NGPHistoryEvent.fromEventData(event_data(NGPHistoryEvent.EVENT_TYPE.REWIND))),
+                      RewindEvent)
+
+
+class TestEventLayout(unittest.TestCase):
+
+    def test_overlapping_fields(self):
+        layout = EventLayout({
+            'flag': EventField(0x03, 'I', convert=lambda value: (value & 0x01) == 0x01),
+            'first': EventField(0x00, 'B'),
+            'amount': EventField(0x04, 'I', scale=10000.0),
+            'bytes': EventField(0x08, '2B', convert=lambda b0, b1: b0 + b1),
+        })
+        data = bytes([0x07, 0x00, 0x00, 0x00]) + struct.pack('>I', 25000) + bytes([0x01, 0x02])
+
+        self.assertEqual(layout.decode(data), {'flag': True, 'first': 0x07, 'amount': 2.5, 'bytes': 3})
+        self.assertEqual(len(layout._structs), 2)
+
+    def test_fields_in_units(self):
+        data = bytearray(event_data(NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE, size=0x35))
+        struct.pack_into('>BBHH', data, 0x0B, NGPConstants.BG_UNITS.MMOL_L, NGPConstants.CARB_UNITS.GRAMS, 55, 42)
+        struct.pack_into('>BI', data, 0x30, 0x01, 15000)
+        event = NGPHistoryEvent.fromEventData(bytes(data))
+
+        self.assertIsInstance(event, BolusWizardEstimateEvent)
+        self.assertEqual((event.bgInput, event.carbInput), (5.5, 42))
+        self.assertEqual((event.estimateModifiedByUser, event.finalEstimate), (False, 1.5))
+        self.assertEqual((event.eventType, event.source, event.size), (0x3D, 0x01, 0x35))
+        self.assertIn('finalEstimate', vars(event))
+
+    def test_event_defined_by_fields(self):
+        RewindEvent = NGPHistoryEvent.defineEvent('RewindEvent', [NGPHistoryEvent.EVENT_TYPE.REWIND],
+                                                  {'volume': EventField(0x0B, 'H', scale=100.0)})
+        self.addCleanup(NGPHistoryEvent._eventClasses.pop, NGPHistoryEvent.EVENT_TYPE.REWIND)
+        data = bytearray(event_data(NGPHistoryEvent.EVENT_TYPE.REWIND))
+        struct.pack_into('>H', data, 0x0B, 250)
+        event = NGPHistoryEvent.fromEventData(bytes(data))
+
+        self.assertIs(type(event), RewindEvent)
+        self.assertEqual(event.volume, 2.5)
+
+
+class TestHistoryEventIndex(unittest.TestCase):
+
+    def event(self, eventClass, eventType, minutes, **fields):
+        event = eventClass(event_data(eventType, size=0x40))
+        # Shadow the decoded fields
+        event.timestamp = datetime.datetime(2017, 8, 27, 12, 0) + datetime.timedelta(minutes=minutes)
+        vars(event).update(fields)
+        return event
+
+    def test_links_within_window(self):
+        programmed = [self.event(NormalBolusProgrammedEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED,
+                                 minutes, bolusNumber=number) for minutes, number in ((-5, 8), (0, 7), (3, 8))]
+        delivered = self.event(NormalBolusDeliveredEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED, 4,
+                               bolusNumber=8)
+        late = self.event(NormalBolusDeliveredEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED, 8,
+                          bolusNumber=8)
+        historyIndex = HistoryEventIndex(programmed + [delivered, late])
+
+        for event in historyIndex:
+            event.postProcess(historyIndex)
+
+        self.assertIs(delivered.programmedEvent, programmed[2])
+        # Exactly 5 minutes apart is too late
+        self.assertIsNone(late.programmedEvent)
+        # Neither the event itself nor later ones in the history
+        self.assertEqual(historyIndex.before(NormalBolusProgrammedEvent, programmed[2],
+                                             datetime.timedelta(minutes=10), 'bolusNumber', 8), [programmed[0]])
+        self.assertEqual(historyIndex.before(NormalBolusProgrammedEvent, programmed[0],
+                                             datetime.timedelta(minutes=10), 'bolusNumber', 8), [])
+
+    def test_links_within_same_second(self):
+        # The boluses of 2017-08-15 in testdata/paulokow_20170827_sample.dat
+        def at(time, eventClass, eventType, **fields):
+            timestamp = datetime.datetime.combine(datetime.date(2017, 8, 15), datetime.time.fromisoformat(time))
+            return self.event(eventClass, eventType, 0, timestamp=timestamp, **fields)
+
+        def history():
+            estimate, programmed, delivered = (
+                (BolusWizardEstimateEvent, NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE),
+                (NormalBolusProgrammedEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED),
+                (NormalBolusDeliveredEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED))
+            return [at('16:31:07', *estimate, finalEstimate=0.6),
+                    at('16:31:08', *programmed, programmedAmount=0.6, bolusNumber=89),
+                    at('16:31:34', *delivered, bolusNumber=89),
+                    at('16:31:54', *estimate, finalEstimate=0.6),
+                    at('16:31:54', *programmed, programmedAmount=0.6, bolusNumber=90),
+                    at('16:32:20', *delivered, bolusNumber=90),
+                    at('20:23:28', *estimate, finalEstimate=2.0),
+                    at('20:23:28', *programmed, programmedAmount=2.0, bolusNumber=92),
+                    at('20:24:50', *delivered, bolusNumber=92)]
+
+        indexed = history()
+        historyIndex = HistoryEventIndex(indexed)
+        for event in historyIndex:
+            event.postProcess(historyIndex)
+        streamed = list(HistoryEventWindow().link(iter(history())))
+
+        for events in (indexed, streamed):
+            for i in range(0, len(events), 3):
+                estimate, programmed, delivered = events[i:i + 3]
+                self.assertIs(programmed.bolusWizardEvent, estimate)
+                self.assertTrue(estimate.programmed)
+                self.assertIs(delivered.programmedEvent, programmed)
+
+    def test_wizard_estimate_by_amount(self):
+        estimates = [self.event(BolusWizardEstimateEvent, NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE, minutes,
+                                finalEstimate=amount) for minutes, amount in ((0, 1.5), (1, 2.5))]
+        programmed = self.event(NormalBolusProgrammedEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED, 2,
+                                programmedAmount=2.5)
+
+        programmed.postProcess(HistoryEventIndex(estimates + [programmed]))
+
+        self.assertIs(programmed.bolusWizardEvent, estimates[1])
+        self.assertTrue(estimates[1].programmed)
+        self.assertFalse(estimates[0].programmed)
+
+    def test_stream_linked_in_window(self):
+        estimate = self.event(BolusWizardEstimateEvent, NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE, 0,
+                              finalEstimate=2.5)
+        programmed = self.event(NormalBolusProgrammedEvent, NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED, 2,
+                                programmedAmount=2.5)
+        later = [self.event(NGPHistoryEvent, NGPHistoryEvent.EVENT_TYPE.REWIND, minutes) for minutes in range(3, 60)]
+        window = HistoryEventWindow(datetime.timedelta(minutes=10))
+
+        stream = window.link(iter([estimate, programmed] + later))
+
+        # Yielded once no later event can link to it anymore
+        self.assertIs(next(stream), estimate)
+        self.assertTrue(estimate.programmed)
+        self.assertEqual(window.newest, later[7].timestamp)
+        self.assertEqual(list(stream), [programmed] + later)
+        self.assertEqual(len(window), 11)
+
+    def test_stream_starts_over(self):
+        events = [self.event(NGPHistoryEvent, NGPHistoryEvent.EVENT_TYPE.REWIND, minutes) for minutes in (30, 31, 0)]
+        window = HistoryEventWindow(datetime.timedelta(minutes=10))
+
+        stream = window.link(iter(events))
+
+        # The events before are yielded as soon as the next one starts over
+        self.assertEqual([next(stream), next(stream)], events[:2])
+        self.assertEqual(list(stream), [events[2]])
+        self.assertEqual(list(window), [events[2]])
+
+
+class TestEventFilter(unittest.TestCase):
+
+    def setUp(self):
+        offset = -0x5A3D7B6
+        self.start = datetime.datetime(2017, 12, 21, 12, 0)
+        events = []
+        for minutes, eventType in ((0, NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION),
+                                   (10, NGPHistoryEvent.EVENT_TYPE.REWIND),
+                                   (20, NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED),
+                                   (30, NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION)):
+            data = bytearray(event_data(eventType))
+            rtc = DateTimeHelper.rtcFromDate(self.start + datetime.timedelta(minutes=minutes), offset)
+            struct.pack_into('>II', data, 0x03, rtc, offset & 0xffffffff)
+            events.append(bytes(data))
+        self.pages = [b''.join(events[:2]), b''.join(events[2:])]
+        self.driver = Medtronic600SeriesDriver()
+
+    def decoded(self, *args):
+        return [(event.eventType, event.timestamp.replace(tzinfo=None))
+                for event in self.driver.decodeEvents(self.pages, None, *args)]
+
+    def test_event_types(self):
+        self.assertEqual([eventType for eventType, _ in self.decoded({NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED,
+                                                                      NGPHistoryEvent.EVENT_TYPE.REWIND})],
+                         [NGPHistoryEvent.EVENT_TYPE.REWIND, NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED])
+
+    def test_time_window(self):
+        self.assertEqual(self.decoded(None, self.start + datetime.timedelta(minutes=10),
+                                      self.start + datetime.timedelta(minutes=20)),
+                         [(NGPHistoryEvent.EVENT_TYPE.REWIND, self.start + datetime.timedelta(minutes=10)),
+                          (NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED, self.start + datetime.timedelta(minutes=20))])
+        self.assertEqual(self.decoded({NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION},
+                                      self.start + datetime.timedelta(minutes=5)),
+                         [(NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION, self.start + datetime.timedelta(minutes=30))])
+
+
+def sensor_readings_data(readings, minutesBetweenReadings=5, predictedSg=120):
+    data = bytearray(event_data(NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED,
+                                size=0x0F + 9 * len(readings)))
+    struct.pack_into('>QBBH', data, 0x03, 0x9A0B0C0D0FFFF000, minutesBetweenReadings, len(readings), predictedSg)
+    # Newest reading first
+    for i, reading in enumerate(reversed(readings)):
+        struct.pack_into('>BBHBhBB', data, 0x0F + 9 * i, *reading)
+    return bytes(data)
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestSensorReadings(unittest.TestCase):
+
+    def test_readings(self):
+        event = NGPHistoryEvent.fromEventData(sensor_readings_data([
+            (0x00, 95, 2150, 0x10, -25, 0, 0x01),
+            (0x0D, 0x2C, 2200, 0xFF, 130, 2, 0x02),
+        ]))
+        readings = event.readings()
+
+        self.assertEqual(readings['sg'].tolist(), [95, 0x12C])
+        self.assertEqual(readings['isig'].tolist(), [21.5, 22.0])
+        self.assertEqual(readings['vctr'].tolist(), [0.16, 0xFFFFFFFF / 100.0])
+        self.assertEqual(readings['rateOfChange'].tolist(), [-0.25, 1.3])
+        self.assertEqual(readings['backfilledData'].tolist(), [True, False])
+        self.assertEqual(readings['discardData'].tolist(), [False, True])
+        self.assertEqual(readings['predictedSg'].tolist(), [120, 120])
+        self.assertEqual((readings['timestamp'][1] - readings['timestamp'][0]).item().total_seconds(), 300)
+
+    def test_readings_as_events(self):
+        events = [NGPHistoryEvent.fromEventData(sensor_readings_data([(0x00, 95, 2150, 0x10, -25, 0, 0x01)])),
+                  NGPHistoryEvent.fromEventData(sensor_readings_data([(0x00, 101, 2150, 0x00, 40, 1, 0x00),
+                                                                      (0x00, 104, 2140, 0x00, 60, 1, 0x00)],
+                                                                     minutesBetweenReadings=2)),
+                  # no reading and a sensor error code (769) in between
+                  NGPHistoryEvent.fromEventData(sensor_readings_data([(0x00, 0, 0, 0x00, 0, 2, 0x00),
+                                                                      (0x03, 0x01, 0, 0x00, 0, 3, 0x00),
+                                                                      (0x00, 110, 2160, 0x00, 20, 0, 0x00)]))]
+        readings = SensorGlucoseReadingsEvent.readingsOf(events)
+        expected = [reading for event in events for reading in event.allNestedEvents()]
+
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(len(readings), 4)
+        decoded = SensorGlucoseReading.fromReadings(readings, expected[0].timestamp.tzinfo)
+        self.assertEqual([(reading.timestamp, reading.sg, reading.vctr, reading.rateOfChange, reading.noisyData)
+                          for reading in decoded],
+                         [(reading.timestamp, reading.sg, reading.vctr, reading.rateOfChange, reading.noisyData)
+                          for reading in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
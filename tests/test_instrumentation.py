@@ -0,0 +1,86 @@
+import unittest
+
+from instrumentation import Instrumentation, RollingHistogram
+
+
+class Driver(object):
+    def __init__(self):
+        self.device = None
+
+    def negotiateChannel(self):
+        return 0x14
+
+    def beginEHSM(self):
+        raise RuntimeError("no pump")
+
+
+class TestRollingHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = RollingHistogram()
+        for duration in range(1, 101):
+            histogram.add(duration / 1000.0)
+
+        self.assertEqual(histogram.percentile(50), 0.05)
+        self.assertEqual(histogram.percentile(99), 0.099)
+        self.assertEqual(histogram.maximum, 0.1)
+
+    def test_window(self):
+        histogram = RollingHistogram(window=2)
+        for duration in (40.0, 0.005, 0.2):
+            histogram.add(duration)
+
+        self.assertEqual(len(histogram), 2)
+        self.assertEqual(histogram.maximum, 0.2)
+        buckets = histogram.buckets()
+        self.assertEqual(buckets[10], 1)
+        self.assertEqual(buckets[250], 1)
+        self.assertEqual(buckets[None], 0)
+
+    def test_empty(self):
+        self.assertEqual(RollingHistogram().percentile(90), 0.0)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_nested_spans(self):
+        instrumentation = Instrumentation()
+        instrumentation.start_cycle()
+        with instrumentation.span("_open_connection"):
+            with instrumentation.span("negotiateChannel"):
+                pass
+        summary = instrumentation.finish_cycle()
+
+        self.assertEqual([(span.name, span.depth) for span in summary.spans],
+                         [("_open_connection", 0), ("negotiateChannel", 1)])
+        self.assertGreaterEqual(summary.spans[0].duration, summary.spans[1].duration)
+        self.assertIs(instrumentation.last_cycle, summary)
+        self.assertEqual(len(instrumentation.histogram(Instrumentation.CYCLE)), 1)
+
+    def test_counters_per_cycle(self):
+        instrumentation = Instrumentation()
+        instrumentation.count("retries")
+        instrumentation.start_cycle()
+        instrumentation.count("retries")
+        instrumentation.count("usb_bytes_read", 64)
+        instrumentation.count("usb_bytes_read", 64)
+
+        self.assertEqual(instrumentation.finish_cycle().counters, {"retries": 1, "usb_bytes_read": 128})
+
+    def test_wrapped_driver(self):
+        instrumentation = Instrumentation()
+        driver = instrumentation.wrap(Driver())
+        instrumentation.start_cycle()
+
+        self.assertEqual(driver.negotiateChannel(), 0x14)
+        with self.assertRaises(RuntimeError):
+            driver.beginEHSM()
+        self.assertIsNone(driver.device)
+        summary = instrumentation.finish_cycle()
+
+        self.assertEqual([(span.name, span.failed) for span in summary.spans],
+                         [("negotiateChannel", False), ("beginEHSM", True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import struct
+import tempfile
+import time
+import unittest
+
+from read_minimed_next24 import Medtronic600SeriesDriver, TimeoutException, BayerBinaryMessage, MedtronicSession, \
+    UsbFrameReader
+from usb_transport import Transport, RecordingTransport, ReplayTransport, ReplayError
+
+
+class QueueTransport(Transport):
+    def __init__(self, reports):
+        self.reports = list(reports)
+        self.written = []
+
+    def open(self):
+        pass
+
+    def read(self, size, timeout=None):
+        if not self.reports:
+            time.sleep((timeout or 0) / 1000.0)
+            return b''
+        return self.reports.pop(0)
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class FailingTransport(QueueTransport):
+    def __init__(self):
+        QueueTransport.__init__(self, [])
+        self.reads = 0
+
+    def read(self, size, timeout=None):
+        self.reads += 1
+        raise OSError(19, "No such device")
+
+
+def usb_report(payload):
+    return (struct.pack('>3sB', b'ABC', len(payload)) + payload).ljust(64, b'\x00')
+
+
+def bayer_report(operation, payload):
+    message = BayerBinaryMessage(operation, MedtronicSession(), payload).encode()
+    return usb_report(message)
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_incomplete_transport_fails_on_creation(self):
+        class ReadOnlyTransport(Transport):
+            def open(self):
+                pass
+
+            def read(self, size, timeout=None):
+                return b''
+
+            def close(self):
+                pass
+
+        with self.assertRaises(TypeError):
+            ReadOnlyTransport()
+
+
+class TestRecordReplay(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def record(self, reports, operations):
+        transport = RecordingTransport(QueueTransport(reports), self.path)
+        transport.open()
+        operations(transport)
+        transport.close()
+
+    def test_replay_returns_recorded_reports(self):
+        def operations(transport):
+            transport.write(usb_report(b'\x58'))
+            transport.read(64, timeout=10)
+            transport.read(64, timeout=10)
+
+        self.record([usb_report(b'\x06')], operations)
+
+        replay = ReplayTransport(self.path, strict=True)
+        replay.open()
+        replay.write(usb_report(b'\x58'))
+        self.assertEqual(replay.read(64, timeout=10), usb_report(b'\x06'))
+        self.assertEqual(replay.read(64, timeout=10), b'')
+        self.assertTrue(replay.finished)
+        # reading past the capture behaves like a timeout
+        self.assertEqual(replay.read(64, timeout=10), b'')
+
+    def test_replay_strict_write_mismatch(self):
+        self.record([], lambda transport: transport.write(usb_report(b'\x58')))
+
+        replay = ReplayTransport(self.path, strict=True)
+        replay.open()
+        with self.assertRaises(ReplayError):
+            replay.write(usb_report(b'\x15'))
+
+    def test_replay_skips_recorded_timeouts_on_write(self):
+        def operations(transport):
+            transport.read(64, timeout=50)
+            transport.write(usb_report(b'\x15'))
+
+        self.record([], operations)
+
+        replay = ReplayTransport(self.path, strict=True)
+        replay.open()
+        replay.write(usb_report(b'\x15'))
+        self.assertTrue(replay.finished)
+
+    def test_driver_reads_multi_report_message_from_replay(self):
+        message = bytes(range(100))
+
+        def operations(transport):
+            transport.read(64, timeout=10)
+            transport.read(64, timeout=10)
+
+        self.record([usb_report(message[:60]), usb_report(message[60:])], operations)
+
+        mt = Medtronic600SeriesDriver(ReplayTransport(self.path))
+        mt.openDevice()
+        self.assertEqual(mt.readMessage(), bytearray(message))
+        with self.assertRaises(TimeoutException):
+            mt.readMessage(timeout_ms=200)
+        mt.closeDevice()
+
+
+class TestUsbFrameReader(unittest.TestCase):
+
+    def wait_for_frames(self, reader, count):
+        for _ in range(100):
+            if reader.frames.qsize() + reader.resendCount >= count:
+                return
+            time.sleep(0.01)
+
+    def test_discard_pending_drops_strays(self):
+        reader = UsbFrameReader(QueueTransport([usb_report(b'\x06'), usb_report(b'\x04')]))
+        reader.start()
+        try:
+            self.wait_for_frames(reader, 2)
+            self.assertEqual(reader.discardPending(), 2)
+            self.assertEqual(reader.strayCount, 2)
+            with self.assertRaises(TimeoutException):
+                reader.getFrame(50)
+        finally:
+            reader.stop()
+
+    def test_resent_response_is_dropped(self):
+        response = bayer_report(0x80, b'\x55\x01')
+        transport = QueueTransport([response, response, bayer_report(0x80, b'\x55\x02')])
+        reader = UsbFrameReader(transport)
+        reader.start()
+        try:
+            self.assertEqual(bytes(reader.getFrame(1000)[0x21:]), b'\x55\x01')
+            self.assertEqual(bytes(reader.getFrame(1000)[0x21:]), b'\x55\x02')
+            self.assertEqual(reader.resendCount, 1)
+        finally:
+            reader.stop()
+
+    def test_invalid_report_raised_in_order(self):
+        reader = UsbFrameReader(QueueTransport([usb_report(b'\x06'), b'XYZ'.ljust(64, b'\x00')]))
+        reader.start()
+        try:
+            self.assertEqual(reader.getFrame(1000), bytearray(b'\x06'))
+            with self.assertRaises(RuntimeError):
+                reader.getFrame(1000)
+        finally:
+            reader.stop()
+
+
+    def test_transport_error_stops_reader(self):
+        transport = FailingTransport()
+        reader = UsbFrameReader(transport)
+        reader.start()
+        try:
+            reader._thread.join(1)
+            self.assertFalse(reader.running)
+            self.assertEqual(transport.reads, 1)
+            # the error is not dropped with the strays, and raised by every read
+            self.assertEqual(reader.discardPending(), 0)
+            for _ in range(2):
+                with self.assertRaises(OSError):
+                    reader.getFrame(1000)
+        finally:
+            reader.stop()
+
+    def test_transport_error_reaches_driver(self):
+        mt = Medtronic600SeriesDriver(transport=FailingTransport())
+        mt.openDevice()
+        try:
+            with self.assertRaises(OSError):
+                mt.readMessage()
+            self.assertFalse(mt.reader.running)
+        finally:
+            mt.closeDevice()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+from .transport import Transport
+from .hid_transport import HidTransport
+from .hidraw_transport import HidrawTransport
+from .record_replay import RecordingTransport, ReplayTransport, ReplayError
+
+__all__ = ["Transport", "HidTransport", "HidrawTransport", "RecordingTransport", "ReplayTransport", "ReplayError"]
@@ -0,0 +1,39 @@
+from usb_transport.transport import Transport
+
+
+class HidTransport(Transport):
+    """Transport backed by the hidapi ctypes binding.
+
+    hid is only imported when the device is opened, so other transports work
+    without libhidapi installed.
+    """
+
+    def __init__(self, vid, pid):
+        self._vid = vid
+        self._pid = pid
+        self._device = None
+
+    @property
+    def manufacturer(self):
+        return self._device.manufacturer
+
+    @property
+    def product(self):
+        return self._device.product
+
+    @property
+    def serial(self):
+        return self._device.serial
+
+    def open(self):
+        import hid
+        self._device = hid.Device(self._vid, self._pid)
+
+    def read(self, size, timeout=None):
+        return self._device.read(size, timeout=timeout)
+
+    def write(self, data):
+        return self._device.write(data)
+
+    def close(self):
+        self._device.close()
@@ -0,0 +1,108 @@
+import os
+import select
+import time
+
+from usb_transport.transport import Transport
+
+
+class HidrawTransport(Transport):
+    """Transport talking to /dev/hidrawN directly, Linux only.
+
+    The device is opened non-blocking and reads sleep in epoll (select where
+    epoll is missing) until a report arrives or the timeout expires, so
+    there is no polling loop and a report is handed over as soon as the
+    kernel has it. Reports are read straight into the caller's buffer.
+    Without a path, the first hidraw device with the given vendor and
+    product id is used.
+    """
+    SYSFS_HIDRAW = '/sys/class/hidraw'
+    DEV = '/dev'
+
+    def __init__(self, vid=None, pid=None, path=None):
+        self._vid = vid
+        self._pid = pid
+        self._path = path
+        self._info = {}
+        self._fd = None
+        self._poller = None
+
+    @property
+    def manufacturer(self):
+        # hidraw only exposes the combined name, e.g. "Bayer HealthCare LLC. Contour Next Link 2.4"
+        return self._info.get("HID_NAME")
+
+    @property
+    def product(self):
+        return self._info.get("HID_NAME")
+
+    @property
+    def serial(self):
+        return self._info.get("HID_UNIQ")
+
+    @classmethod
+    def find(cls, vid, pid):
+        """Return the device path and uevent entries of the first matching hidraw device"""
+        hid_id = "{0:08X}:{1:08X}".format(vid, pid)
+        for name in sorted(os.listdir(cls.SYSFS_HIDRAW)):
+            info = cls._read_uevent(os.path.join(cls.SYSFS_HIDRAW, name, 'device', 'uevent'))
+            # HID_ID is bus:vendor:product, e.g. 0003:00001A79:00006210
+            if info.get("HID_ID", "").upper().endswith(hid_id):
+                return os.path.join(cls.DEV, name), info
+        raise IOError("No hidraw device found for {0:04x}:{1:04x}".format(vid, pid))
+
+    @staticmethod
+    def _read_uevent(path):
+        info = {}
+        try:
+            with open(path) as uevent:
+                for line in uevent:
+                    key, _, value = line.strip().partition('=')
+                    info[key] = value
+        except IOError:
+            pass
+        return info
+
+    def open(self):
+        if self._path is None:
+            self._path, self._info = self.find(self._vid, self._pid)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_NONBLOCK)
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll(1)
+            self._poller.register(self._fd, select.EPOLLIN)
+
+    def _wait_readable(self, timeout):
+        if self._poller is not None:
+            return bool(self._poller.poll(-1 if timeout is None else timeout))
+        return bool(select.select([self._fd], [], [], timeout)[0])
+
+    def readinto(self, buffer, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000.0
+        while True:
+            try:
+                return os.readv(self._fd, [buffer])
+            except BlockingIOError:
+                pass
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return 0
+            self._wait_readable(remaining)
+
+    def read(self, size, timeout=None):
+        buffer = bytearray(size)
+        return bytes(buffer[:self.readinto(buffer, timeout=timeout)])
+
+    def write(self, data):
+        while True:
+            try:
+                return os.write(self._fd, data)
+            except BlockingIOError:
+                select.select([], [self._fd], [])
+
+    def close(self):
+        if self._poller is not None:
+            self._poller.close()
+            self._poller = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
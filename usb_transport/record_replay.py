@@ -0,0 +1,173 @@
+import binascii
+import json
+import logging
+import threading
+import time
+
+from usb_transport.transport import Transport
+
+logger = logging.getLogger('app')
+
+
+class ReplayError(Exception):
+    pass
+
+
+class RecordingTransport(Transport):
+    """Wraps another transport and writes every report to a capture file.
+
+    The capture is a JSON lines file. Each line holds the operation ("open",
+    "read" or "write"), the time since open in seconds, the time the call
+    blocked and the report as hex. A read with empty data is a timeout.
+    """
+
+    def __init__(self, transport, path):
+        self._transport = transport
+        self._path = path
+        self._file = None
+        self._start = None
+        # Reads come from the driver's reader thread, writes from the driver itself
+        self._lock = threading.Lock()
+
+    @property
+    def manufacturer(self):
+        return self._transport.manufacturer
+
+    @property
+    def product(self):
+        return self._transport.product
+
+    @property
+    def serial(self):
+        return self._transport.serial
+
+    def _record(self, op, started, data=b'', **extra):
+        now = time.monotonic()
+        entry = {
+            "op": op,
+            "t": round(started - self._start, 6),
+            "duration": round(now - started, 6),
+            "data": binascii.hexlify(bytes(data)).decode('ascii'),
+        }
+        entry.update(extra)
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+
+    def open(self):
+        self._transport.open()
+        self._file = open(self._path, 'w')
+        self._start = time.monotonic()
+        self._record("open", self._start,
+                     manufacturer=self.manufacturer, product=self.product, serial=self.serial)
+
+    def read(self, size, timeout=None):
+        started = time.monotonic()
+        data = self._transport.read(size, timeout=timeout)
+        self._record("read", started, data, timeout=timeout)
+        return data
+
+    def write(self, data):
+        started = time.monotonic()
+        result = self._transport.write(data)
+        self._record("write", started, data)
+        return result
+
+    def close(self):
+        try:
+            self._transport.close()
+        finally:
+            with self._lock:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+
+
+class ReplayTransport(Transport):
+    """Feeds a capture made by RecordingTransport back to the driver.
+
+    Replay is deterministic and runs at full speed unless realtime is set, in
+    which case every read blocks as long as it did while recording. A read
+    waits for the driver's next write when the capture expects one, and reads
+    past the recorded ones time out. Recorded timeouts are skipped when the
+    driver writes, so captures stay usable when the amount of polling changes.
+    With strict set, written reports must match the capture exactly.
+    """
+
+    def __init__(self, path, realtime=False, strict=False):
+        self._realtime = realtime
+        self._strict = strict
+        self._header = {}
+        self._records = []
+        self._pos = 0
+        self._condition = threading.Condition()
+
+        with open(path) as capture:
+            for line in capture:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["op"] == "open":
+                    self._header = record
+                else:
+                    record["data"] = binascii.unhexlify(record["data"])
+                    self._records.append(record)
+
+    @property
+    def manufacturer(self):
+        return self._header.get("manufacturer")
+
+    @property
+    def product(self):
+        return self._header.get("product")
+
+    @property
+    def serial(self):
+        return self._header.get("serial")
+
+    @property
+    def finished(self):
+        return self._pos >= len(self._records)
+
+    def open(self):
+        self._pos = 0
+
+    def _next(self):
+        if self.finished:
+            return None
+        return self._records[self._pos]
+
+    def read(self, size, timeout=None):
+        with self._condition:
+            record = self._next()
+            if record is None or record["op"] != "read":
+                # Nothing to read before the driver's next write: behave like an idle device
+                self._condition.wait(None if timeout is None else timeout / 1000.0)
+                record = self._next()
+                if record is None or record["op"] != "read":
+                    return b''
+
+            self._pos += 1
+        if self._realtime:
+            time.sleep(record["duration"])
+        return record["data"][:size]
+
+    def write(self, data):
+        with self._condition:
+            record = self._next()
+            while record is not None and record["op"] == "read" and not record["data"]:
+                self._pos += 1
+                record = self._next()
+
+            if record is None or record["op"] != "write":
+                logger.error("ReplayTransport: unexpected write at record {0}".format(self._pos))
+                raise ReplayError("Unexpected write at record {0}".format(self._pos))
+            if self._strict and bytes(data) != record["data"]:
+                raise ReplayError("Written report differs from capture at record {0}".format(self._pos))
+
+            self._pos += 1
+            self._condition.notify_all()
+        return len(data)
+
+    def close(self):
+        with self._condition:
+            self._condition.notify_all()
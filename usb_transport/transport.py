@@ -0,0 +1,48 @@
+import abc
+
+
+class Transport(abc.ABC):
+    """Byte level connection to the Contour Next Link.
+
+    The interface mirrors hid.Device: reports are read and written as whole
+    USB blocks and read returns an empty bytes object when the timeout expires.
+    readinto fills a caller supplied buffer instead; backends that can read
+    into memory directly override it. open, read, write and close are
+    abstract, so an incomplete backend fails when it is created rather than
+    in the reader thread.
+    """
+
+    @property
+    def manufacturer(self):
+        return None
+
+    @property
+    def product(self):
+        return None
+
+    @property
+    def serial(self):
+        return None
+
+    @abc.abstractmethod
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def read(self, size, timeout=None):
+        pass
+
+    def readinto(self, buffer, timeout=None):
+        """Read one report into buffer and return its size, 0 on timeout"""
+        data = self.read(len(buffer), timeout=timeout)
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+    @abc.abstractmethod
+    def write(self, data):
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass